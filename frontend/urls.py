@@ -1,27 +1,82 @@
+import datetime
+import hashlib
+import json
+
+from django.http import StreamingHttpResponse
 from django.urls import path
 
 from pros_core.setup_app import PROS_MODELS, PROS_VIEWSET_MAP, AppModel
 
 from rest_framework import viewsets
-from rest_framework.decorators import api_view
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.response import Response
+from pros_core.conditional import build_etag, conditional_headers, is_not_modified
 from pros_core.models import ProsNode
+from pros_core.renderers import ComplexEncoder
 
 
 from pros_core.viewsets import (
     generic_viewset_factory,
     ProsAbstractViewSet,
+    stream_bulk_lists,
+    get_items_batch,
+    ITEM_BATCH_SIZE_MAX,
+    ITEM_CACHE,
+)
+from pros_core.bulk_upsert import (
+    bulk_upsert,
+    BULK_UPSERT_CHUNK_SIZE,
+    BULK_UPSERT_CHUNK_SIZE_MAX,
 )
+from pros_core.metrics import METRICS
+from pros_core.streaming import STREAM_CONTENT_TYPES, NDJSON, stream_ndjson
 
 from icecream import ic
 
 urlpatterns = []
 
 
+def bulk_upsert_view_factory(model):
+    @api_view(["POST"])
+    @permission_classes([IsAuthenticated])
+    def bulk_upsert_view(request):
+        """Create or update entities from an NDJSON body (one entity per line),
+        streaming back a {"line", "status", "uid", ...} result line per entity"""
+        try:
+            chunk_size = int(
+                request.query_params.get("chunk_size", BULK_UPSERT_CHUNK_SIZE)
+            )
+        except ValueError:
+            return Response({"detail": "chunk_size must be an integer"}, status=400)
+        if not 0 < chunk_size <= BULK_UPSERT_CHUNK_SIZE_MAX:
+            return Response(
+                {"detail": f"chunk_size must be between 1 and {BULK_UPSERT_CHUNK_SIZE_MAX}"},
+                status=400,
+            )
+        return StreamingHttpResponse(
+            stream_ndjson(
+                bulk_upsert(
+                    model.model,
+                    request.body.decode().splitlines(),
+                    request.user.username,
+                    chunk_size,
+                ),
+                chunk_rows=1,
+            ),
+            content_type=STREAM_CONTENT_TYPES[NDJSON],
+        )
+
+    return bulk_upsert_view
+
+
 def build_url_patterns(model, vs):
     patterns = [
         path(f"{model.app}/{model.model_name.lower()}/", vs.as_view({"get": "list"})),
+        path(
+            f"{model.app}/{model.model_name.lower()}/autocomplete/",
+            vs.as_view({"get": "autocomplete"}),
+        ),
     ]
     if not model.meta.get("abstract"):
         patterns += [
@@ -29,14 +84,26 @@ def build_url_patterns(model, vs):
                 f"{model.app}/{model.model_name.lower()}/<str:pk>",
                 vs.as_view({"get": "retrieve", "put": "update"}),
             ),
+            path(
+                f"{model.app}/{model.model_name.lower()}/<str:pk>/relations/<str:relation>/",
+                vs.as_view({"get": "relations"}),
+            ),
             path(
                 f"{model.app}/{model.model_name.lower()}/new/",
                 vs.as_view({"post": "create"}),
             ),
+            path(
+                f"{model.app}/{model.model_name.lower()}/bulk/",
+                bulk_upsert_view_factory(model),
+            ),
             path(
                 f"{model.app}/{model.model_name.lower()}/<str:pk>/",
                 vs.as_view({"delete": "delete"}),
             ),
+            path(
+                f"{model.app}/{model.model_name.lower()}/<str:pk>/merge/<str:other>/",
+                vs.as_view({"post": "merge", "delete": "unmerge"}),
+            ),
         ]
     return patterns
 
@@ -89,13 +156,86 @@ for model_name, model in PROS_MODELS.items():
     urlpatterns += build_url_patterns(model, vs)
 
 
+# The schema only changes with the code, so is built (and versioned) once per process
+SCHEMA = build_schema_from_pros_model(PROS_MODELS, {})
+SCHEMA_ETAG = build_etag(
+    "schema",
+    hashlib.sha1(
+        json.dumps(SCHEMA, sort_keys=True, cls=ComplexEncoder).encode()
+    ).hexdigest(),
+)
+SCHEMA_LAST_MODIFIED = datetime.datetime.now(datetime.timezone.utc)
+
+
 @api_view(["GET"])
 def schema(request):
-    import time
-
-    # time.sleep(20)
-    resp_data = build_schema_from_pros_model(PROS_MODELS, {})
-    return Response(resp_data)
+    headers = conditional_headers(SCHEMA_ETAG, SCHEMA_LAST_MODIFIED)
+    if is_not_modified(request, SCHEMA_ETAG):
+        return Response(status=304, headers=headers)
+    return Response(SCHEMA, headers=headers)
 
 
 urlpatterns.append(path("schema/", schema))
+
+
+@api_view(["GET"])
+def bulk_lists(request):
+    """Full lists of the types given as `?types=a,b,c` (or of all listable types),
+    streamed as NDJSON with one {"type", "seq", "rows"} line per type"""
+    listable = {
+        model_name: model
+        for model_name, model in PROS_MODELS.items()
+        if not model.meta.get("inline_only")
+    }
+    if types := request.query_params.get("types"):
+        model_names = [t.strip().lower() for t in types.split(",") if t.strip()]
+        if unknown := [t for t in model_names if t not in listable]:
+            return Response(
+                {"detail": f"Unknown types: {', '.join(unknown)}"}, status=400
+            )
+    else:
+        model_names = list(listable)
+
+    return StreamingHttpResponse(
+        stream_ndjson(
+            stream_bulk_lists([listable[t].model for t in dict.fromkeys(model_names)]),
+            chunk_rows=1,
+        ),
+        content_type=STREAM_CONTENT_TYPES[NDJSON],
+    )
+
+
+urlpatterns.append(path("lists/", bulk_lists))
+
+
+@api_view(["GET"])
+def batch_items(request):
+    """Items of the uids given as `?uids=a,b,c`, as {"items": {uid: item}, "missing": [uid]}"""
+    uids = list(
+        dict.fromkeys(
+            uid.strip() for uid in request.query_params.get("uids", "").split(",") if uid.strip()
+        )
+    )
+    if not uids:
+        return Response({"detail": "No uids given"}, status=400)
+    if len(uids) > ITEM_BATCH_SIZE_MAX:
+        return Response(
+            {"detail": f"At most {ITEM_BATCH_SIZE_MAX} uids can be retrieved at once"},
+            status=400,
+        )
+    return Response(get_items_batch(uids))
+
+
+urlpatterns.append(path("items/", batch_items))
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    """Counters and timings of this process"""
+    return Response(
+        {**METRICS.snapshot(), "item_cache": ITEM_CACHE.stats()}
+    )
+
+
+urlpatterns.append(path("metrics/", metrics))
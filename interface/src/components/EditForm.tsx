@@ -25,11 +25,23 @@ import TypedInputRow from "./form_components/TypedInputRow";
 import InlineRelationEditField from "./form_components/InlineRelationEditField";
 import RelationEditRow from "./form_components/RelationEditRow";
 
+// Related values are taken in label order, skipping those without a label, as the
+// server does when it computes the label (see pros_core/template_labels.py)
+const by_label = (values: any[]) =>
+  values.every((v) => typeof v === "object")
+    ? values
+        .filter((v) => v?.label)
+        .sort((a, b) => (a.label < b.label ? -1 : a.label > b.label ? 1 : 0))
+    : values;
+
 const nested_get = (
   nested: object | object[] | string[],
   keys: string[] | number[]
 ) => {
   const k = keys.shift();
+  if (nested.constructor === Array) {
+    nested = by_label(nested as any[]);
+  }
   if (keys.length > 0) {
     if (nested.constructor === Array) {
       if (k === "__all__") {
@@ -42,12 +54,12 @@ const nested_get = (
           })
           .join(", ");
       }
-      return nested_get(nested[0][k], keys);
+      return nested_get(nested[0]?.[k], keys);
     }
     return nested_get(nested[k], keys);
   } else {
     if (nested.constructor === Array) {
-      return nested[0][k];
+      return nested[0]?.[k];
     }
 
     return nested[k];
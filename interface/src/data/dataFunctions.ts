@@ -25,9 +25,17 @@ export type RequestParams = {
 };
 
 
+// The list state is stored as the server's change sequence number if it provides
+// one, otherwise as the timestamp of the last request. It must only be set once
+// the rows it describes are stored, or the changes in between are never requested
+function setListSyncState(entityType: string, changeSeq: string | null | undefined) {
+  setDbRequests(entityType, changeSeq ? `seq:${changeSeq}` : new Date().toISOString());
+}
+
 async function storeDataToIndexedDB(
   entityType: string,
-  data: ViewEntityTypeData[]
+  data: ViewEntityTypeData[],
+  changeSeq: string | null = null
 ) {
   db.open();
   const dataToStore = data.map((item) => ({
@@ -35,10 +43,40 @@ async function storeDataToIndexedDB(
     ...item
   }));
   // @ts-ignore
-  db[entityType].bulkPut(dataToStore);
-  const timestamp = new Date();
-  setDbRequests(entityType, timestamp.toISOString());
+  await db[entityType].bulkPut(dataToStore);
+  setListSyncState(entityType, changeSeq);
+}
+
+// Fill the list cache of all the given entity types with one (streamed) request,
+// storing each list as soon as it arrives
+export async function bootstrapListCache(entityTypes: string[]): Promise<void> {
+  if (entityTypes.length === 0) {
+    return;
+  }
+  const response = await fetch(
+    `${BASE_URI}/lists/?types=${entityTypes.join(",")}`,
+    { mode: "cors", credentials: "same-origin", method: "GET" }
+  );
+  if (response.status !== 200 || !response.body) {
+    return;
+  }
 
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { done, value } = await reader.read();
+    buffer += decoder.decode(value, { stream: !done });
+    const lines = buffer.split("\n");
+    buffer = done ? "" : (lines.pop() as string);
+    for (const line of lines.filter((l) => l.trim())) {
+      const { type, seq, rows } = JSON.parse(line);
+      await storeDataToIndexedDB(type, rows, seq.toString());
+    }
+    if (done) {
+      return;
+    }
+  }
 }
 
 async function updateDataInIndexedDB(
@@ -91,11 +129,11 @@ async function getDataAndPatchIndexedDB(uri: string, entityType: string): Promis
       "Content-Type": "application/json",
     },
   };
-  const lastRefreshedTimestamp = dbRequests[entityType];
-  const response = await fetch(
-    `${BASE_URI}/${uri}?lastRefreshedTimestamp=${lastRefreshedTimestamp}`,
-    fetchOptions
-  );
+  const syncState: string = dbRequests[entityType];
+  const syncParams = syncState.startsWith("seq:")
+    ? `since_seq=${syncState.slice(4)}`
+    : `lastRefreshedTimestamp=${syncState}`;
+  const response = await fetch(`${BASE_URI}/${uri}?${syncParams}`, fetchOptions);
 
   // Unauthorised probably means expired token, so we can refresh this
   // an dtry again
@@ -111,8 +149,15 @@ async function getDataAndPatchIndexedDB(uri: string, entityType: string): Promis
     const response_json = await response.json();
     await updateDataInIndexedDB(entityType, response_json.created_modified);
     await deleteDataFromIndexedDB(entityType, response_json.deleted);
-    const timestamp = new Date();
-    setDbRequests(entityType, timestamp.toISOString());
+    setListSyncState(entityType, response_json.seq?.toString());
+    return;
+  }
+  // The changes since our sequence number have been pruned: drop the stored
+  // list so that it is requested in full
+  if (response.status === 410) {
+    // @ts-ignore
+    await db[entityType].clear();
+    setDbRequests(entityType, "");
     return;
   }
 }
@@ -150,6 +195,9 @@ async function dataRequest(
   if (entityTypeForDb && schema[entityTypeForDb]?.meta?.use_list_cache !== false && method === "GET" && dbRequests[entityTypeForDb]) {
     // Do a request to server for updated data... get, and index...
     await getDataAndPatchIndexedDB(url, entityTypeForDb);
+  }
+  // Serve from IndexedDB, unless the patch request dropped the stored list
+  if (entityTypeForDb && schema[entityTypeForDb]?.meta?.use_list_cache !== false && method === "GET" && dbRequests[entityTypeForDb]) {
     await dbReady;
     // @ts-ignore
     const response = await db[entityTypeForDb]
@@ -185,7 +233,11 @@ async function dataRequest(
   if (response.status === 200) {
     const response_json = await response.json();
     if (entityTypeForDb && method === "GET" && schema[entityTypeForDb]?.meta?.use_list_cache !== false) {
-      storeDataToIndexedDB(entityTypeForDb, response_json);
+      await storeDataToIndexedDB(
+        entityTypeForDb,
+        response_json,
+        response.headers.get("X-Pros-Change-Seq")
+      );
     }
     return response_json;
   }
@@ -6,7 +6,8 @@ import App from "./App";
 import { createEffect, createSignal, Show } from "solid-js";
 import { createStore } from "solid-js/store";
 import { Router } from "@solidjs/router";
-import { db } from "./data/db";
+import { db, dbRequests } from "./data/db";
+import { bootstrapListCache } from "./data/dataFunctions";
 
 const SERVER: string = "http://127.0.0.1:8000";
 const BASE_URI: string = "http://127.0.0.1:8000/api";
@@ -54,6 +55,15 @@ function SchemaWrapper(props: SchemaWrapperProps) {
     db.open();
     console.log("setting up db");
     resolveDbReady(true);
+
+    // Fetch the lists not yet cached in one request, in the background
+    bootstrapListCache(
+      Object.keys(stores).filter(
+        (entity_name) =>
+          json[entity_name].meta?.use_list_cache !== false &&
+          !dbRequests[entity_name]
+      )
+    );
   });
 
   return (
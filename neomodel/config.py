@@ -14,3 +14,13 @@ MAX_TRANSACTION_RETRY_TIME = 30.0
 RESOLVER = None
 TRUST = neo4j.TRUST_SYSTEM_CA_SIGNED_CERTIFICATES
 USER_AGENT = None
+
+# Node property holding the number of inbound relationships of a node, kept up to date
+# when relationships are connected, disconnected or deleted along with a node.
+# Set to None to disable the counter.
+INBOUND_COUNT_PROPERTY = 'inbound_count'
+# Relationship types not included in the inbound count
+INBOUND_COUNT_EXCLUDED_TYPES = ('MERGED',)
+
+# Number of records pulled from the server at a time by Database.stream_query
+STREAM_FETCH_SIZE = 1000
@@ -514,6 +514,18 @@ class StructuredNode(NodeBase):
         :return: True
         """
         self._pre_action_check("delete")
+        if config.INBOUND_COUNT_PROPERTY:
+            # Nodes this one points to lose an inbound relationship
+            self.cypher(
+                "MATCH (self) WHERE id(self)=$self "
+                "MATCH (self)-[r]->(target) "
+                "WHERE target <> self AND NOT type(r) IN $excluded_types "
+                "WITH target, count(r) AS removed "
+                "SET target.{0} = coalesce(target.{0}, 0) - removed".format(
+                    config.INBOUND_COUNT_PROPERTY
+                ),
+                {"excluded_types": list(config.INBOUND_COUNT_EXCLUDED_TYPES)},
+            )
         self.cypher(
             "MATCH (self) WHERE id(self)=$self "
             "OPTIONAL MATCH (self)-[r]-()"
@@ -15,6 +15,7 @@ from .match import (
 )
 from .relationship import StructuredRel
 from .core import db
+from . import config
 
 # basestring python 3.x fallback
 try:
@@ -35,6 +36,29 @@ def check_source(fn):
     return checker
 
 
+def _counts_inbound(definition):
+    """Whether relationships of this definition are included in the inbound count"""
+    return bool(config.INBOUND_COUNT_PROPERTY) and (
+        definition["relation_type"] not in config.INBOUND_COUNT_EXCLUDED_TYPES
+    )
+
+
+def _inbound_count_set(node, delta):
+    """SET clause adjusting the inbound count of node by delta (a number or Cypher expression)"""
+    return " SET {0}.{1} = coalesce({0}.{1}, 0) + {2}".format(
+        node, config.INBOUND_COUNT_PROPERTY, delta
+    )
+
+
+def _inbound_count_delete(rel):
+    """DELETE clause for rel, decrementing the inbound count of its end node(s)"""
+    return (
+        " WITH {0}, endNode({0}) AS inbound_target DELETE {0}"
+        " WITH inbound_target, count(*) AS removed".format(rel)
+        + _inbound_count_set("inbound_target", "-removed")
+    )
+
+
 # checks if obj is a direct subclass, 1 level
 def is_direct_subclass(obj, classinfo):
     for base in obj.__bases__:
@@ -124,6 +148,10 @@ class RelationshipManager(object):
             "MATCH (them), (us) WHERE id(them)=$them and id(us)=$self "
             "MERGE" + new_rel
         )
+        if _counts_inbound(self.definition):
+            # MERGE creates undirected relationships from left to right
+            target = "us" if self.definition["direction"] == INCOMING else "them"
+            q += " ON CREATE" + _inbound_count_set(target, 1)
 
         params["them"] = node.id
 
@@ -244,11 +272,17 @@ class RelationshipManager(object):
             "MATCH " + old_rel
         )
         q += " MERGE" + new_rel
+        if _counts_inbound(self.definition):
+            target = "us" if self.definition["direction"] == INCOMING else "new"
+            q += " ON CREATE" + _inbound_count_set(target, 1)
 
         # copy over properties if we have
         for p in existing_properties:
             q += " SET r2.{0} = r.{1}".format(p, p)
-        q += " WITH r DELETE r"
+        if _counts_inbound(self.definition):
+            q += _inbound_count_delete("r")
+        else:
+            q += " WITH r DELETE r"
 
         self.source.cypher(q, {"old": old_node.id, "new": new_node.id})
 
@@ -261,10 +295,11 @@ class RelationshipManager(object):
         :return:
         """
         rel = _rel_helper(lhs="a", rhs="b", ident="r", **self.definition)
-        q = (
-            "MATCH (a), (b) WHERE id(a)=$self and id(b)=$them "
-            "MATCH " + rel + " DELETE r"
-        )
+        q = "MATCH (a), (b) WHERE id(a)=$self and id(b)=$them MATCH " + rel
+        if _counts_inbound(self.definition):
+            q += _inbound_count_delete("r")
+        else:
+            q += " DELETE r"
         self.source.cypher(q, {"them": node.id})
 
     @check_source
@@ -276,7 +311,11 @@ class RelationshipManager(object):
         """
         rhs = "b:" + self.definition["node_class"].__label__
         rel = _rel_helper(lhs="a", rhs=rhs, ident="r", **self.definition)
-        q = "MATCH (a) WHERE id(a)=$self MATCH " + rel + " DELETE r"
+        q = "MATCH (a) WHERE id(a)=$self MATCH " + rel
+        if _counts_inbound(self.definition):
+            q += _inbound_count_delete("r")
+        else:
+            q += " DELETE r"
         self.source.cypher(q)
 
     @check_source
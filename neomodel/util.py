@@ -3,7 +3,7 @@ import os
 import sys
 import time
 import warnings
-from threading import local
+from threading import Lock, local
 
 from neo4j import DEFAULT_DATABASE, GraphDatabase, basic_auth
 from neo4j.exceptions import ClientError, SessionExpired
@@ -73,12 +73,18 @@ class NodeClassRegistry:
 class Database(local, NodeClassRegistry):
     """
     A singleton object via which all operations from neomodel to the Neo4j backend are handled with.
+
+    The object is thread-local, but the drivers (and so their connection pools) are
+    shared between the threads of a process that connect to the same URL.
     """
+    _drivers = {}
+    _drivers_lock = Lock()
 
     def __init__(self):
         """
         """
         self._active_transaction = None
+        self._on_commit_callbacks = []
         self.url = None
         self.driver = None
         self._session = None
@@ -122,7 +128,11 @@ class Database(local, NodeClassRegistry):
             options['encrypted'] = config.ENCRYPTED
             options['trust'] = config.TRUST
 
-        self.driver = GraphDatabase.driver(u.scheme + '://' + hostname, **options)
+        with Database._drivers_lock:
+            driver_key = (url, os.getpid())
+            if driver_key not in Database._drivers:
+                Database._drivers[driver_key] = GraphDatabase.driver(u.scheme + '://' + hostname, **options)
+            self.driver = Database._drivers[driver_key]
         self.url = url
         self._pid = os.getpid()
         self._active_transaction = None
@@ -160,6 +170,7 @@ class Database(local, NodeClassRegistry):
 
         :return: last_bookmark
         """
+        callbacks, self._on_commit_callbacks = self._on_commit_callbacks, []
         try:
             self._active_transaction.commit()
             last_bookmark = self._session.last_bookmark()
@@ -169,6 +180,9 @@ class Database(local, NodeClassRegistry):
             self._active_transaction = None
             self._session = None
 
+        for callback in callbacks:
+            callback()
+
         return last_bookmark
 
     @ensure_connection
@@ -176,6 +190,7 @@ class Database(local, NodeClassRegistry):
         """
         Rolls back the current transaction
         """
+        self._on_commit_callbacks = []
         try:
             self._active_transaction.rollback()
         finally:
@@ -184,6 +199,19 @@ class Database(local, NodeClassRegistry):
             self._active_transaction = None
             self._session = None
 
+    def on_commit(self, callback):
+        """
+        Registers a callable to be run once the current transaction has been committed.
+        Callbacks are discarded if the transaction is rolled back; with no transaction
+        in progress, the callable is run immediately.
+
+        :param callback: A callable taking no arguments
+        """
+        if self._active_transaction:
+            self._on_commit_callbacks.append(callback)
+        else:
+            callback()
+
     def _object_resolution(self, result_list):
         """
         Performs in place automatic object resolution on a set of results
@@ -300,6 +328,40 @@ class Database(local, NodeClassRegistry):
 
         return results, meta
 
+    @ensure_connection
+    def stream_query(self, query, params=None, fetch_size=None):
+        """
+        Runs a read query in its own session and returns a generator over the values of
+        its records, which are pulled from the server in batches of `fetch_size` as the
+        generator is consumed. The session is closed when the generator is exhausted
+        or closed.
+
+        The query runs outside any active transaction, so the generator can be
+        consumed after it ends (e.g. by a streaming response) and from another thread.
+
+        :param query: A CYPHER query
+        :type: str
+        :param params: Dictionary of parameters
+        :type: dict
+        :param fetch_size: Number of records to pull from the server at a time
+            (defaults to config.STREAM_FETCH_SIZE)
+        :type: int
+        """
+
+        if self._pid != os.getpid():
+            self.set_connection(self.url)
+
+        # Bound now, as the database object is thread-local
+        driver, database_name = self.driver, self._database_name
+        fetch_size = fetch_size or config.STREAM_FETCH_SIZE
+
+        def stream():
+            with driver.session(database=database_name, fetch_size=fetch_size) as session:
+                for record in session.run(query, params):
+                    yield list(record.values())
+
+        return stream()
+
 
 class TransactionProxy(object):
     bookmarks = None
@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pros.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+from pros_core.label_index import LABEL_INDEX  # noqa: E402
+
+LABEL_INDEX.sync_in_background(
+    getattr(settings, "PROS_LABEL_INDEX_SYNC_INTERVAL", 2.0)
+)
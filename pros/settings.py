@@ -42,6 +42,7 @@ INSTALLED_APPS = [
     "rest_framework",
     "rest_framework_simplejwt",
     # "test_app.apps.TestAppConfig",
+    "pros_core.apps.ProsCoreConfig",
     "frontend.apps.FrontendConfig",
     "pros_dating.apps.ProsDatingConfig",
     "pros_vocabs.apps.ProsVocabsConfig",
@@ -166,6 +167,7 @@ CORS_ALLOW_ALL_ORIGINS = True
 CORS_EXPOSE_HEADERS = [
     "Content-Type",
     "X-CSRFToken",
+    "X-Pros-Change-Seq",
 ]
 CORS_ALLOW_CREDENTIALS = True
 
@@ -181,3 +183,20 @@ REST_FRAMEWORK = {
 }
 
 INTERAL_URI_BASE = "http://pros.net"
+
+# Directory for the precompressed full-list snapshot files (None to disable them)
+PROS_SNAPSHOT_DIR = BASE_DIR / "snapshots"
+
+# Seconds between checks of the change log by each process's list projections for
+# writes made by other processes (writes by the process itself are seen at once)
+PROS_LIST_VERSION_CHECK_INTERVAL = 1.0
+
+# Seconds between each process's label index catching up with writes made by other
+# processes (writes by the process itself are applied as they commit)
+PROS_LABEL_INDEX_SYNC_INTERVAL = 2.0
+
+# Maximum number of item responses kept in each process's item cache (0 to disable it)
+PROS_ITEM_CACHE_SIZE = 1000
+
+# Default number of rows written per transaction by the bulk upsert endpoints
+PROS_BULK_UPSERT_CHUNK_SIZE = 500
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pros.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402
+from pros_core.label_index import LABEL_INDEX  # noqa: E402
+
+LABEL_INDEX.sync_in_background(
+    getattr(settings, "PROS_LABEL_INDEX_SYNC_INTERVAL", 2.0)
+)
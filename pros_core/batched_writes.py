@@ -0,0 +1,536 @@
+"""Writes of entities and their relations in a constant number of statements.
+
+Creating or updating an entity through neomodel costs a query per node, plus a
+lookup and a MERGE (and a count, for cardinality One) per relation. Instead, the
+nodes (the entity and its inline nodes) and their relations are built in Python,
+with the same defaults and `pre_save` hooks as `save` and `connect`, and all the
+changes are written by one statement (see `write_changes`).
+
+Updates first read the current state they change in one query, and write only the
+difference, so unchanged relations keep their identity.
+
+Models that override `save` itself (e.g. to write further nodes) are still saved
+with it."""
+
+import datetime
+from typing import Type
+
+from neomodel import db
+from neomodel import config
+from neomodel.exceptions import AttemptedCardinalityViolation
+from neomodel.relationship_manager import _counts_inbound
+from neomodel.util import _UnsavedNode
+
+from pros_core.models import ProsNode
+from pros_core.outbox import build_event
+from pros_core.setup_app import PROS_MODELS
+from pros_core.template_labels import (
+    LABEL_DEPENDENCIES,
+    LABEL_TEMPLATES,
+    PROPAGATE_TEMPLATE_LABELS,
+)
+
+INBOUND_COUNT = config.INBOUND_COUNT_PROPERTY
+
+# Cardinalities of relation fields that may relate to at most one node
+SINGLE_CARDINALITIES = {"One", "ZeroOrOne"}
+
+# Each part is a unit subquery, run (once) whether or not its list is empty, in this
+# order: relations are removed before their nodes are deleted, and added after
+# their nodes are created. Outbox events (see pros_core.outbox) are written with them
+WRITE_CHANGES_QUERY = f"""
+CALL {{
+    UNWIND $removed_relations AS removed
+    MATCH ()-[r]->(target)
+    WHERE id(r) = removed.id
+    DELETE r
+    FOREACH (_ IN CASE WHEN removed.counts_inbound THEN [1] ELSE [] END |
+        SET target.{INBOUND_COUNT} = coalesce(target.{INBOUND_COUNT}, 0) - 1
+    )
+    RETURN count(*) AS removed_relation_count
+}}
+CALL {{
+    UNWIND $deleted_nodes AS deleted_uid
+    MATCH (n:ProsNode {{uid: deleted_uid}})
+    DETACH DELETE n
+    RETURN count(*) AS deleted_node_count
+}}
+CALL {{
+    UNWIND $created_nodes AS new_node
+    CALL apoc.create.node(new_node.labels, new_node.properties) YIELD node
+    RETURN count(node) AS created_node_count
+}}
+CALL {{
+    UNWIND $updated_nodes AS updated
+    MATCH (n:ProsNode {{uid: updated.uid}})
+    SET n += updated.properties
+    RETURN count(*) AS updated_node_count
+}}
+CALL {{
+    UNWIND $changed_relations AS changed
+    MATCH ()-[r]->()
+    WHERE id(r) = changed.id
+    SET r = changed.properties
+    RETURN count(*) AS changed_relation_count
+}}
+CALL {{
+    UNWIND $added_relations AS relation
+    MATCH (source:ProsNode {{uid: relation.source}})
+    MATCH (target:ProsNode {{uid: relation.target}})
+    CALL apoc.create.relationship(source, relation.type, relation.properties, target)
+    YIELD rel
+    FOREACH (_ IN CASE WHEN relation.counts_inbound THEN [1] ELSE [] END |
+        SET target.{INBOUND_COUNT} = coalesce(target.{INBOUND_COUNT}, 0) + 1
+    )
+    RETURN COLLECT([relation.source, relation.type, relation.target]) AS created
+}}
+CALL {{
+    UNWIND $events AS event
+    CREATE (:ProsOutboxEvent {{
+        id: event.id, topic: event.topic, payload: event.payload,
+        created_at: timestamp(), available_at: timestamp(), attempts: 0
+    }})
+    RETURN count(*) AS event_count
+}}
+RETURN created
+"""
+
+# A node, with its outgoing relations of some types
+CURRENT_NODE_QUERY = """
+MATCH (n:ProsNode {uid: $uid})
+OPTIONAL MATCH (n)-[r]->(target)
+WHERE type(r) IN $types
+RETURN n, labels(n),
+    COLLECT(CASE WHEN r IS NULL THEN null ELSE [id(r), type(r), target.uid, properties(r)] END)
+"""
+
+# Inline nodes of a node by relation type, with all their outgoing relations
+CURRENT_INLINE_NODES_QUERY = """
+MATCH (source:ProsNode {uid: $uid})-[r]->(inline_node)
+WHERE type(r) IN $types AND r.inline
+OPTIONAL MATCH (inline_node)-[inline_node_rel]->(target)
+RETURN type(r), id(r), inline_node, labels(inline_node),
+    COLLECT(CASE WHEN inline_node_rel IS NULL THEN null ELSE
+        [id(inline_node_rel), type(inline_node_rel), target.uid, properties(inline_node_rel)]
+    END)
+"""
+
+
+def uses_custom_save(model_class: Type[ProsNode]) -> bool:
+    return model_class.save is not ProsNode.save
+
+
+def build_node_write(model_class: Type[ProsNode], property_data: dict) -> dict:
+    """Labels and properties of a new node, as `save` would write them"""
+    instance = model_class(**property_data)
+    instance.pre_save()
+    return {
+        "labels": model_class.inherited_labels(),
+        "properties": model_class.deflate(
+            instance.__properties__, obj=_UnsavedNode(), skip_empty=True
+        ),
+    }
+
+
+def build_node_writes(
+    nodes: list[tuple[Type[ProsNode], dict]]
+) -> tuple[list[dict], list[dict]]:
+    """Writes of new nodes from (model class, property data) pairs, and the
+    properties written for each. Nodes of models with their own `save` are saved
+    straight away instead."""
+    written = []
+    node_writes = []
+    for node_class, property_data in nodes:
+        if uses_custom_save(node_class):
+            instance = node_class(**property_data)
+            instance.save()
+            written.append(node_class.deflate(instance.__properties__, instance))
+        else:
+            node_write = build_node_write(node_class, property_data)
+            node_writes.append(node_write)
+            written.append(node_write["properties"])
+    return node_writes, written
+
+
+def build_relation_write(
+    relation, source_uid: str, target_uid: str, properties: dict | None
+) -> dict:
+    """A new relation, with its properties as `connect` would write them"""
+    rel_model = relation.definition["model"]
+    rel_instance = rel_model(**properties) if properties else rel_model()
+    if hasattr(rel_instance, "pre_save"):
+        rel_instance.pre_save()
+    return {
+        "source": source_uid,
+        "target": target_uid,
+        "type": relation.definition["relation_type"],
+        "properties": {
+            k: v
+            for k, v in rel_model.deflate(rel_instance.__properties__).items()
+            if v is not None
+        },
+        "counts_inbound": _counts_inbound(relation.definition),
+    }
+
+
+def build_relation_writes(
+    model_class: Type[ProsNode], source_uid: str, relation_data: dict
+) -> list[dict]:
+    """New relations from a node for each related value of each relation field.
+
+    Raises AttemptedCardinalityViolation if a field of cardinality One or ZeroOrOne
+    is given more than one related node, as `connect` would."""
+    app_model = PROS_MODELS[model_class.__name__.lower()]
+    relations = app_model.relations
+    writes = {}
+    for related_name, related_values in relation_data.items():
+        if (
+            app_model.fields[related_name]["cardinality"] in SINGLE_CARDINALITIES
+            and len({related_value["uid"] for related_value in related_values}) > 1
+        ):
+            raise AttemptedCardinalityViolation(
+                f"{model_class.__name__}.{related_name} can only relate to one node"
+            )
+        for related_value in related_values:
+            write = build_relation_write(
+                relations[related_name],
+                source_uid,
+                related_value["uid"],
+                related_value.get("relData"),
+            )
+            # As with MERGE, a relation to the same node is only written once
+            writes[(write["type"], write["target"])] = write
+    return list(writes.values())
+
+
+def removed_relation(rel_id: int, rel_type: str) -> dict:
+    return {"id": rel_id, "counts_inbound": _counts_inbound({"relation_type": rel_type})}
+
+
+def relation_types(model_class: Type[ProsNode], relation_names) -> list[str]:
+    relations = PROS_MODELS[model_class.__name__.lower()].relations
+    return [relations[name].definition["relation_type"] for name in relation_names]
+
+
+def diff_relations(
+    model_class: Type[ProsNode], uid: str, relation_data: dict, current: list
+) -> tuple[list[dict], list[dict], list[dict]]:
+    """Added, changed and removed relations that make the relations of each of the
+    given relation fields of a node the given related values, from its current
+    relations of those fields as (id, type, target uid, properties)"""
+    desired = {
+        (write["type"], write["target"]): write
+        for write in build_relation_writes(model_class, uid, relation_data)
+    }
+    changed, removed = [], []
+    seen = set()
+    for rel_id, rel_type, target_uid, properties in current:
+        key = (rel_type, target_uid)
+        write = desired.get(key)
+        if write is None or key in seen:
+            # No longer related (or a duplicate relation)
+            removed.append(removed_relation(rel_id, rel_type))
+        elif properties != write["properties"]:
+            changed.append({"id": rel_id, "properties": write["properties"]})
+        seen.add(key)
+    added = [write for key, write in desired.items() if key not in seen]
+    return added, changed, removed
+
+
+def new_changes() -> dict[str, list]:
+    """Changes to be written by `write_changes`, by keyword"""
+    return {
+        "added_relations": [],
+        "changed_relations": [],
+        "removed_relations": [],
+        "created_nodes": [],
+        "updated_nodes": [],
+        "deleted_nodes": [],
+        "events": [],
+    }
+
+
+def add_relation_changes(changes: dict, added: list, changed: list, removed: list):
+    changes["added_relations"] += added
+    changes["changed_relations"] += changed
+    changes["removed_relations"] += removed
+
+
+def merge_changes(changes: dict, other: dict):
+    for key, values in other.items():
+        changes[key] += values
+
+
+def write_changes(
+    added_relations: list[dict] = (),
+    changed_relations: list[dict] = (),
+    removed_relations: list[dict] = (),
+    created_nodes: list[dict] = (),
+    updated_nodes: list[dict] = (),
+    deleted_nodes: list[str] = (),
+    events: list[dict] = (),
+):
+    """Write node and relation changes in one statement: relations are created,
+    have their properties replaced (by id) or are deleted (by id); nodes are
+    created, have properties set (by uid) or are deleted (by uid). Outbox events
+    are written with them.
+
+    Raises ProsNode.DoesNotExist (rolling back the transaction) if any of the
+    nodes of the added relations are not found."""
+    params = {
+        "added_relations": list(added_relations),
+        "changed_relations": list(changed_relations),
+        "removed_relations": list(removed_relations),
+        "created_nodes": list(created_nodes),
+        "updated_nodes": list(updated_nodes),
+        "deleted_nodes": list(deleted_nodes),
+        "events": list(events),
+    }
+    if not any(params.values()):
+        return
+    results, meta = db.cypher_query(WRITE_CHANGES_QUERY, params)
+    created = {tuple(row) for row in results[0][0]}
+    missing = sorted(
+        {
+            relation["target"]
+            for relation in added_relations
+            if (relation["source"], relation["type"], relation["target"]) not in created
+        }
+    )
+    if missing:
+        raise ProsNode.DoesNotExist(f"Related nodes not found: {', '.join(missing)}")
+
+
+def create_relations(relation_writes: list[dict]):
+    """Create relations between existing nodes"""
+    write_changes(added_relations=relation_writes)
+
+
+def create_entity(
+    model_class: Type[ProsNode],
+    property_data: dict,
+    relation_data: dict,
+    inline_nodes: dict[str, tuple[Type[ProsNode], dict, dict]],
+) -> dict:
+    """Create a node with its relations, and its inline nodes given as
+    {field name: (model class, property data, relation data)} with their own
+    relations; returns the properties written for the node"""
+    changes = new_changes()
+    properties = plan_entity_creation(
+        model_class, property_data, relation_data, inline_nodes, changes
+    )
+    write_changes(**changes)
+    return properties
+
+
+def plan_entity_creation(
+    model_class: Type[ProsNode],
+    property_data: dict,
+    relation_data: dict,
+    inline_nodes: dict[str, tuple[Type[ProsNode], dict, dict]],
+    changes: dict,
+) -> dict:
+    """Add the changes creating a node (see `create_entity`) to `changes`; returns
+    the properties to be written for the node"""
+    node_writes, (properties, *inline_properties) = build_node_writes(
+        [(model_class, property_data)]
+        + [(inline_model, data) for inline_model, data, _ in inline_nodes.values()]
+    )
+    changes["created_nodes"] += node_writes
+    if not uses_custom_save(model_class):
+        # Nodes saved straight away have emitted their events already (see post_create)
+        changes["events"] += model_class.outbox_events_on_create(properties)
+
+    inline_relations = PROS_MODELS[model_class.__name__.lower()].inline_relations
+    changes["added_relations"] += build_relation_writes(
+        model_class, properties["uid"], relation_data
+    )
+    for (inline_field_name, (inline_model, _, inline_relation_data)), written in zip(
+        inline_nodes.items(), inline_properties
+    ):
+        changes["added_relations"].append(
+            build_relation_write(
+                inline_relations[inline_field_name],
+                properties["uid"],
+                written["uid"],
+                None,
+            )
+        )
+        changes["added_relations"] += build_relation_writes(
+            inline_model, written["uid"], inline_relation_data
+        )
+    return properties
+
+
+def update_inline_nodes(
+    model_class: Type[ProsNode],
+    uid: str,
+    inline_nodes: dict[str, tuple[Type[ProsNode], dict, dict]],
+    username: str | None = None,
+):
+    """Make the inline nodes of a node those given as {field name: (model class,
+    property data, relation data)}, reading the stored inline nodes in one query and
+    writing the changes in one statement."""
+    changes = new_changes()
+    plan_inline_node_changes(model_class, uid, inline_nodes, username, changes)
+    write_changes(**changes)
+
+
+def plan_inline_node_changes(
+    model_class: Type[ProsNode],
+    uid: str,
+    inline_nodes: dict[str, tuple[Type[ProsNode], dict, dict]],
+    username: str | None,
+    changes: dict,
+):
+    """Add the changes making the inline nodes of a node those given to `changes`.
+
+    An inline node of the same type is updated in place (only the properties and
+    relations that differ); otherwise a new one replaces it, and the old one is
+    deleted if it is inline-only."""
+    if not inline_nodes:
+        return
+    inline_relations = PROS_MODELS[model_class.__name__.lower()].inline_relations
+    results, meta = db.cypher_query(
+        CURRENT_INLINE_NODES_QUERY,
+        {
+            "uid": uid,
+            "types": [
+                inline_relations[name].definition["relation_type"] for name in inline_nodes
+            ],
+        },
+    )
+    stored = {row[0]: row[1:] for row in results}
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for field_name, (inline_model, property_data, relation_data) in inline_nodes.items():
+        inline_relation = inline_relations[field_name]
+        stored_rel_id, stored_node, stored_labels, stored_relations = stored.get(
+            inline_relation.definition["relation_type"], (None, None, [], [])
+        )
+        stored_inline_only = "ProsInlineOnlyNode" in stored_labels
+
+        property_data = dict(property_data)
+        # Inline nodes that are entities in their own right record their modification
+        if stored_node is not None and not stored_inline_only:
+            property_data.pop("createdWhen", None)
+            property_data.pop("createdBy", None)
+            property_data = {**property_data, "modifiedBy": username, "modifiedWhen": now}
+
+        # Same type: update the stored inline node in place
+        if stored_node is not None and stored_node.get("real_type") == (
+            inline_model.__name__.lower()
+        ):
+            plan_node_changes(
+                inline_model,
+                stored_node,
+                property_data,
+                relation_data,
+                stored_relations,
+                changes,
+            )
+            continue
+
+        # Otherwise a new inline node, replacing the stored one if there is one
+        node_writes, (written,) = build_node_writes([(inline_model, property_data)])
+        changes["created_nodes"] += node_writes
+        changes["added_relations"].append(
+            build_relation_write(inline_relation, uid, written["uid"], None)
+        )
+        changes["added_relations"] += build_relation_writes(
+            inline_model, written["uid"], relation_data
+        )
+        if stored_node is not None:
+            changes["removed_relations"].append(
+                removed_relation(
+                    stored_rel_id, inline_relation.definition["relation_type"]
+                )
+            )
+            if stored_inline_only:
+                changes["removed_relations"] += [
+                    removed_relation(rel_id, rel_type)
+                    for rel_id, rel_type, target_uid, properties in stored_relations
+                ]
+                changes["deleted_nodes"].append(stored_node["uid"])
+
+
+def plan_node_changes(
+    model_class: Type[ProsNode],
+    stored_node,
+    property_data: dict,
+    relation_data: dict,
+    stored_relations: list,
+    changes: dict,
+):
+    """Add the changes updating a stored node with the given properties (through
+    `pre_save`, setting only those that differ) and relation fields to `changes`"""
+    instance = model_class.inflate(stored_node)
+    for prop_key, prop_value in property_data.items():
+        setattr(instance, prop_key, prop_value)
+    instance.pre_save()
+    properties = model_class.deflate(instance.__properties__, instance)
+    changed_properties = {k: v for k, v in properties.items() if stored_node.get(k) != v}
+    if changed_properties:
+        changes["updated_nodes"].append(
+            {"uid": instance.uid, "properties": changed_properties}
+        )
+
+    types = set(relation_types(model_class, relation_data))
+    add_relation_changes(
+        changes,
+        *diff_relations(
+            model_class,
+            instance.uid,
+            relation_data,
+            [row for row in stored_relations if row[1] in types],
+        ),
+    )
+
+
+def update_entity(
+    model_class: Type[ProsNode],
+    uid: str,
+    property_data: dict,
+    relation_data: dict,
+    inline_nodes: dict[str, tuple[Type[ProsNode], dict, dict]],
+    username: str | None = None,
+):
+    """Update a node's properties, the given relation fields and inline nodes,
+    with two reads and one write; raises DoesNotExist if there is no such node"""
+    changes = new_changes()
+    plan_entity_update(
+        model_class, uid, property_data, relation_data, inline_nodes, username, changes
+    )
+    write_changes(**changes)
+
+
+def plan_entity_update(
+    model_class: Type[ProsNode],
+    uid: str,
+    property_data: dict,
+    relation_data: dict,
+    inline_nodes: dict[str, tuple[Type[ProsNode], dict, dict]],
+    username: str | None,
+    changes: dict,
+):
+    """Add the changes updating a node (see `update_entity`) to `changes`"""
+    results, meta = db.cypher_query(
+        CURRENT_NODE_QUERY,
+        {"uid": uid, "types": relation_types(model_class, relation_data)},
+    )
+    if not results or model_class.__label__ not in results[0][1]:
+        raise model_class.DoesNotExist(
+            f"<{model_class.__name__} uid={uid}> not found."
+        )
+    stored_node, labels, stored_relations = results[0]
+
+    plan_node_changes(
+        model_class, stored_node, property_data, relation_data, stored_relations, changes
+    )
+    # Labels embedding this node's are recomputed in the background
+    if LABEL_DEPENDENCIES and (
+        model_class.__name__.lower() in LABEL_TEMPLATES
+        or property_data.get("label", stored_node.get("label")) != stored_node.get("label")
+    ):
+        changes["events"].append(build_event(PROPAGATE_TEMPLATE_LABELS, {"uids": [uid]}))
+    plan_inline_node_changes(model_class, uid, inline_nodes, username, changes)
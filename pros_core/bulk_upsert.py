@@ -0,0 +1,294 @@
+"""Bulk upsert of entities of one type from NDJSON, one entity per line.
+
+Lines are processed in chunks, each in its own write transaction: every row of a
+chunk is validated against the model's JSON schema and checked (uids of the rows
+and of the nodes they relate to are looked up for the whole chunk at once), and
+the changes of all valid rows are written by one statement (see batched_writes).
+Rows with a `uid` of an existing entity of the type update it; other rows create
+an entity (with the given uid, if any). Rows may relate to others of their chunk by uid;
+a row relating to a row that is not written is not written either.
+
+A result is yielded per line, in order, once its chunk has been committed, so an
+invalid row is reported without affecting the others. If writing a chunk fails, its
+transaction is rolled back and each of its rows is reported as failed."""
+
+import datetime
+import itertools
+import json
+from typing import Iterable, Iterator, Type
+
+from django.conf import settings
+from neomodel import db
+from neomodel.exceptions import AttemptedCardinalityViolation, DoesNotExist
+
+from pros_core import change_log
+from pros_core.batched_writes import (
+    merge_changes,
+    new_changes,
+    plan_entity_creation,
+    plan_entity_update,
+    write_changes,
+)
+from pros_core.models import ProsNode
+from pros_core.schema_validation import instance_errors
+from pros_core.setup_app import PROS_MODELS
+from pros_core.template_labels import refresh_template_labels
+from pros_core.viewsets import (
+    get_affected_uids,
+    get_inline_node_data,
+    get_property_and_relation_data,
+    record_entity_changes,
+)
+
+CREATED = "created"
+UPDATED = "updated"
+ERROR = "error"
+
+# Rows written per transaction
+BULK_UPSERT_CHUNK_SIZE = getattr(settings, "PROS_BULK_UPSERT_CHUNK_SIZE", 500)
+BULK_UPSERT_CHUNK_SIZE_MAX = 5000
+
+EXISTING_NODES_QUERY = """
+MATCH (n:ProsNode) WHERE n.uid IN $uids
+RETURN n.uid, labels(n)
+"""
+
+
+def referenced_uids(relation_data: dict, inline_nodes: dict) -> set[str]:
+    """uids of the nodes a row relates to, directly or from its inline nodes"""
+    return {
+        related_value["uid"]
+        for data in (
+            relation_data,
+            *(inline_relation_data for _, _, inline_relation_data in inline_nodes.values()),
+        )
+        for related_values in data.values()
+        for related_value in related_values
+    }
+
+
+def error_result(line: int, *errors, uid: str | None = None) -> dict:
+    return {"line": line, "status": ERROR, "uid": uid, "errors": list(errors)}
+
+
+class BulkUpsert:
+    def __init__(self, model_class: Type[ProsNode], username: str):
+        self.model_class = model_class
+        self.username = username
+        self.app_model = PROS_MODELS[model_class.__name__.lower()]
+
+    def parse(self, line: int, text: str) -> tuple[dict | None, dict | None]:
+        """A row prepared for writing, or an error result"""
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            return None, error_result(line, f"Invalid JSON: {e}")
+        if not isinstance(data, dict):
+            return None, error_result(line, "Each line must be a JSON object")
+
+        uid = data.get("uid")
+        if errors := [
+            f"{'/'.join(str(p) for p in error.absolute_path) or '(root)'}: {error.message}"
+            for error in instance_errors(self.app_model, data)
+        ]:
+            return None, error_result(line, *errors, uid=uid)
+
+        try:
+            (
+                property_data,
+                relation_data,
+                inline_relation_data,
+            ) = get_property_and_relation_data(data, self.model_class)
+            inline_nodes = get_inline_node_data(inline_relation_data)
+        except (KeyError, TypeError, ValueError) as e:
+            return None, error_result(line, f"Invalid value: {e}", uid=uid)
+
+        return {
+            "line": line,
+            "uid": uid,
+            "property_data": property_data,
+            "relation_data": relation_data,
+            "inline_nodes": inline_nodes,
+        }, None
+
+    def write_chunk(self, rows: list[dict]) -> dict[int, dict]:
+        """Write the rows of a chunk in one transaction; returns their results by line"""
+        results = {}
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with db.write_transaction:
+            existing = dict(
+                db.cypher_query(
+                    EXISTING_NODES_QUERY,
+                    {"uids": [row["uid"] for row in rows if row["uid"]]},
+                )[0]
+            )
+
+            # Check each row against the nodes that exist or are written in this chunk
+            seen_uids = set()
+            valid_rows = []
+            for row in rows:
+                if row["uid"] in seen_uids:
+                    results[row["line"]] = error_result(
+                        row["line"], "uid appears more than once in the batch", uid=row["uid"]
+                    )
+                    continue
+                if row["uid"]:
+                    seen_uids.add(row["uid"])
+                if row["uid"] in existing and (
+                    self.model_class.__label__ not in existing[row["uid"]]
+                ):
+                    results[row["line"]] = error_result(
+                        row["line"],
+                        "uid belongs to an entity of another type",
+                        uid=row["uid"],
+                    )
+                    continue
+                valid_rows.append(row)
+
+            references = {
+                row["line"]: referenced_uids(row["relation_data"], row["inline_nodes"])
+                for row in valid_rows
+            }
+            found, meta = db.cypher_query(
+                EXISTING_NODES_QUERY,
+                {"uids": list(set().union(set(), *references.values()))},
+            )
+            known_uids = {uid for uid, labels in found}
+            chunk_uids = {row["uid"] for row in valid_rows if row["uid"]}
+
+            planned = {}
+            for row in valid_rows:
+                if missing := sorted(references[row["line"]] - known_uids - chunk_uids):
+                    results[row["line"]] = error_result(
+                        row["line"],
+                        f"Related nodes not found: {', '.join(missing)}",
+                        uid=row["uid"],
+                    )
+                    continue
+                row_changes = new_changes()
+                try:
+                    result = self.plan_row(row, row["uid"] in existing, now, row_changes)
+                except (DoesNotExist, AttemptedCardinalityViolation) as e:
+                    results[row["line"]] = error_result(row["line"], str(e), uid=row["uid"])
+                    continue
+                planned[row["line"]] = (row, result, row_changes)
+
+            # Rows relating to rows of the chunk that are not written are not written
+            # either, in turn, until all the rows left relate only to written nodes
+            while True:
+                written_uids = known_uids | {
+                    row["uid"] for row, result, row_changes in planned.values()
+                }
+                dropped = {
+                    line: missing
+                    for line, (row, result, row_changes) in planned.items()
+                    if (missing := sorted(references[line] - written_uids))
+                }
+                if not dropped:
+                    break
+                for line, missing in dropped.items():
+                    row, result, row_changes = planned.pop(line)
+                    results[line] = error_result(
+                        line,
+                        f"Related nodes not written: {', '.join(missing)}",
+                        uid=row["uid"],
+                    )
+
+            changes = new_changes()
+            created, updated = {}, set()
+            for line, (row, result, row_changes) in planned.items():
+                if result["status"] == CREATED:
+                    created[result["uid"]] = line
+                else:
+                    updated.add(result["uid"])
+                results[line] = result
+                merge_changes(changes, row_changes)
+
+            # Nodes that are no longer related after the update are affected too
+            affected_uids = get_affected_uids(updated) if updated else set()
+            write_changes(**changes)
+            for uid, label in refresh_template_labels(set(created) | updated).items():
+                if uid in created:
+                    results[created[uid]]["label"] = label
+            if created or updated:
+                record_entity_changes(
+                    {
+                        **{uid: change_log.UPDATE for uid in updated},
+                        **{uid: change_log.CREATE for uid in created},
+                    },
+                    affected_uids | get_affected_uids(set(created) | updated),
+                )
+        return results
+
+    def plan_row(self, row: dict, exists: bool, now, changes: dict) -> dict:
+        """Add the changes of a row to `changes`; returns its result"""
+        if exists:
+            property_data = {
+                k: v
+                for k, v in row["property_data"].items()
+                if k not in ("createdBy", "createdWhen")
+            }
+            plan_entity_update(
+                self.model_class,
+                row["uid"],
+                {**property_data, "modifiedBy": self.username, "modifiedWhen": now},
+                row["relation_data"],
+                row["inline_nodes"],
+                self.username,
+                changes,
+            )
+            return {"line": row["line"], "status": UPDATED, "uid": row["uid"]}
+
+        properties = plan_entity_creation(
+            self.model_class,
+            {
+                **row["property_data"],
+                **({"uid": row["uid"]} if row["uid"] else {}),
+                "createdBy": self.username,
+                "createdWhen": now,
+                "modifiedBy": self.username,
+                "modifiedWhen": now,
+            },
+            row["relation_data"],
+            row["inline_nodes"],
+            changes,
+        )
+        return {
+            "line": row["line"],
+            "status": CREATED,
+            "uid": properties["uid"],
+            "label": properties.get("label"),
+        }
+
+    def run(self, lines: Iterable[str], chunk_size: int) -> Iterator[dict]:
+        numbered = (
+            (line, text) for line, text in enumerate(lines, start=1) if text.strip()
+        )
+        while chunk := list(itertools.islice(numbered, chunk_size)):
+            results = {}
+            rows = []
+            for line, text in chunk:
+                row, error = self.parse(line, text)
+                if error:
+                    results[line] = error
+                else:
+                    rows.append(row)
+            if rows:
+                try:
+                    results.update(self.write_chunk(rows))
+                except Exception as e:
+                    for row in rows:
+                        results[row["line"]] = error_result(
+                            row["line"], f"Batch not written: {e}", uid=row["uid"]
+                        )
+            yield from (results[line] for line, text in chunk)
+
+
+def bulk_upsert(
+    model_class: Type[ProsNode],
+    lines: Iterable[str],
+    username: str,
+    chunk_size: int = BULK_UPSERT_CHUNK_SIZE,
+) -> Iterator[dict]:
+    """Upsert entities from NDJSON lines; yields a result per (non-blank) line"""
+    return BulkUpsert(model_class, username).run(lines, chunk_size)
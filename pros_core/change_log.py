@@ -0,0 +1,175 @@
+"""Global, monotonically increasing change sequence.
+
+Every write transaction that changes entities takes the next number from the
+single `(:ProsChangeSequence {name: "global"})` node and records one
+`(:ProsChange {seq, uid, op, types, changedWhen})` per changed entity. Taking the
+number write-locks the sequence node until the transaction ends, so transactions
+commit in sequence order and a client that has seen sequence N has seen every change
+up to N, regardless of the clocks of the workers that made them.
+
+Clients sync a list with `?since_seq=N`, which only reads the (indexed) changes
+after N.
+
+The same transaction sets the sequence number and time of the last change of each
+changed entity and of each of its types on `(:ProsVersion {key, seq, changedWhen})`
+nodes, used as version tokens for conditional requests."""
+
+import datetime
+
+from neomodel import db
+
+# Change operations. `touch` marks entities whose list row or item view changed
+# because of a change to another entity (e.g. a new incoming relation)
+CREATE = "create"
+UPDATE = "update"
+DELETE = "delete"
+RESTORE = "restore"
+MERGE = "merge"
+TOUCH = "touch"
+
+CHANGE_SEQUENCE_NAME = "global"
+
+
+def uid_version_key(uid: str) -> str:
+    return f"uid:{uid}"
+
+
+def type_version_key(entity_type: str) -> str:
+    return f"type:{entity_type}"
+
+
+def record_changes(
+    changes: dict[str, str], types: dict[str, list[str]] | None = None
+) -> int | None:
+    """Record a change operation for each uid, under the next sequence number, in
+    the current transaction.
+
+    The types of each change are the labels of the changed node, unless given
+    in `types` (as they must be for nodes that are about to be deleted).
+    Returns the sequence number, or None if there was nothing to record."""
+    if not changes:
+        return None
+    types = types or {}
+    q = """
+    MERGE (s:ProsChangeSequence {name: $name})
+    SET s.seq = coalesce(s.seq, 0) + 1
+    WITH s.seq AS seq, datetime() AS now
+    UNWIND $changes AS change
+    OPTIONAL MATCH (n:ProsNode {uid: change.uid})
+    WITH seq, now, change, coalesce(change.types, labels(n), []) AS types
+    CREATE (:ProsChange {
+        seq: seq,
+        uid: change.uid,
+        op: change.op,
+        types: types,
+        changedWhen: now
+    })
+    // Keys as built by uid_version_key and type_version_key
+    WITH seq, now, ["uid:" + change.uid] + [t IN types | "type:" + t] AS keys
+    UNWIND keys AS key
+    WITH DISTINCT seq, now, key
+    MERGE (v:ProsVersion {key: key})
+    SET v.seq = seq, v.changedWhen = now
+    RETURN DISTINCT seq
+    """
+    results, meta = db.cypher_query(
+        q,
+        {
+            "name": CHANGE_SEQUENCE_NAME,
+            "changes": [
+                {"uid": uid, "op": op, "types": types.get(uid)}
+                for uid, op in changes.items()
+            ],
+        },
+    )
+    return results[0][0] if results else None
+
+
+def get_version(key: str) -> tuple[int, datetime.datetime | None]:
+    """Sequence number and time of the last change recorded for a version key;
+    0 and None if there is none"""
+    results, meta = db.cypher_query(
+        "MATCH (v:ProsVersion {key: $key}) RETURN v.seq, v.changedWhen", {"key": key}
+    )
+    if not results:
+        return 0, None
+    seq, changed_when = results[0]
+    return seq, changed_when.to_native() if changed_when else None
+
+
+def get_versions(keys: list[str]) -> dict[str, int]:
+    """Sequence number of the last change recorded for each of the version keys
+    (0 for keys without changes)"""
+    results, meta = db.cypher_query(
+        "MATCH (v:ProsVersion) WHERE v.key IN $keys RETURN v.key, v.seq", {"keys": keys}
+    )
+    return {**{key: 0 for key in keys}, **dict(results)}
+
+
+def get_change_seq() -> tuple[int, int]:
+    """Latest sequence number, and the sequence number up to which the change log
+    has been pruned"""
+    results, meta = db.cypher_query(
+        """
+        OPTIONAL MATCH (s:ProsChangeSequence {name: $name})
+        RETURN coalesce(s.seq, 0), coalesce(s.pruned_seq, 0)
+        """,
+        {"name": CHANGE_SEQUENCE_NAME},
+    )
+    return results[0][0], results[0][1]
+
+
+def get_changes_since(
+    entity_type: str | None, since_seq: int
+) -> tuple[int, dict[str, str]]:
+    """Latest sequence number, and the last change operation since `since_seq`
+    of each changed entity of the type (or of any type, if None)"""
+    q = """
+    OPTIONAL MATCH (s:ProsChangeSequence {name: $name})
+    WITH coalesce(s.seq, 0) AS latest
+    OPTIONAL MATCH (c:ProsChange)
+    WHERE $since_seq < c.seq <= latest
+    AND ($entity_type IS NULL OR $entity_type IN c.types)
+    WITH latest, c ORDER BY c.seq
+    // Without changes, c is null: collecting null drops it
+    RETURN latest, COLLECT(CASE WHEN c IS NULL THEN null ELSE [c.uid, c.op] END)
+    """
+    results, meta = db.cypher_query(
+        q,
+        {
+            "name": CHANGE_SEQUENCE_NAME,
+            "entity_type": entity_type,
+            "since_seq": since_seq,
+        },
+    )
+    latest, changes = results[0]
+    # Later changes to an entity supersede earlier ones
+    return latest, {uid: op for uid, op in changes if uid is not None}
+
+
+def prune_changes(before_seq: int, batch_size: int = 10000) -> int:
+    """Delete changes up to and including `before_seq`; returns the number deleted.
+
+    Clients that last synced before this point have to reload the full list."""
+    results, meta = db.cypher_query(
+        """
+        MATCH (c:ProsChange) WHERE c.seq <= $before_seq
+        CALL {
+            WITH c
+            DELETE c
+        } IN TRANSACTIONS OF $batch_size ROWS
+        RETURN count(*)
+        """,
+        {"before_seq": before_seq, "batch_size": batch_size},
+    )
+    db.cypher_query(
+        """
+        MATCH (s:ProsChangeSequence {name: $name})
+        SET s.pruned_seq = CASE
+            WHEN coalesce(s.pruned_seq, 0) > $before_seq THEN s.pruned_seq
+            ELSE $before_seq
+        END
+        """,
+        {"name": CHANGE_SEQUENCE_NAME, "before_seq": before_seq},
+    )
+    return results[0][0] if results else 0
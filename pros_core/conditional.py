@@ -0,0 +1,44 @@
+"""Version-token validators for conditional GET requests (ETag / If-None-Match
+and Last-Modified / If-Modified-Since)"""
+
+import datetime
+
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+# Browsers may store responses, but must revalidate them before each use
+CONDITIONAL_CACHE_CONTROL = "no-cache"
+
+
+def build_etag(*parts) -> str:
+    # Weak, as GZipMiddleware would weaken a strong ETag anyway
+    return 'W/"{}"'.format("-".join(str(part) for part in parts))
+
+
+def conditional_headers(etag: str, last_modified: datetime.datetime | None) -> dict:
+    headers = {"ETag": etag, "Cache-Control": CONDITIONAL_CACHE_CONTROL}
+    if last_modified:
+        headers["Last-Modified"] = http_date(last_modified.timestamp())
+    return headers
+
+
+def strip_weak(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def is_not_modified(
+    request, etag: str, last_modified: datetime.datetime | None = None
+) -> bool:
+    """Whether the client's cached copy, as described by the request's validators,
+    is still current. If-None-Match takes precedence over If-Modified-Since."""
+    if if_none_match := request.META.get("HTTP_IF_NONE_MATCH"):
+        client_etags = parse_etags(if_none_match)
+        return "*" in client_etags or strip_weak(etag) in {
+            strip_weak(client_etag) for client_etag in client_etags
+        }
+    if last_modified and (
+        if_modified_since := parse_http_date_safe(
+            request.META.get("HTTP_IF_MODIFIED_SINCE", "")
+        )
+    ):
+        return int(last_modified.timestamp()) <= if_modified_since
+    return False
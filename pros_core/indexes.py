@@ -0,0 +1,54 @@
+from neomodel import db
+
+from pros_core.setup_app import PROS_MODELS
+
+# Indexes used by Pros queries on top of those created by neomodel's install_labels
+PROS_INDEXES = [
+    "CREATE INDEX prosnode_merge_cluster IF NOT EXISTS FOR (n:ProsNode) ON (n.merge_cluster)",
+    "CREATE INDEX proschange_seq IF NOT EXISTS FOR (c:ProsChange) ON (c.seq)",
+    "CREATE CONSTRAINT proschangesequence_name IF NOT EXISTS "
+    "FOR (s:ProsChangeSequence) REQUIRE s.name IS UNIQUE",
+    "CREATE CONSTRAINT prosversion_key IF NOT EXISTS "
+    "FOR (v:ProsVersion) REQUIRE v.key IS UNIQUE",
+    "CREATE INDEX prosoutboxevent_available_at IF NOT EXISTS "
+    "FOR (e:ProsOutboxEvent) ON (e.available_at)",
+    "CREATE CONSTRAINT prosoutboxevent_id IF NOT EXISTS "
+    "FOR (e:ProsOutboxEvent) REQUIRE e.id IS UNIQUE",
+]
+
+
+def fulltext_index_name(model_name: str) -> str:
+    return f"{model_name.lower()}_label_fulltext"
+
+
+def build_fulltext_indexes() -> list[str]:
+    """Label full-text index for every (non-inline) Pros model with a label"""
+    return [
+        f"CREATE FULLTEXT INDEX {fulltext_index_name(model_name)} IF NOT EXISTS "
+        f"FOR (n:{model.model.__name__}) ON EACH [n.label] "
+        "OPTIONS {indexConfig: {`fulltext.analyzer`: 'standard-no-stop-words'}}"
+        for model_name, model in PROS_MODELS.items()
+        if "label" in model.properties and not model.meta.get("inline_only")
+    ]
+
+
+def list_order_index_name(model_name: str) -> str:
+    return f"{model_name.lower()}_label_uid"
+
+
+def build_list_order_indexes() -> list[str]:
+    """(label, uid) range index for every (non-inline) Pros model, backing the keyset
+    order of the paginated list query (see pros_core.queries)"""
+    return [
+        f"CREATE INDEX {list_order_index_name(model_name)} IF NOT EXISTS "
+        f"FOR (n:{model.model.__name__}) ON (n.label, n.uid)"
+        for model_name, model in PROS_MODELS.items()
+        if not model.meta.get("inline_only")
+    ]
+
+
+def install_pros_indexes(stdout=None):
+    for index_query in PROS_INDEXES + build_fulltext_indexes() + build_list_order_indexes():
+        db.cypher_query(index_query)
+        if stdout:
+            stdout.write(f" + {index_query}\n")
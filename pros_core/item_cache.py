@@ -0,0 +1,91 @@
+"""Bounded LRU cache of item responses, invalidated by the entities they depend on.
+
+Each response is stored with the version of the item it was built at (see
+change_log), and is only returned for that version, so a response built from data
+read before a concurrent write can never outlive it. Responses are also dropped as
+soon as any entity they include changes, via `entities_changed`."""
+
+import threading
+from collections import OrderedDict
+
+from pros_core.metrics import METRICS
+
+
+def get_item_dependencies(item) -> set[str]:
+    """uids of all entities included in an item response"""
+    dependencies = set()
+    stack = [item]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            if isinstance(uid := value.get("uid"), str):
+                dependencies.add(uid)
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+    return dependencies
+
+
+class ItemCache:
+    def __init__(self, maxsize: int, metrics_prefix: str = "item_cache"):
+        self.maxsize = maxsize
+        self.metrics_prefix = metrics_prefix
+        self.lock = threading.RLock()
+        # uid -> (version, item, dependencies), least recently used first
+        self.entries: OrderedDict[str, tuple[int, dict, set[str]]] = OrderedDict()
+        # dependency uid -> uids of the cached items including it
+        self.dependents: dict[str, set[str]] = {}
+
+    def count(self, name: str, n: int = 1):
+        METRICS.increment(f"{self.metrics_prefix}.{name}", n)
+
+    def get(self, uid: str, version: int) -> dict | None:
+        with self.lock:
+            entry = self.entries.get(uid)
+            if entry is None or entry[0] != version:
+                self.count("misses")
+                return None
+            self.entries.move_to_end(uid)
+            self.count("hits")
+            return entry[1]
+
+    def _remove(self, uid: str):
+        version, item, dependencies = self.entries.pop(uid)
+        for dependency in dependencies:
+            if dependents := self.dependents.get(dependency):
+                dependents.discard(uid)
+                if not dependents:
+                    del self.dependents[dependency]
+
+    def put(self, uid: str, version: int, item: dict):
+        if self.maxsize <= 0:
+            return
+        dependencies = get_item_dependencies(item) | {uid}
+        with self.lock:
+            if uid in self.entries:
+                self._remove(uid)
+            self.entries[uid] = (version, item, dependencies)
+            for dependency in dependencies:
+                self.dependents.setdefault(dependency, set()).add(uid)
+            while len(self.entries) > self.maxsize:
+                self._remove(next(iter(self.entries)))
+                self.count("evictions")
+
+    def invalidate(self, uids: set[str]):
+        """Drop the cached items that include any of the entities"""
+        with self.lock:
+            stale = set()
+            for uid in uids:
+                stale |= self.dependents.get(uid, set())
+            for uid in stale:
+                self._remove(uid)
+            self.count("invalidations", len(stale))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.dependents.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"size": len(self.entries), "maxsize": self.maxsize}
@@ -0,0 +1,418 @@
+"""Retrieval of entities with their relations, as independent per-facet
+queries run concurrently and assembled in Python.
+
+After the nodes (one or a batch) and their merged nodes are found, the facets of
+all of them (incoming, outgoing, incoming via inline nodes, and inline nodes) are each
+fetched by one query, on separate sessions. Each node is assembled as its properties, then its
+inline nodes, then its outgoing, incoming and incoming-inline relations grouped by
+relation name, with later groups taking precedence over earlier keys.
+
+Neighbouring nodes are projected in the queries to the fields needed to display them
+(DEFAULT_RELATED_FIELDS), unless other fields are asked for.
+
+Only the first RELATION_PREVIEW_SIZE incoming relations of each name are included
+(by label), with the total of each in `relation_totals`, as entities such as places
+or sources can have thousands; the rest are paged with `get_relation_page`, from
+the cursor of each name in `relation_next`."""
+
+import concurrent.futures
+
+from neomodel import db
+
+# Facet queries run at once for one request. Each request has its own workers, so
+# that concurrent requests do not queue behind each other's facets
+ITEM_FACET_WORKERS = 4
+
+# Fields of the nodes related to the inline nodes of merged nodes
+MERGED_INLINE_RELATED_FIELDS = [
+    "uid",
+    "real_type",
+    "label",
+    "is_deleted",
+    "rel_type",
+    "deleted_and_has_dependent_nodes",
+]
+
+# Fields of neighbouring nodes returned by default: enough to display and link them
+DEFAULT_RELATED_FIELDS = ["uid", "label", "real_type", "is_deleted"]
+
+# Fields of the main node always returned when its fields are restricted
+ITEM_REQUIRED_FIELDS = {"uid", "real_type"}
+
+# Incoming relations of each name included in an item
+RELATION_PREVIEW_SIZE = 50
+
+RELATION_PAGE_SIZE = 50
+RELATION_PAGE_SIZE_MAX = 500
+
+# Keys incoming relations can be ordered by (with the uid of the related node)
+RELATION_ORDERINGS = {
+    "label": 'coalesce(o.label, "")',
+    "date": """coalesce(toString(head([
+        (o)-[date_rel]->(date_node)
+        WHERE date_rel.inline AND date_node.earliest_possible_conservative IS NOT NULL
+        | date_node.earliest_possible_conservative
+    ])), "")""",
+}
+
+
+def projected(node: str) -> str:
+    """Properties of a node, restricted to $related_keys unless they are null"""
+    return f"""CASE
+    WHEN {node} IS NULL THEN null
+    WHEN $related_keys IS NULL THEN properties({node})
+    ELSE apoc.map.fromPairs([k IN $related_keys WHERE {node}[k] IS NOT NULL | [k, {node}[k]]])
+END"""
+
+
+MAIN_QUERY = """
+UNWIND $uids AS uid
+MATCH (main:ProsNode {uid: uid})
+OPTIONAL MATCH (mn:ProsNode {merge_cluster: main.merge_cluster})
+WHERE mn <> main
+RETURN main, COLLECT(mn)
+"""
+
+def rel_types_pattern(rel_types: set[str] | None) -> str:
+    """Relationship type expression matching any of the types, or any type if None"""
+    if rel_types is None:
+        return ""
+    return ":" + "|".join(f"`{t}`" for t in sorted(rel_types))
+
+
+def build_facet_queries(
+    incoming: set[str] | None = None,
+    outgoing: set[str] | None = None,
+    incoming_inline: set[str] | None = None,
+    passthrough: set[str] | None = None,
+    inline: set[str] | None = None,
+    inline_related: set[str] | None = None,
+) -> dict[str, str | None]:
+    """Facet queries matching relations of the given types (any type if None).
+
+    A facet whose relations cannot have any type is None, and is not queried."""
+    queries = {}
+
+    # The relations of each name are counted, then only the first $relation_limit
+    # of them are sorted and projected, with their sort keys for paging on
+    queries["incoming"] = (
+        f"""
+UNWIND $uids AS uid
+MATCH (n:ProsNode {{uid: uid}})
+CALL {{
+    WITH n
+    MATCH (n)<-[r{rel_types_pattern(incoming)}]-(o)
+    WHERE r.inline IS NULL AND NOT r:MERGED
+    RETURN toLower(r.reverse_name) AS rel_name, count(*) AS total
+}}
+CALL {{
+    WITH n, rel_name
+    MATCH (n)<-[r{rel_types_pattern(incoming)}]-(o)
+    WHERE r.inline IS NULL AND NOT r:MERGED AND toLower(r.reverse_name) = rel_name
+    WITH r, o, {RELATION_ORDERINGS["label"]} AS sort_key
+    ORDER BY sort_key, o.uid
+    LIMIT $relation_limit
+    RETURN COLLECT([r, {projected("o")}, sort_key]) AS rows
+}}
+RETURN uid, rel_name, total, rows"""
+        if incoming != set()
+        else None
+    )
+
+    queries["outgoing"] = (
+        f"""
+UNWIND $uids AS uid
+MATCH (n:ProsNode {{uid: uid}})-[r{rel_types_pattern(outgoing)}]->(o)
+WHERE r.inline IS NULL AND NOT r:MERGED
+RETURN uid, toLower(type(r)), r, {projected("o")}"""
+        if outgoing != set()
+        else None
+    )
+
+    queries["incoming_inline"] = (
+        f"""
+UNWIND $uids AS uid
+MATCH (n:ProsNode {{uid: uid}})<-[r{rel_types_pattern(incoming_inline)}]-(inline_node)<-[passthrough_rel{rel_types_pattern(passthrough)}]-(o)
+WHERE o.uid <> n.uid AND NOT r:MERGED AND passthrough_rel.inline
+RETURN uid, toLower(r.reverse_name), {projected("o")}"""
+        if incoming_inline != set() and passthrough != set()
+        else None
+    )
+
+    related_match = (
+        f"""OPTIONAL MATCH (inline_node)-[related_rel{rel_types_pattern(inline_related)}]->(related_node)
+WHERE NOT related_rel:MERGED"""
+        if inline_related != set()
+        else "WITH uid, inline_rel, inline_node, null AS related_rel, null AS related_node"
+    )
+    queries["inlines"] = (
+        f"""
+UNWIND $uids AS uid
+MATCH (n:ProsNode {{uid: uid}})-[inline_rel{rel_types_pattern(inline)}]->(inline_node)
+WHERE inline_node.uid <> n.uid AND inline_rel.inline
+{related_match}
+RETURN uid, toLower(type(inline_rel)), inline_node,
+    COLLECT([toLower(type(related_rel)), {projected("related_node")}])"""
+        if inline != set()
+        else None
+    )
+    return queries
+
+
+# Facet queries for nodes of any type
+FACET_QUERIES = build_facet_queries()
+
+
+def deleted_and_has_dependent_nodes(node: dict) -> bool:
+    return bool(node.get("is_deleted")) and (node.get("inbound_count") or 0) > 0
+
+
+# Keyset-paginated incoming relations of one name, by each ordering
+RELATION_PAGE_QUERIES = {
+    order: f"""
+MATCH (n:ProsNode {{uid: $uid}})
+CALL {{
+    WITH n
+    MATCH (n)<-[r]-(o)
+    WHERE r.inline IS NULL AND NOT r:MERGED AND toLower(r.reverse_name) = $rel_name
+    RETURN count(*) AS total
+}}
+CALL {{
+    WITH n
+    MATCH (n)<-[r]-(o)
+    WHERE r.inline IS NULL AND NOT r:MERGED AND toLower(r.reverse_name) = $rel_name
+    WITH r, o, {sort_key} AS sort_key
+    WHERE $after_key IS NULL
+        OR sort_key > $after_key
+        OR (sort_key = $after_key AND o.uid > $after_uid)
+    WITH r, o, sort_key
+    ORDER BY sort_key, o.uid
+    LIMIT $limit
+    RETURN COLLECT([r, {projected("o")}, sort_key]) AS rows
+}}
+RETURN total, rows
+"""
+    for order, sort_key in RELATION_ORDERINGS.items()
+}
+
+
+def query_facet(query: str, uids: list[str], related_keys: list[str] | None) -> list:
+    results, meta = db.cypher_query(
+        query,
+        {
+            "uids": uids,
+            "related_keys": related_keys,
+            "relation_limit": RELATION_PREVIEW_SIZE,
+        },
+    )
+    return results
+
+
+def get_related_keys(related_fields: list[str] | None) -> list[str] | None:
+    """Properties of related nodes to query: the uid is always needed, and the
+    inbound counter to tell whether deleted neighbours have dependents"""
+    if related_fields is None:
+        return None
+    return list(dict.fromkeys(["uid", *related_fields, "inbound_count"]))
+
+
+def build_related_node_view(
+    node, rel_type: str, related_fields: list[str] | None, rel=None
+) -> dict:
+    view = dict(node)
+    if rel is not None:
+        view["relData"] = dict(rel)
+    view["rel_type"] = rel_type
+    view["deleted_and_has_dependent_nodes"] = deleted_and_has_dependent_nodes(view)
+    if related_fields is not None and "inbound_count" not in related_fields:
+        view.pop("inbound_count", None)
+    return view
+
+
+def get_items(
+    uids: list[str],
+    fields: list[str] | None = None,
+    related_fields: list[str] | None = DEFAULT_RELATED_FIELDS,
+) -> tuple[dict[str, dict], list[str]]:
+    """Items of the given uids, keyed by uid, and the uids that were not found.
+
+    The properties of the main (and merged) nodes are restricted to `fields`, and
+    those of neighbouring nodes to `related_fields`, unless these are None."""
+    related_keys = get_related_keys(related_fields)
+
+    def related_node_view(node, rel_type: str, rel=None) -> dict:
+        return build_related_node_view(node, rel_type, related_fields, rel)
+
+    # Compiled per model at startup, after this module is imported
+    from pros_core.setup_app import PROS_MODELS
+
+    # Imported here, as the viewsets use this module
+    from pros_core.viewsets import encode_list_cursor
+
+    results, meta = db.cypher_query(MAIN_QUERY, {"uids": list(uids)})
+    mains = {main["uid"]: (main, merged) for main, merged in results}
+
+    # Nodes are queried with the facet queries of their type, so that only the
+    # relation types the type can have are expanded
+    uids_by_type = {}
+    for main, merged in mains.values():
+        for node in (main, *merged):
+            uids_by_type.setdefault(node.get("real_type"), {})[node["uid"]] = None
+
+    facet_jobs = []
+    for real_type, type_uids in uids_by_type.items():
+        app_model = PROS_MODELS.get(real_type)
+        facet_queries = app_model.item_queries if app_model else FACET_QUERIES
+        for name, query in facet_queries.items():
+            if query is not None:
+                facet_jobs.append((name, query, list(type_uids)))
+
+    # Facet rows of each node
+    facets = {}
+    if facet_jobs:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(ITEM_FACET_WORKERS, len(facet_jobs)),
+            thread_name_prefix="item-facet",
+        ) as executor:
+            futures = [
+                (name, executor.submit(query_facet, query, type_uids, related_keys))
+                for name, query, type_uids in facet_jobs
+            ]
+            for name, future in futures:
+                for row in future.result():
+                    facets.setdefault(row[0], {}).setdefault(name, []).append(
+                        row[1:]
+                    )
+
+    def group_by_rel_type(views: list[dict]) -> dict:
+        grouped = {}
+        for view in views:
+            if view["rel_type"] is not None:
+                grouped.setdefault(view["rel_type"], []).append(view)
+        return grouped
+
+    def node_view(node, is_main: bool) -> dict:
+        """Relation data is only given for the relations of a main node, and the
+        nodes related to the inline nodes of merged nodes are summarised"""
+        node_facets = facets.get(node["uid"], {})
+        view = build_node_view(node, is_main, node_facets)
+        if fields is not None:
+            return {
+                k: v for k, v in view.items() if k in fields or k in ITEM_REQUIRED_FIELDS
+            }
+        return view
+
+    def build_node_view(node, is_main: bool, node_facets: dict) -> dict:
+        inline_views = {}
+        for inline_key, inline_node, related in node_facets.get("inlines", []):
+            related_views = [
+                related_node_view(related_node, rel_type)
+                for rel_type, related_node in related
+                if related_node is not None
+            ]
+            if not is_main:
+                related_views = [
+                    {k: view.get(k) for k in MERGED_INLINE_RELATED_FIELDS}
+                    for view in related_views
+                ]
+            inline_views[inline_key] = {
+                **dict(inline_node),
+                "type": inline_node.get("real_type"),
+                **group_by_rel_type(related_views),
+            }
+
+        return {
+            **dict(node),
+            **inline_views,
+            "deleted_and_has_dependent_nodes": deleted_and_has_dependent_nodes(node),
+            **group_by_rel_type(
+                related_node_view(related, rel_type, rel if is_main else None)
+                for rel_type, rel, related in node_facets.get("outgoing", [])
+            ),
+            **group_by_rel_type(
+                related_node_view(related, rel_type, rel if is_main else None)
+                for rel_type, total, rows in node_facets.get("incoming", [])
+                for rel, related, sort_key in rows
+            ),
+            **group_by_rel_type(
+                related_node_view(related, rel_type)
+                for rel_type, related in node_facets.get("incoming_inline", [])
+            ),
+            "relation_totals": {
+                rel_type: total
+                for rel_type, total, rows in node_facets.get("incoming", [])
+                if rel_type is not None
+            },
+            # Cursor to page on from (see get_relation_page), for each name with
+            # more relations than are included
+            "relation_next": {
+                rel_type: encode_list_cursor(rows[-1][2], rows[-1][1]["uid"])
+                for rel_type, total, rows in node_facets.get("incoming", [])
+                if rel_type is not None and total > len(rows)
+            },
+        }
+
+    items = {}
+    for uid, (main, merged) in mains.items():
+        item = node_view(main, is_main=True)
+        if merged:
+            item["merged_items"] = [node_view(m, is_main=False) for m in merged]
+            item["is_merged_item"] = True
+        else:
+            item["is_merged_item"] = False
+        items[uid] = item
+    return items, [uid for uid in uids if uid not in items]
+
+
+def get_item(
+    model_class,
+    uid: str,
+    fields: list[str] | None = None,
+    related_fields: list[str] | None = DEFAULT_RELATED_FIELDS,
+) -> dict:
+    items, missing = get_items([uid], fields=fields, related_fields=related_fields)
+    if missing:
+        raise model_class.DoesNotExist(
+            f"""<{model_class.__name__} uid={uid}> not found."""
+        )
+    return items[uid]
+
+
+def get_relation_page(
+    uid: str,
+    rel_name: str,
+    order: str = "label",
+    after: tuple[str, str] | None = None,
+    limit: int = RELATION_PAGE_SIZE,
+    related_fields: list[str] | None = DEFAULT_RELATED_FIELDS,
+) -> dict | None:
+    """One keyset-paginated page of the incoming relations of an entity with a
+    name, ordered by `order` (a key of RELATION_ORDERINGS) then uid, with the total
+    number of them and the (sort key, uid) after which the next page starts, if any.
+    None if the entity does not exist."""
+    after_key, after_uid = after or (None, None)
+    results, meta = db.cypher_query(
+        RELATION_PAGE_QUERIES[order],
+        {
+            "uid": uid,
+            "rel_name": rel_name.lower(),
+            "after_key": after_key,
+            "after_uid": after_uid,
+            # One extra row to find out whether there is a next page
+            "limit": limit + 1,
+            "related_keys": get_related_keys(related_fields),
+        },
+    )
+    if not results:
+        return None
+    total, rows = results[0]
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "results": [
+            build_related_node_view(related, rel_name.lower(), related_fields, rel)
+            for rel, related, sort_key in rows
+        ],
+        "total": total,
+        "next": (rows[-1][2], rows[-1][1]["uid"]) if has_next else None,
+    }
@@ -0,0 +1,238 @@
+import bisect
+import heapq
+import logging
+import threading
+import time
+from array import array
+
+from neomodel import db
+
+from pros_core import change_log
+
+logger = logging.getLogger(__name__)
+
+# Trigram postings are only used for queries at least this long;
+# shorter queries scan the (in-memory) labels directly
+TRIGRAM_LENGTH = 3
+
+
+def trigrams(text: str) -> set[str]:
+    return {text[i : i + TRIGRAM_LENGTH] for i in range(len(text) - TRIGRAM_LENGTH + 1)}
+
+
+class TrigramLabelIndex:
+    """In-process trigram index over the labels of all (non-inline) Pros entities,
+    answering substring and prefix autocomplete queries without touching Neo4j.
+
+    Documents are stored in parallel arrays indexed by a document id; postings map
+    each trigram to an array of document ids in ascending order. Updated or removed
+    documents are tombstoned, and the index is compacted once half of it is dead.
+
+    Searches never query the database once the index is loaded. Writes by this
+    process are refreshed as they commit (see `refresh`); the index also records the
+    change sequence number (see change_log) it reflects, and `sync` catches up with
+    the entities changed since then by any process, from a background thread."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # Held while entities are read and applied, so that updates are applied in
+        # the order they were read; searches only wait on `lock`, for the in-memory part
+        self.update_lock = threading.RLock()
+        self.loaded = False
+        self.clear()
+
+    def clear(self):
+        self.uids: list[str] = []
+        self.labels: list[str] = []
+        self.lower_labels: list[str] = []
+        self.type_ids = array("H")
+        self.is_deleted = bytearray()
+        self.alive = bytearray()
+        self.doc_ids: dict[str, int] = {}
+        self.postings: dict[str, array] = {}
+        self.type_names: list[str] = []
+        self.type_name_ids: dict[str, int] = {}
+        self.dead_count = 0
+        self.seq = 0
+
+    def query_entities(self, uids: list[str] | None = None) -> list[list]:
+        q = """
+        MATCH (n:ProsNode)
+        WHERE n.label IS NOT NULL AND NOT n:ProsInlineOnlyNode
+        AND ($uids IS NULL OR n.uid IN $uids)
+        RETURN n.uid, n.label, n.real_type, coalesce(n.is_deleted, false)
+        """
+        results, meta = db.cypher_query(q, {"uids": uids})
+        return results
+
+    def load(self):
+        with self.update_lock:
+            # Read before the entities, so that they include every change up to it
+            seq, pruned_seq = change_log.get_change_seq()
+            entities = self.query_entities()
+            with self.lock:
+                self.clear()
+                for uid, label, real_type, is_deleted in entities:
+                    self._add(uid, label, real_type, is_deleted)
+                self.seq = seq
+                self.loaded = True
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            with self.update_lock:
+                if not self.loaded:
+                    self.load()
+
+    def sync_in_background(self, interval: float = 2.0):
+        """Build the index in a daemon thread, so that the first autocomplete
+        request does not have to wait for it, then sync it every `interval` seconds"""
+
+        def run():
+            while True:
+                try:
+                    self.sync()
+                except Exception:
+                    logger.exception("Could not sync label index")
+                time.sleep(interval)
+
+        threading.Thread(target=run, name="label-index-sync", daemon=True).start()
+
+    def _type_id(self, real_type: str) -> int:
+        if real_type not in self.type_name_ids:
+            self.type_name_ids[real_type] = len(self.type_names)
+            self.type_names.append(real_type)
+        return self.type_name_ids[real_type]
+
+    def _add(self, uid: str, label: str, real_type: str, is_deleted: bool):
+        doc_id = len(self.uids)
+        lower_label = label.lower()
+        self.uids.append(uid)
+        self.labels.append(label)
+        self.lower_labels.append(lower_label)
+        self.type_ids.append(self._type_id(real_type))
+        self.is_deleted.append(bool(is_deleted))
+        self.alive.append(1)
+        self.doc_ids[uid] = doc_id
+        for trigram in trigrams(lower_label):
+            if trigram not in self.postings:
+                self.postings[trigram] = array("I")
+            self.postings[trigram].append(doc_id)
+
+    def _remove(self, uid: str):
+        if (doc_id := self.doc_ids.pop(uid, None)) is not None:
+            self.alive[doc_id] = 0
+            self.dead_count += 1
+
+    def _compact(self):
+        documents = [
+            (self.uids[i], self.labels[i], self.type_names[self.type_ids[i]], self.is_deleted[i])
+            for i in range(len(self.uids))
+            if self.alive[i]
+        ]
+        self.clear()
+        for document in documents:
+            self._add(*document)
+
+    def sync(self):
+        """Catch up with the changes committed since the index was last synced"""
+        if not self.loaded:
+            self.ensure_loaded()
+            return
+        latest_seq, pruned_seq = change_log.get_change_seq()
+        if latest_seq == self.seq:
+            return
+        with self.update_lock:
+            if self.seq < pruned_seq:
+                # The changes to catch up with are no longer in the change log
+                self.load()
+                return
+            latest_seq, changes = change_log.get_changes_since(None, self.seq)
+            if changes:
+                self.refresh(set(changes))
+            self.seq = latest_seq
+
+    def refresh(self, uids: set[str]):
+        """Re-read the given entities from the database, updating or removing them"""
+        with self.update_lock:
+            if not self.loaded:
+                return
+            entities = self.query_entities(list(uids))
+            with self.lock:
+                found = set()
+                for uid, label, real_type, is_deleted in entities:
+                    found.add(uid)
+                    doc_id = self.doc_ids.get(uid)
+                    if doc_id is not None and self.labels[doc_id] == label:
+                        # Label unchanged: postings can stay as they are
+                        self.type_ids[doc_id] = self._type_id(real_type)
+                        self.is_deleted[doc_id] = bool(is_deleted)
+                    else:
+                        self._remove(uid)
+                        self._add(uid, label, real_type, is_deleted)
+                for uid in set(uids) - found:
+                    self._remove(uid)
+                if self.dead_count > len(self.doc_ids):
+                    self._compact()
+
+    def _candidates(self, text: str):
+        """Document ids that may contain text"""
+        if len(text) < TRIGRAM_LENGTH:
+            return range(len(self.uids))
+        postings = sorted(
+            (self.postings.get(trigram, array("I")) for trigram in trigrams(text)), key=len
+        )
+        smallest, others = postings[0], postings[1:]
+        return (
+            doc_id
+            for doc_id in smallest
+            if all(
+                (i := bisect.bisect_left(posting, doc_id)) < len(posting) and posting[i] == doc_id
+                for posting in others
+            )
+        )
+
+    def search(
+        self, text: str, real_types: set[str] | None = None, k: int = 20
+    ) -> list[dict]:
+        """Top-k entities whose label contains `text`, ranked by label prefix matches,
+        then word prefix matches, then match position and label length"""
+        # Only queries the database if the index has not been built yet
+        self.ensure_loaded()
+        text = text.lower().strip()
+        if not text:
+            return []
+
+        with self.lock:
+            type_ids = (
+                {self.type_name_ids[t] for t in real_types if t in self.type_name_ids}
+                if real_types is not None
+                else None
+            )
+            matches = []
+            for doc_id in self._candidates(text):
+                if not self.alive[doc_id]:
+                    continue
+                if type_ids is not None and self.type_ids[doc_id] not in type_ids:
+                    continue
+                label = self.lower_labels[doc_id]
+                position = label.find(text)
+                if position == -1:
+                    continue
+                word_start = position == 0 or not label[position - 1].isalnum()
+                matches.append(
+                    ((position != 0, not word_start, position, len(label), label), doc_id)
+                )
+
+            return [
+                {
+                    "uid": self.uids[doc_id],
+                    "label": self.labels[doc_id],
+                    "real_type": self.type_names[self.type_ids[doc_id]],
+                    "is_deleted": bool(self.is_deleted[doc_id]),
+                }
+                for _, doc_id in heapq.nsmallest(k, matches)
+            ]
+
+
+LABEL_INDEX = TrigramLabelIndex()
+
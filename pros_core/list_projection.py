@@ -0,0 +1,176 @@
+import bisect
+import datetime
+import threading
+import time
+from typing import Callable, NamedTuple
+
+from pros_core import change_log
+from pros_core.models import ProsNode
+
+
+def row_sort_key(row: dict) -> tuple[str, str]:
+    """Sort key of a list row, matching the (label, uid) keyset ordering of the
+    paginated list query"""
+    return row.get("label") or "", row["uid"]
+
+
+class ListVersion(NamedTuple):
+    """What a list reflects: at least the version of its type (see change_log) and
+    the time of its change, and every change up to the sequence number `seq`"""
+
+    version: int
+    changed_when: datetime.datetime | None
+    seq: int
+
+
+def read_list_version(type_name: str) -> ListVersion:
+    """Version of a type's list, to be read before its rows"""
+    version, changed_when = change_log.get_version(change_log.type_version_key(type_name))
+    # Read after the version, so that it is at least the version
+    seq, pruned_seq = change_log.get_change_seq()
+    return ListVersion(version, changed_when, seq)
+
+
+class ListProjection:
+    """Materialized list rows of one Pros model, kept sorted by (label, uid).
+
+    Loaded in full on first read. Reads then check the version of the type in the
+    change log at most once every `check_interval` seconds (or on the next read
+    after a write by this process, see `expire`), and if it has changed, patch in
+    freshly-queried rows for the entities changed after the sequence number the
+    projection reflects. This catches up with writes made by any process, in the
+    order they committed."""
+
+    def __init__(
+        self, model_class: type[ProsNode], query_rows: Callable, check_interval: float = 1.0
+    ):
+        self.model_class = model_class
+        self.query_rows = query_rows
+        self.check_interval = check_interval
+        self.rows: dict[str, dict] = {}
+        self.keys: list[tuple[str, str]] = []
+        self.loaded = False
+        self.list_version: ListVersion | None = None
+        # time.monotonic() of the last version check, None to check on the next read
+        self.checked_at: float | None = None
+        self.lock = threading.RLock()
+        self._ordered_rows = None
+
+    def load(self):
+        with self.lock:
+            self.checked_at = time.monotonic()
+            list_version = read_list_version(self.model_class.__name__)
+            rows = self.query_rows(self.model_class)
+            self.rows = {row["uid"]: row for row in rows}
+            self.keys = sorted(row_sort_key(row) for row in rows)
+            self._ordered_rows = None
+            self.list_version = list_version
+            self.loaded = True
+
+    def expire(self):
+        """Check the version on the next read, rather than waiting out the interval"""
+        self.checked_at = None
+
+    def sync(self) -> ListVersion:
+        """Catch up with the changes to the type since the projection was last
+        synced; returns the version it now reflects"""
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    self.load()
+                return self.list_version
+
+        now = time.monotonic()
+        checked_at = self.checked_at
+        if checked_at is not None and now - checked_at < self.check_interval:
+            return self.list_version
+        # Set before reading the version, so that an expire() for a write committed
+        # after the read still has the next read check again
+        self.checked_at = now
+        version, changed_when = change_log.get_version(
+            change_log.type_version_key(self.model_class.__name__)
+        )
+        if version <= self.list_version.version:
+            return self.list_version
+
+        with self.lock:
+            # Another read may have caught up while this one waited for the lock
+            if version > self.list_version.version:
+                latest_seq, pruned_seq = change_log.get_change_seq()
+                if self.list_version.seq < pruned_seq:
+                    # The changes to catch up with are no longer in the change log
+                    self.load()
+                else:
+                    latest_seq, changes = change_log.get_changes_since(
+                        self.model_class.__name__, self.list_version.seq
+                    )
+                    if changes:
+                        self.patch(set(changes))
+                    self.list_version = ListVersion(version, changed_when, latest_seq)
+            return self.list_version
+
+    def remove(self, uid: str):
+        if old_row := self.rows.pop(uid, None):
+            key = row_sort_key(old_row)
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def patch(self, uids: set[str]):
+        """Re-query the rows for `uids`, replacing or removing them in the projection"""
+        with self.lock:
+            # Query under the lock, so concurrent patches are applied in order
+            rows = self.query_rows(self.model_class, uids=list(uids))
+            for uid in uids:
+                self.remove(uid)
+            for row in rows:
+                self.rows[row["uid"]] = row
+                bisect.insort(self.keys, row_sort_key(row))
+            self._ordered_rows = None
+
+    def all(self) -> tuple[list[dict], ListVersion]:
+        """All rows, and the version they reflect"""
+        # Synced outside the lock; the rows read after it may be newer, never older
+        list_version = self.sync()
+        with self.lock:
+            if self._ordered_rows is None:
+                self._ordered_rows = [self.rows[uid] for _, uid in self.keys]
+            return self._ordered_rows, list_version
+
+    def page(
+        self, after: tuple[str, str] | None, limit: int
+    ) -> tuple[list[dict], bool, ListVersion]:
+        """Return up to `limit` rows after the (label, uid) cursor, whether there
+        are more rows after them, and the version they reflect"""
+        list_version = self.sync()
+        with self.lock:
+            start = bisect.bisect_right(self.keys, after) if after else 0
+            keys = self.keys[start : start + limit + 1]
+            return (
+                [self.rows[uid] for _, uid in keys[:limit]],
+                len(keys) > limit,
+                list_version,
+            )
+
+
+class ListProjectionRegistry:
+    """Per-model ListProjections, created on first use"""
+
+    def __init__(self, query_rows: Callable, check_interval: float = 1.0):
+        self.query_rows = query_rows
+        self.check_interval = check_interval
+        self.projections: dict[str, ListProjection] = {}
+        self.lock = threading.Lock()
+
+    def get(self, model_class: type[ProsNode]) -> ListProjection:
+        model_name = model_class.__name__.lower()
+        with self.lock:
+            if model_name not in self.projections:
+                self.projections[model_name] = ListProjection(
+                    model_class, self.query_rows, self.check_interval
+                )
+            return self.projections[model_name]
+
+    def expire(self):
+        """Have every projection check its version on its next read, after a write
+        by this process"""
+        for projection in list(self.projections.values()):
+            projection.expire()
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pros_core.viewsets import LIST_SNAPSHOTS
+
+
+class Command(BaseCommand):
+    help = "Build the precompressed full-list snapshot files of all types that have changed"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Rebuild every snapshot, not only those of changed types",
+        )
+
+    def handle(self, *args, **options):
+        if LIST_SNAPSHOTS is None:
+            raise CommandError("PROS_SNAPSHOT_DIR is not set")
+        if options["all"]:
+            for model_class in LIST_SNAPSHOTS.model_classes.values():
+                LIST_SNAPSHOTS.build(model_class)
+            rebuilt = list(LIST_SNAPSHOTS.model_classes)
+        else:
+            rebuilt = LIST_SNAPSHOTS.rebuild_stale()
+        self.stdout.write(self.style.SUCCESS(f"Built {len(rebuilt)} list snapshots"))
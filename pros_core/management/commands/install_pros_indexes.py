@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from pros_core.indexes import install_pros_indexes
+
+
+class Command(BaseCommand):
+    help = "Create the Neo4j indexes used by Pros queries (run after install_labels)"
+
+    def handle(self, *args, **options):
+        install_pros_indexes(stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS("Pros indexes installed"))
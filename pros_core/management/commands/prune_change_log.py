@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pros_core.change_log import get_change_seq, prune_changes
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete old entries from the change log. Clients that last synced "
+        "before the pruned sequence number reload their lists in full"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep",
+            type=int,
+            default=100000,
+            help="Number of most recent sequence numbers to keep",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10000,
+            help="Number of changes to delete per transaction",
+        )
+
+    def handle(self, *args, **options):
+        if options["keep"] < 0:
+            raise CommandError("--keep must not be negative")
+        latest, pruned = get_change_seq()
+        before_seq = latest - options["keep"]
+        if before_seq <= pruned:
+            self.stdout.write("Nothing to prune")
+            return
+        deleted = prune_changes(before_seq, batch_size=options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Pruned {deleted} changes up to sequence {before_seq}")
+        )
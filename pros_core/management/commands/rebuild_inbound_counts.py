@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+
+from neomodel import config, db
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill or repair the inbound relation counter on all ProsNodes, "
+        "used to determine whether deleted nodes still have dependent nodes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of nodes to update per transaction",
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report nodes with an incorrect counter, without repairing them",
+        )
+
+    def handle(self, *args, **options):
+        count_property = config.INBOUND_COUNT_PROPERTY
+        params = {"excluded_types": list(config.INBOUND_COUNT_EXCLUDED_TYPES)}
+
+        count_query = """
+        MATCH (n:ProsNode)
+        CALL {
+            WITH n
+            OPTIONAL MATCH (n)<-[r]-()
+            WHERE NOT type(r) IN $excluded_types
+            RETURN count(r) AS inbound_count
+        }
+        """
+
+        if options["check"]:
+            results, meta = db.cypher_query(
+                count_query
+                + f"""
+                WITH n, inbound_count
+                WHERE coalesce(n.{count_property}, -1) <> inbound_count
+                RETURN n.uid, n.real_type, n.{count_property}, inbound_count
+                """,
+                params,
+            )
+            for uid, real_type, stored, actual in results:
+                self.stdout.write(f"{real_type} {uid}: stored {stored}, actual {actual}")
+            self.stdout.write(f"{len(results)} nodes with incorrect inbound count")
+            return
+
+        results, meta = db.cypher_query(
+            f"""
+            MATCH (n:ProsNode)
+            CALL {{
+                WITH n
+                OPTIONAL MATCH (n)<-[r]-()
+                WHERE NOT type(r) IN $excluded_types
+                WITH n, count(r) AS inbound_count
+                SET n.{count_property} = inbound_count
+            }} IN TRANSACTIONS OF $batch_size ROWS
+            RETURN count(n)
+            """,
+            {**params, "batch_size": options["batch_size"]},
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt inbound count on {results[0][0]} nodes")
+        )
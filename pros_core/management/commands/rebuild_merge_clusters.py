@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from neomodel import db
+
+from pros_core.merge_clusters import rebuild_merge_clusters
+
+
+class Command(BaseCommand):
+    help = "Backfill or repair the merge cluster ids of all nodes from their MERGED relations"
+
+    def handle(self, *args, **options):
+        with db.write_transaction:
+            cluster_count = rebuild_merge_clusters()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {cluster_count} merge clusters"))
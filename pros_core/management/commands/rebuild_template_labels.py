@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from neomodel import db
+
+from pros_core.template_labels import LABEL_PROPAGATOR, LABEL_TEMPLATES
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill or repair the stored labels of entities whose types have a "
+        "construct_label_template, and of the labels depending on them"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of labels to recompute per transaction",
+        )
+
+    def handle(self, *args, **options):
+        results, meta = db.cypher_query(
+            "MATCH (s:ProsNode) WHERE s.real_type IN $types RETURN s.uid",
+            {"types": list(LABEL_TEMPLATES)},
+        )
+        uids = [row[0] for row in results]
+        batch_size = options["batch_size"]
+
+        changed = set()
+        for i in range(0, len(uids), batch_size):
+            changed |= LABEL_PROPAGATOR.refresh_batch(set(uids[i : i + batch_size]))
+        LABEL_PROPAGATOR.propagate(changed)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Recomputed {len(uids)} template labels, {len(changed)} changed"
+            )
+        )
@@ -0,0 +1,49 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pros_core.outbox import OUTBOX_BATCH_SIZE, OUTBOX_HANDLERS, run_worker
+
+# Imported for the outbox handlers they register
+import pros_core.template_labels  # noqa: F401
+
+
+class Command(BaseCommand):
+    help = (
+        "Handle the side effects of writes recorded in the outbox, in batches, "
+        "until stopped"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=OUTBOX_BATCH_SIZE,
+            help="Number of events to claim at once",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait for new events when there are none",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Stop once no events are available, instead of waiting for more",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+        logging.basicConfig(level=logging.INFO)
+        self.stdout.write(f"Handling outbox topics: {', '.join(sorted(OUTBOX_HANDLERS))}")
+        try:
+            run_worker(
+                batch_size=options["batch_size"],
+                poll_interval=options["poll_interval"],
+                once=options["once"],
+            )
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS("Outbox worker stopped"))
@@ -0,0 +1,192 @@
+"""Persisted identifiers for connected components of MERGED relations.
+
+Every node with at least one MERGED relation carries the id of its component in
+`merge_cluster`, so merged nodes can be found with an indexed equality lookup
+instead of a variable-length `[:MERGED*]` traversal. Nodes without MERGED
+relations have no cluster id."""
+
+import uuid
+
+from neomodel import db
+
+from pros_core import change_log
+from pros_core.models import ProsNode
+from pros_core.signals import entities_changed
+
+MERGE_CLUSTER_PROPERTY = "merge_cluster"
+
+
+def new_cluster_id() -> str:
+    return uuid.uuid4().hex
+
+
+def get_merge_cluster(uid: str) -> str | None:
+    results, meta = db.cypher_query(
+        "MATCH (n:ProsNode {uid: $uid}) RETURN n.merge_cluster", {"uid": uid}
+    )
+    return results[0][0] if results else None
+
+
+def record_merge_changes(uids: set[str]):
+    """Record a merge change for the nodes of a changed cluster, and notify listeners
+    once the transaction commits"""
+    change_log.record_changes({uid: change_log.MERGE for uid in uids})
+    uids = frozenset(uids)
+    db.on_commit(lambda: entities_changed.send_robust(sender=ProsNode, uids=uids))
+
+
+def get_cluster_uids(cluster: str | None) -> set[str]:
+    if cluster is None:
+        return set()
+    results, meta = db.cypher_query(
+        "MATCH (m:ProsNode {merge_cluster: $cluster}) RETURN m.uid", {"cluster": cluster}
+    )
+    return {row[0] for row in results}
+
+
+def merge_nodes(uid_a: str, uid_b: str):
+    """Add a MERGED relation between two nodes, joining their clusters.
+
+    The nodes of the smaller cluster are relabelled with the id of the larger one."""
+    q = """
+    MATCH (a:ProsNode {uid: $uid_a}), (b:ProsNode {uid: $uid_b})
+    MERGE (a)-[:MERGED]->(b)
+    WITH a, b
+    CALL {
+        WITH a
+        OPTIONAL MATCH (m:ProsNode {merge_cluster: a.merge_cluster})
+        RETURN count(m) AS a_size
+    }
+    CALL {
+        WITH b
+        OPTIONAL MATCH (m:ProsNode {merge_cluster: b.merge_cluster})
+        RETURN count(m) AS b_size
+    }
+    WITH CASE WHEN a_size >= b_size THEN [a, b] ELSE [b, a] END AS ordered
+    WITH ordered[0] AS keep, ordered[1] AS absorb
+    WITH keep, absorb, coalesce(keep.merge_cluster, $new_cluster) AS cluster
+    SET keep.merge_cluster = cluster
+    WITH absorb, cluster
+    CALL {
+        WITH absorb, cluster
+        MATCH (m:ProsNode {merge_cluster: absorb.merge_cluster})
+        SET m.merge_cluster = cluster
+    }
+    SET absorb.merge_cluster = cluster
+    RETURN cluster
+    """
+    results, meta = db.cypher_query(
+        q, {"uid_a": uid_a, "uid_b": uid_b, "new_cluster": new_cluster_id()}
+    )
+    cluster = results[0][0] if results else None
+    record_merge_changes(get_cluster_uids(cluster))
+    return cluster
+
+
+def unmerge_nodes(uid_a: str, uid_b: str):
+    """Remove the MERGED relations between two nodes, splitting their cluster if
+    it is no longer connected"""
+    cluster = get_merge_cluster(uid_a)
+    cluster_uids = get_cluster_uids(cluster)
+    db.cypher_query(
+        """
+        MATCH (:ProsNode {uid: $uid_a})-[r:MERGED]-(:ProsNode {uid: $uid_b})
+        DELETE r
+        """,
+        {"uid_a": uid_a, "uid_b": uid_b},
+    )
+    refresh_merge_cluster(cluster)
+    record_merge_changes(cluster_uids)
+
+
+def find_components(edges: dict[str, set[str]]) -> list[set[str]]:
+    """Connected components of an undirected graph given as adjacency sets"""
+    parent = {node: node for node in edges}
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for node, neighbours in edges.items():
+        for neighbour in neighbours:
+            parent.setdefault(neighbour, neighbour)
+            root_a, root_b = find(node), find(neighbour)
+            if root_a != root_b:
+                parent[root_b] = root_a
+
+    components = {}
+    for node in parent:
+        components.setdefault(find(node), set()).add(node)
+    return list(components.values())
+
+
+def write_clusters(assignments: list[dict]):
+    """Set `merge_cluster` for each {"uid", "cluster"} assignment (cluster may be None)"""
+    db.cypher_query(
+        """
+        UNWIND $assignments AS assignment
+        MATCH (n:ProsNode {uid: assignment.uid})
+        SET n.merge_cluster = assignment.cluster
+        """,
+        {"assignments": assignments},
+    )
+
+
+def refresh_merge_cluster(cluster: str | None):
+    """Recompute the components of one cluster after MERGED relations (or merged
+    nodes) have been removed. The largest component keeps the cluster id; other
+    components get new ids and nodes left without MERGED relations lose it."""
+    if cluster is None:
+        return
+    results, meta = db.cypher_query(
+        """
+        MATCH (m:ProsNode {merge_cluster: $cluster})
+        OPTIONAL MATCH (m)-[:MERGED]-(n:ProsNode)
+        RETURN m.uid, COLLECT(n.uid)
+        """,
+        {"cluster": cluster},
+    )
+    edges = {uid: set(merged_uids) for uid, merged_uids in results}
+    components = sorted(find_components(edges), key=len, reverse=True)
+
+    assignments = []
+    for i, component in enumerate(components):
+        if len(component) == 1:
+            component_cluster = None
+        elif i == 0:
+            component_cluster = cluster
+        else:
+            component_cluster = new_cluster_id()
+        assignments += [{"uid": uid, "cluster": component_cluster} for uid in component]
+    write_clusters(assignments)
+
+
+def rebuild_merge_clusters() -> int:
+    """Recompute all cluster ids from the MERGED relations; returns the number of clusters"""
+    results, meta = db.cypher_query(
+        """
+        MATCH (a:ProsNode)-[:MERGED]->(b:ProsNode)
+        RETURN a.uid, b.uid
+        """
+    )
+    edges = {}
+    for uid_a, uid_b in results:
+        edges.setdefault(uid_a, set()).add(uid_b)
+        edges.setdefault(uid_b, set()).add(uid_a)
+
+    components = find_components(edges)
+    assignments = []
+    for component in components:
+        cluster = new_cluster_id()
+        assignments += [{"uid": uid, "cluster": cluster} for uid in component]
+
+    db.cypher_query(
+        """
+        MATCH (n:ProsNode) WHERE n.merge_cluster IS NOT NULL
+        REMOVE n.merge_cluster
+        """
+    )
+    write_clusters(assignments)
+    return len(components)
@@ -0,0 +1,49 @@
+"""In-process counters and timings, for monitoring caches and request handling"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: dict[str, int] = {}
+        self.timings: dict[str, dict[str, float]] = {}
+
+    def increment(self, name: str, n: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            timing = self.timings.setdefault(
+                name, {"count": 0, "total": 0.0, "max": 0.0}
+            )
+            timing["count"] += 1
+            timing["total"] += seconds
+            timing["max"] = max(timing["max"], seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "timings": {
+                    name: {
+                        **timing,
+                        "mean": timing["total"] / timing["count"] if timing["count"] else 0.0,
+                    }
+                    for name, timing in self.timings.items()
+                },
+            }
+
+
+METRICS = Metrics()
@@ -18,6 +18,7 @@ from neomodel.relationship_manager import (
     RelationshipClassRedefined,
     OUTGOING,
 )
+from neomodel.config import INBOUND_COUNT_PROPERTY
 from pypher import Pypher, __
 import datetime
 
@@ -25,6 +26,8 @@ from icecream import ic
 
 from frozendict import frozendict
 
+from pros_core.outbox import emit
+
 REVERSE_RELATIONS = defaultdict(lambda: defaultdict(dict))
 
 OverrideLabel = namedtuple("OverrideLabel", ["label", "reverse_label"])
@@ -111,10 +114,24 @@ class ProsNode(StructuredNode):
             meta_attrs,
         )
 
-    def save(self, *args, **kwargs):
+    def pre_save(self):
+        """Set derived properties before the node is written. Also run for nodes
+        written without `save` (see batched_writes), so subclasses should derive
+        their properties here and call super()."""
         self.real_type = type(self).__name__.lower()
         # self.modifiedWhen = datetime.datetime.now()
-        super().save(*args, **kwargs)
+
+    @classmethod
+    def outbox_events_on_create(cls, properties: dict) -> list[dict]:
+        """Outbox events (see pros_core.outbox) to be written with a new node of this
+        class, for side effects handled after the request; given the node's
+        properties"""
+        return []
+
+    def post_create(self):
+        """Emit the outbox events of nodes created by neomodel (`save` or `create`)
+        rather than the batched writes, which write them with the node"""
+        emit(*self.outbox_events_on_create(self.__properties__))
 
     def __hash__(self):
         return hash(self.uid)
@@ -289,16 +306,28 @@ RETURN s, r, o, r2, o2, odate, o2date"""
 
         return db_results[0][0]
 
-    def has_dependent_relations(self, uid=None):
-        uid = uid or self.uid
-        """-> Bool: other nodes are dependent on this node. Deleting it would break links."""
-        q = Pypher()
-        q.Match.node("s").rel_in().node("o")
-        q.WHERE.s.property("uid") == uid
-        q.RETURN.count("s") > 0
+    def has_dependent_relations(self, uid=None, live=False):
+        """-> Bool: other nodes are dependent on this node. Deleting it would break links.
 
-        db_results, meta = db.cypher_query(str(q), q.bound_params)
-        return db_results[0][0]
+        Uses the inbound relation counter maintained by neomodel's relationship manager
+        (see `rebuild_inbound_counts` management command to backfill/repair). With
+        `live`, or if the node has no counter yet, the inbound relations are counted
+        instead, as they must be before deciding to delete the node."""
+        uid = uid or self.uid
+        if not live:
+            q = f"""MATCH (s:ProsNode {{uid: $uid}})
+            RETURN s.{INBOUND_COUNT_PROPERTY}"""
+            db_results, meta = db.cypher_query(q, {"uid": uid})
+            if not db_results:
+                return False
+            if db_results[0][0] is not None:
+                return db_results[0][0] > 0
+
+        q = """MATCH (s:ProsNode {uid: $uid})
+        OPTIONAL MATCH (s)<-[r]-()
+        RETURN count(r) > 0"""
+        db_results, meta = db.cypher_query(q, {"uid": uid})
+        return db_results[0][0] if db_results else False
 
 
 class ProsInlineOnlyNode(ProsNode):
@@ -0,0 +1,128 @@
+"""Transactional outbox for side effects of writes that need not delay the request.
+
+A write adds `(:ProsOutboxEvent {id, topic, payload, created_at, available_at,
+attempts})` nodes in its own transaction (see `build_event` and
+batched_writes.write_changes, or `emit`), so events exist exactly if the write was
+committed. A worker (`manage.py run_outbox_worker`) claims batches of available
+events, passes the payloads of each topic to the handler registered for it, and
+deletes the events that were handled.
+
+Claiming an event makes it unavailable for a lease; events whose handler fails are
+retried once their lease expires, up to OUTBOX_MAX_ATTEMPTS times, after which they
+are left in place for inspection. As an event may be handled more than once,
+handlers must be idempotent."""
+
+import json
+import logging
+import time
+import uuid
+from typing import Callable
+
+from neomodel import db
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = 500
+# Milliseconds a claimed event is unavailable to other claims
+OUTBOX_LEASE = 5 * 60 * 1000
+OUTBOX_MAX_ATTEMPTS = 5
+
+WRITE_EVENTS_QUERY = """
+UNWIND $events AS event
+CREATE (:ProsOutboxEvent {
+    id: event.id, topic: event.topic, payload: event.payload,
+    created_at: timestamp(), available_at: timestamp(), attempts: 0
+})
+"""
+
+CLAIM_EVENTS_QUERY = """
+MATCH (e:ProsOutboxEvent)
+WHERE e.available_at <= timestamp() AND e.attempts < $max_attempts
+WITH e ORDER BY e.created_at, e.id LIMIT $batch_size
+SET e.available_at = timestamp() + $lease, e.attempts = e.attempts + 1
+RETURN e.id, e.topic, e.payload, e.attempts
+"""
+
+DELETE_EVENTS_QUERY = """
+MATCH (e:ProsOutboxEvent) WHERE e.id IN $ids
+DELETE e
+"""
+
+# Handlers by topic, each taking the payloads of a batch of events
+OUTBOX_HANDLERS: dict[str, Callable[[list[dict]], None]] = {}
+
+
+def outbox_handler(topic: str):
+    """Register the decorated function as the handler of the events of `topic`"""
+
+    def register(handler: Callable[[list[dict]], None]):
+        OUTBOX_HANDLERS[topic] = handler
+        return handler
+
+    return register
+
+
+def build_event(topic: str, payload: dict) -> dict:
+    """An event, to be written with the changes of a transaction"""
+    return {"id": uuid.uuid4().hex, "topic": topic, "payload": json.dumps(payload)}
+
+
+def emit(*events: dict):
+    """Write events in the current transaction"""
+    if events:
+        db.cypher_query(WRITE_EVENTS_QUERY, {"events": list(events)})
+
+
+@db.write_transaction
+def claim_events(batch_size: int) -> list[list]:
+    results, meta = db.cypher_query(
+        CLAIM_EVENTS_QUERY,
+        {
+            "batch_size": batch_size,
+            "lease": OUTBOX_LEASE,
+            "max_attempts": OUTBOX_MAX_ATTEMPTS,
+        },
+    )
+    return results
+
+
+def process_events(batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    """Claim and handle a batch of events, one handler call per topic; returns the
+    number of events claimed"""
+    events = claim_events(batch_size)
+    by_topic: dict[str, list] = {}
+    for event_id, topic, payload, attempts in events:
+        by_topic.setdefault(topic, []).append((event_id, json.loads(payload), attempts))
+
+    handled = []
+    for topic, topic_events in by_topic.items():
+        if (handler := OUTBOX_HANDLERS.get(topic)) is None:
+            logger.error("No outbox handler for topic %s", topic)
+            continue
+        try:
+            handler([payload for _, payload, _ in topic_events])
+        except Exception:
+            logger.exception(
+                "Outbox handler for %s failed (attempt %s of %s)",
+                topic,
+                max(attempts for _, _, attempts in topic_events),
+                OUTBOX_MAX_ATTEMPTS,
+            )
+            continue
+        handled += [event_id for event_id, _, _ in topic_events]
+
+    if handled:
+        db.cypher_query(DELETE_EVENTS_QUERY, {"ids": handled})
+    return len(events)
+
+
+def run_worker(
+    batch_size: int = OUTBOX_BATCH_SIZE, poll_interval: float = 1.0, once: bool = False
+):
+    """Handle events as they become available; with `once`, until none are left"""
+    while True:
+        if process_events(batch_size) == batch_size:
+            continue
+        if once:
+            return
+        time.sleep(poll_interval)
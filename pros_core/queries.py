@@ -0,0 +1,259 @@
+"""Cypher queries compiled once per model at startup (see setup_app), so that
+the query strings, and therefore the cached query plans, are the same on every call.
+
+n.b. everything interpolated into these queries comes from the model definitions,
+never from requests."""
+
+from __future__ import annotations
+
+import typing
+
+from pros_core.item_retrieval import build_facet_queries
+
+if typing.TYPE_CHECKING:
+    from pros_core.setup_app import AppModel
+
+
+def build_select_value_string(select_values, unpack_values):
+    select_value_string = "{"
+    select_value_string += ", ".join(f".{v}" for v in select_values)
+    if unpack_values:
+        select_value_string += ","
+        select_value_string += ", ".join(f"{k}: {k}" for k in unpack_values if k != "_")
+    select_value_string += "}"
+    return select_value_string
+
+
+def with_subclasses(app_model: AppModel) -> list[AppModel]:
+    return [app_model, *app_model.subclasses_as_list] if app_model else []
+
+
+def get_reverse_name(relation) -> str | None:
+    if reverse_name := relation.definition["model"].__dict__.get("reverse_name"):
+        return reverse_name.default
+    return None
+
+
+def build_relation_match(
+    app_model: AppModel | None,
+    key: str,
+    pros_models: dict[str, AppModel],
+    current_node: str,
+) -> tuple[str, AppModel | None]:
+    """OPTIONAL MATCH clause from the current node to the nodes unpacked as `key`,
+    and the model of those nodes.
+
+    A relation defined on the model (or a subclass) is matched by its type, outwards;
+    a reverse relation is matched inwards by the types of the relations defined with
+    that reverse name. Keys that cannot be resolved against the models fall back to
+    matching any relation with the type or reverse name."""
+    rel, target = f"r_{key}", f"o_{key}"
+
+    # Relation defined on this model: its type is the field name
+    for model in with_subclasses(app_model):
+        relation = {**model.relations, **model.inline_relations}.get(key)
+        if relation is not None:
+            return (
+                f"OPTIONAL MATCH ({current_node})-[{rel}:{relation.definition['relation_type']}]->({target})",
+                pros_models.get(relation._raw_class.lower()),
+            )
+
+    # Reverse relation: the types of the relations pointing here with this reverse name
+    for model in with_subclasses(app_model):
+        relation_to = model.reverse_relations.get(key, {}).get("relation_to")
+        if relation_to is None:
+            continue
+        source_model = pros_models.get(relation_to.lower())
+        relation_types = sorted(
+            {
+                relation.definition["relation_type"]
+                for source in with_subclasses(source_model)
+                for relation in source.relations.values()
+                if get_reverse_name(relation) == key.upper()
+            }
+        )
+        if relation_types:
+            return (
+                f"OPTIONAL MATCH ({current_node})<-[{rel}:{'|'.join(relation_types)}]-({target})\n"
+                f"WHERE {rel}.reverse_name = '{key.upper()}'",
+                source_model,
+            )
+
+    return (
+        f"OPTIONAL MATCH ({current_node})-[{rel}]-({target})\n"
+        f"WHERE type({rel}) = '{key.upper()}' OR {rel}.reverse_name = '{key.upper()}'",
+        None,
+    )
+
+
+def build_unpack_calls(
+    app_model: AppModel | None,
+    fields,
+    pros_models: dict[str, AppModel],
+    current_node: str = "a",
+) -> str:
+    """Subqueries collecting the `Meta.unpack_fields` of each list row"""
+    res = ""
+    if isinstance(fields, set):
+        return res
+    for key, value in fields.items():
+        if key == "_":
+            continue
+        select_values = value if isinstance(value, set) else value.get("_", set())
+        match, target_model = build_relation_match(
+            app_model, key, pros_models, current_node
+        )
+        res += f"""
+CALL {{
+WITH {current_node}
+{match}
+"""
+        res += build_unpack_calls(
+            target_model, value, pros_models, current_node=f"o_{key}"
+        )
+        if not isinstance(value, set):
+            res += f"RETURN COLLECT(o_{key}{build_select_value_string(select_values, value)}) AS {key} }}"
+        else:
+            res += f"RETURN o_{key}{build_select_value_string(select_values, {})} AS {key} }}"
+    return res
+
+
+# Variants of the list query, by how the rows are selected
+LIST_QUERY_ALL = "all"
+LIST_QUERY_PAGE = "page"
+LIST_QUERY_UIDS = "uids"
+
+
+def build_list_match(variant: str, entity_type: str) -> str:
+    """Clause matching the nodes `a` of a variant of a model's list query"""
+    if variant == LIST_QUERY_UIDS:
+        return f"MATCH (a:{entity_type})\n    WHERE a.uid IN $uids"
+    if variant == LIST_QUERY_PAGE:
+        # Labelled nodes are read in (label, uid) order from the range index on them
+        # (see pros_core.indexes), stopping at the end of the page. Unlabelled nodes
+        # sort first, as if labelled "", and are only looked for until the cursor
+        # has passed them
+        return f"""CALL {{
+        WITH $after_label AS after_label
+        WHERE after_label IS NULL OR after_label = ""
+        MATCH (a:{entity_type})
+        WHERE a.label IS NULL AND ($after_uid IS NULL OR a.uid > $after_uid)
+        RETURN a
+        ORDER BY a.uid
+        LIMIT $limit
+      UNION ALL
+        MATCH (a:{entity_type})
+        WHERE a.label >= coalesce($after_label, "")
+            AND ($after_label IS NULL OR a.label > $after_label OR a.uid > $after_uid)
+        RETURN a
+        ORDER BY a.label, a.uid
+        LIMIT $limit
+    }}
+    WITH a
+    ORDER BY coalesce(a.label, ""), a.uid
+    LIMIT $limit"""
+    return f"MATCH (a:{entity_type})"
+
+
+LIST_QUERY_ORDER = {
+    LIST_QUERY_ALL: "ORDER BY da.label",
+    LIST_QUERY_PAGE: 'ORDER BY coalesce(da.label, ""), da.uid',
+    LIST_QUERY_UIDS: "ORDER BY da.label",
+}
+
+
+def compile_list_queries(
+    app_model: AppModel, pros_models: dict[str, AppModel]
+) -> dict[str, str]:
+    """List queries of a model, grouping together merged entities as different
+    permutations, i.e. main person, with merged entities as separate field"""
+    entity_type = app_model.model.__name__
+    unpack_fields = getattr(app_model.model.Meta, "unpack_fields", None)
+    unpack_calls = (
+        build_unpack_calls(app_model, unpack_fields, pros_models)
+        if unpack_fields
+        else ""
+    )
+    unpack_keys = [f for f in unpack_fields if f != "_"] if unpack_fields else []
+
+    return {
+        variant: f"""
+    {build_list_match(variant, entity_type)}
+    CALL {{
+        WITH a
+        MATCH (b:ProsNode {{merge_cluster: a.merge_cluster}})
+        WHERE b <> a
+        WITH b, b.is_deleted AND coalesce(b.inbound_count, 0) > 0 AS ddn
+        RETURN COLLECT(b{{.label, .uid, .real_type, .is_deleted, deleted_and_has_dependent_nodes:ddn}}) AS cb
+    }}
+    {unpack_calls}
+
+    WITH DISTINCT(a) AS da, a.is_deleted AND coalesce(a.inbound_count, 0) > 0 AS ddn, cb <> [] as is_merged_item, cb {"".join(", " + f for f in unpack_keys)}
+
+    RETURN apoc.map.clean(da{{.label, .uid, .real_type, .is_deleted, is_merged_item:is_merged_item, merged_items:cb {"".join(f", {f}: {f}" for f in unpack_keys)}}}, [], [[], {{}}, [{{}}], null]) AS results
+    {order_clause}
+    """
+        for variant, order_clause in LIST_QUERY_ORDER.items()
+    }
+
+
+def relation_types(relations) -> set[str]:
+    return {relation.definition["relation_type"] for relation in relations}
+
+
+def compile_item_queries(
+    app_model: AppModel, pros_models: dict[str, AppModel]
+) -> dict[str, str | None]:
+    """Item facet queries of a model (see item_retrieval), matching only the types
+    of the relations a node of the model can have, in their direction"""
+    # Relations to any class the model inherits from can point to its nodes
+    target_names = {klass.__name__ for klass in app_model.model.__mro__}
+
+    # Models of this model's inline nodes, and of inline nodes in general:
+    # inline-only models and the targets of any inline relation
+    own_inline_models = [
+        m
+        for relation in app_model.inline_relations.values()
+        for m in with_subclasses(pros_models.get(relation._raw_class.lower()))
+    ]
+    inline_model_names = {
+        m.model.__name__
+        for model in pros_models.values()
+        for m in (
+            [model]
+            if model.meta.get("inline_only")
+            else [
+                m
+                for relation in model.inline_relations.values()
+                for m in with_subclasses(pros_models.get(relation._raw_class.lower()))
+            ]
+        )
+    }
+
+    return build_facet_queries(
+        incoming=relation_types(
+            relation
+            for model in pros_models.values()
+            for relation in model.relations.values()
+            if relation._raw_class in target_names
+        ),
+        outgoing=relation_types(app_model.relations.values()),
+        incoming_inline=relation_types(
+            relation
+            for model in pros_models.values()
+            if model.model.__name__ in inline_model_names
+            for relation in model.relations.values()
+            if relation._raw_class in target_names
+        ),
+        passthrough=relation_types(
+            relation
+            for model in pros_models.values()
+            for relation in model.inline_relations.values()
+        ),
+        inline=relation_types(app_model.inline_relations.values()),
+        inline_related=relation_types(
+            relation
+            for model in own_inline_models
+            for relation in (*model.relations.values(), *model.inline_relations.values())
+        ),
+    )
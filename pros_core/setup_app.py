@@ -9,6 +9,8 @@ from icecream import ic
 from neomodel.properties import Property, UniqueIdProperty
 from neomodel.relationship_manager import RelationshipDefinition
 from pros_core.models import ProsNode, REVERSE_RELATIONS, InlineRelation
+from pros_core.queries import compile_item_queries, compile_list_queries
+from pros_core.schema_validation import compile_validator
 
 from django.apps import apps
 
@@ -36,6 +38,9 @@ class AppModel:
     model_docstring: str
     parent_classes: list
     json_schema: dict = dict
+    list_queries: dict = dict
+    item_queries: dict = dict
+    validator: object = None
 
 
 def build_field(p):
@@ -340,6 +345,11 @@ from typing import TypedDict
 
 
 PROS_MODELS: dict[str, AppModel] = build_models(PROS_APPS)
+
+# Compiled after all models are built, as reverse relations refer to other models
+for app_model in PROS_MODELS.values():
+    app_model.list_queries = compile_list_queries(app_model, PROS_MODELS)
+    app_model.item_queries = compile_item_queries(app_model, PROS_MODELS)
 PROPERTY_VALIDATORS = {
     p.__name__: getattr(
         p,
@@ -393,6 +403,8 @@ def build_relation_field(field):
 
     if field["cardinality"] in {"One", "OneOrMore"}:
         F["minItems"] = 1
+    if field["cardinality"] in {"One", "ZeroOrOne"}:
+        F["maxItems"] = 1
 
     if field["relation_fields"]:
         F["items"]["properties"]["relData"] = {
@@ -500,6 +512,7 @@ for model_name, model in PROS_MODELS.items():
     }
 
     PROS_MODELS[model_name].json_schema = S
+    PROS_MODELS[model_name].validator = compile_validator(S)
     # ic(PROS_MODELS[model_name])
 
 PROS_VIEWSET_MAP = build_viewsets(PROS_APPS)
@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+# Sent once a write transaction touching Pros entities has been committed.
+# Receivers get `uids`: a frozenset of the uids of every entity whose list row
+# or item view may have changed (the written entities and their neighbours).
+# Only sent in the process that wrote them: caches that must see writes made by
+# other processes (e.g. the outbox worker) check the change log instead.
+entities_changed = Signal()
@@ -0,0 +1,176 @@
+"""Precompressed snapshot files of full lists.
+
+A snapshot of a type's list is written as `<type>.<seq>.json`, plus gzip and (if the
+brotli package is installed) brotli compressed copies, where `seq` is the version of
+the type (see change_log) read before its rows. A snapshot is served only while its
+version is the current version of the type; otherwise the list is built as usual and
+a rebuild of the stale snapshots is scheduled."""
+
+import gzip
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterable
+
+from pros_core import change_log
+from pros_core.streaming import stream_json_array
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+IDENTITY = "identity"
+GZIP = "gzip"
+BROTLI = "br"
+
+SNAPSHOT_EXTENSIONS = {IDENTITY: "", GZIP: ".gz", BROTLI: ".br"}
+
+SNAPSHOT_FILE_PATTERN = re.compile(r"^(?P<type>\w+)\.(?P<seq>\d+)\.json$")
+
+
+def available_encodings() -> list[str]:
+    """Encodings snapshots are written in, in order of preference"""
+    return [BROTLI, GZIP, IDENTITY] if brotli else [GZIP, IDENTITY]
+
+
+def accepted_encoding(request) -> str:
+    """Preferred snapshot encoding accepted by the client"""
+    accept_encoding = request.META.get("HTTP_ACCEPT_ENCODING", "")
+    accepted = {
+        encoding.split(";")[0].strip()
+        for encoding in accept_encoding.split(",")
+        if not encoding.strip().endswith(";q=0")
+    }
+    for encoding in available_encodings():
+        if encoding == IDENTITY or encoding in accepted:
+            return encoding
+    return IDENTITY
+
+
+class SnapshotStore:
+    """Snapshot files of the lists of a set of models, built from their full list rows
+    by `get_rows(model_class)`"""
+
+    def __init__(
+        self,
+        directory: str | Path,
+        get_rows: Callable[[type], Iterable],
+        debounce: float = 2.0,
+        max_delay: float = 10.0,
+    ):
+        self.directory = Path(directory)
+        self.get_rows = get_rows
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.model_classes: dict[str, type] = {}
+        self.build_lock = threading.Lock()
+        self.timer_lock = threading.Lock()
+        self.timer: threading.Timer | None = None
+        # When the pending rebuild was first scheduled (time.monotonic)
+        self.first_scheduled: float | None = None
+
+    def register(self, model_classes: Iterable[type]):
+        self.model_classes.update({m.__name__.lower(): m for m in model_classes})
+
+    def path(self, model_name: str, seq: int, encoding: str = IDENTITY) -> Path:
+        return self.directory / f"{model_name}.{seq}.json{SNAPSHOT_EXTENSIONS[encoding]}"
+
+    def current_seq(self, model_name: str) -> int | None:
+        """Version of the newest snapshot of a type on disk"""
+        if not self.directory.exists():
+            return None
+        seqs = [
+            int(match["seq"])
+            for file_name in os.listdir(self.directory)
+            if (match := SNAPSHOT_FILE_PATTERN.match(file_name))
+            and match["type"] == model_name
+        ]
+        return max(seqs) if seqs else None
+
+    def get(self, model_class, seq: int, encoding: str) -> Path | None:
+        """Snapshot file of the list of a type at a version, if it has been built"""
+        path = self.path(model_class.__name__.lower(), seq, encoding)
+        return path if path.exists() else None
+
+    def write_atomic(self, path: Path, chunks: Iterable[bytes]):
+        with tempfile.NamedTemporaryFile(
+            dir=self.directory, prefix=f".{path.name}.", delete=False
+        ) as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(f.name, path)
+
+    def build(self, model_class) -> int:
+        """Write the snapshot of a type at its current version, and remove older ones"""
+        model_name = model_class.__name__.lower()
+        seq = change_log.get_version(change_log.type_version_key(model_class.__name__))[0]
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        data = b"".join(stream_json_array(self.get_rows(model_class)))
+        encoders = {
+            IDENTITY: lambda d: d,
+            GZIP: lambda d: gzip.compress(d, compresslevel=9),
+            BROTLI: lambda d: brotli.compress(d),
+        }
+        # Identity last: its presence marks a complete snapshot (see current_seq)
+        for encoding in available_encodings():
+            self.write_atomic(self.path(model_name, seq, encoding), [encoders[encoding](data)])
+
+        for file_name in os.listdir(self.directory):
+            name = file_name.split(".json")[0] + ".json"
+            match = SNAPSHOT_FILE_PATTERN.match(name)
+            if match and match["type"] == model_name and int(match["seq"]) < seq:
+                (self.directory / file_name).unlink(missing_ok=True)
+        return seq
+
+    def rebuild_stale(self) -> list[str]:
+        """Rebuild the snapshots whose types have changed since; returns their names"""
+        with self.build_lock:
+            versions = change_log.get_versions(
+                [change_log.type_version_key(m.__name__) for m in self.model_classes.values()]
+            )
+            rebuilt = []
+            for model_name, model_class in self.model_classes.items():
+                seq = versions[change_log.type_version_key(model_class.__name__)]
+                if self.current_seq(model_name) != seq:
+                    self.build(model_class)
+                    rebuilt.append(model_name)
+            return rebuilt
+
+    def _rebuild_in_background(self):
+        with self.timer_lock:
+            # Unless it was rescheduled as it fired
+            if self.timer is threading.current_thread():
+                self.timer = None
+                self.first_scheduled = None
+        try:
+            self.rebuild_stale()
+        except Exception:
+            logger.exception("Could not rebuild list snapshots")
+
+    def schedule_rebuild(self, reset: bool = True):
+        """Rebuild stale snapshots in the background once no further rebuild has been
+        scheduled for `debounce` seconds, so that bursts of writes cause one rebuild,
+        but at most `max_delay` seconds after the first of them.
+
+        Without `reset` (as on reads that miss a snapshot), a pending rebuild is
+        left as it is, so that a steady stream of reads cannot postpone it."""
+        with self.timer_lock:
+            now = time.monotonic()
+            if self.timer is not None:
+                if not reset:
+                    return
+                self.timer.cancel()
+            else:
+                self.first_scheduled = now
+            delay = min(self.debounce, self.first_scheduled + self.max_delay - now)
+            self.timer = threading.Timer(max(delay, 0), self._rebuild_in_background)
+            self.timer.daemon = True
+            self.timer.start()
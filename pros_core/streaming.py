@@ -0,0 +1,75 @@
+"""Streaming serialisation of list rows, as newline-delimited JSON or as a JSON
+array written out in chunks, for use with StreamingHttpResponse"""
+
+import json
+from typing import Iterable, Iterator
+
+from pros_core.renderers import ComplexEncoder
+
+NDJSON = "ndjson"
+JSON_ARRAY = "json"
+
+STREAM_CONTENT_TYPES = {
+    NDJSON: "application/x-ndjson",
+    JSON_ARRAY: "application/json",
+}
+
+# Number of rows written out per chunk
+STREAM_CHUNK_ROWS = 200
+
+# List query parameters selecting part of a list (or its changes); only full lists
+# are streamed
+LIST_SELECTION_PARAMS = ("filter", "since_seq", "lastRefreshedTimestamp", "after", "limit")
+
+
+def get_stream_format(request) -> str | None:
+    """Streaming format requested with `?stream=ndjson|json`, or by accepting NDJSON"""
+    if stream_format := request.query_params.get("stream"):
+        return stream_format if stream_format in STREAM_CONTENT_TYPES else None
+    if STREAM_CONTENT_TYPES[NDJSON] in request.META.get("HTTP_ACCEPT", ""):
+        return NDJSON
+    return None
+
+
+def list_selection_params(request) -> list[str]:
+    """LIST_SELECTION_PARAMS given in the request, which a stream cannot honour"""
+    return [param for param in LIST_SELECTION_PARAMS if param in request.query_params]
+
+
+def encode_row(row) -> str:
+    return json.dumps(row, cls=ComplexEncoder, ensure_ascii=False)
+
+
+def chunked(lines: Iterable[str], chunk_rows: int) -> Iterator[bytes]:
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_rows:
+            yield "".join(chunk).encode()
+            chunk = []
+    if chunk:
+        yield "".join(chunk).encode()
+
+
+def stream_ndjson(rows: Iterable, chunk_rows: int = STREAM_CHUNK_ROWS) -> Iterator[bytes]:
+    return chunked((encode_row(row) + "\n" for row in rows), chunk_rows)
+
+
+def stream_json_array(
+    rows: Iterable, chunk_rows: int = STREAM_CHUNK_ROWS
+) -> Iterator[bytes]:
+    def lines():
+        separator = "["
+        for row in rows:
+            yield separator + encode_row(row)
+            separator = ","
+        # An empty list never wrote its opening bracket
+        yield "]" if separator == "," else "[]"
+
+    return chunked(lines(), chunk_rows)
+
+
+STREAM_ENCODERS = {
+    NDJSON: stream_ndjson,
+    JSON_ARRAY: stream_json_array,
+}
@@ -0,0 +1,212 @@
+"""Labels of entities built from `Meta.construct_label_template`, stored on the node.
+
+A template such as "Birth of {person_born.label}" embeds the entity's own
+properties (`{forename}`) and the labels of the nodes of its outgoing relation
+fields (`{person_born.label}`, or `{sender.__all__.label}` for all of them), as the
+edit form does in the interface. Related labels are taken in label order (by UTF-16
+code unit, as the interface compares strings), skipping empty ones, on both sides.
+
+The label of a written entity is recomputed in its write transaction. Entities whose
+labels embed another entity's are found through a dependency index compiled from
+the templates: the (type, relation type) pairs by which an entity of a templated
+type refers to the entities its label embeds. Updates whose labels may have changed
+add a PROPAGATE_TEMPLATE_LABELS outbox event, and the outbox worker recomputes the
+dependents of the entities of a batch of events together, following chains of
+templated labels up to LABEL_PROPAGATION_DEPTH_MAX relations deep. The changed
+labels are recorded in the change log, so that the caches of every process see
+them."""
+
+import re
+from dataclasses import dataclass
+
+from neomodel import db
+
+from pros_core import change_log
+from pros_core.outbox import outbox_handler
+from pros_core.setup_app import PROS_MODELS
+
+PLACEHOLDER = re.compile(r"{(.*?)}")
+WHITESPACE = re.compile(r"\s\s+")
+ALL_RELATED = "__all__"
+
+PROPAGATE_TEMPLATE_LABELS = "template_labels.propagate"
+
+# Dependent labels recomputed (and written) per transaction
+LABEL_PROPAGATION_BATCH_SIZE = 500
+# Chains of templated labels embedding templated labels are followed this far
+LABEL_PROPAGATION_DEPTH_MAX = 3
+
+TEMPLATE_NODES_QUERY = """
+MATCH (s:ProsNode) WHERE s.uid IN $uids AND s.real_type IN $types
+CALL {
+    WITH s
+    MATCH (s)-[r]->(t:ProsNode)
+    WHERE type(r) IN $rel_types
+    RETURN collect([type(r), t.label]) AS related
+}
+RETURN s.uid, s.real_type, properties(s), related
+"""
+
+WRITE_LABELS_QUERY = """
+UNWIND $labels AS row
+MATCH (s:ProsNode {uid: row.uid})
+SET s.label = row.label
+"""
+
+DEPENDENT_NODES_QUERY = """
+MATCH (s:ProsNode)-[r]->(t:ProsNode)
+WHERE t.uid IN $uids AND [s.real_type, type(r)] IN $dependencies
+RETURN DISTINCT s.uid
+"""
+
+
+def utf16_sort_key(label: str) -> bytes:
+    """Orders strings as JavaScript compares them"""
+    return label.encode("utf-16-be", "surrogatepass")
+
+
+@dataclass
+class LabelTemplate:
+    template: str
+    # Relation type of each relation field the template embeds
+    relation_types: dict[str, str]
+
+    def render(self, properties: dict, related: list[list[str]]) -> str:
+        """The label, given the node's properties and the [relation type, label] of
+        its related nodes (in any order)"""
+        labels = {}
+        for rel_type, label in related:
+            if label:
+                labels.setdefault(rel_type, []).append(label)
+        for rel_labels in labels.values():
+            rel_labels.sort(key=utf16_sort_key)
+
+        def value(match: re.Match) -> str:
+            field_name, *path = match.group(1).split(".")
+            if not path:
+                v = properties.get(field_name)
+                return "" if v is None else str(v)
+            related_labels = labels.get(self.relation_types.get(field_name), [])
+            if path == [ALL_RELATED, "label"]:
+                return ", ".join(related_labels)
+            if path == ["label"] and related_labels:
+                return related_labels[0]
+            return ""
+
+        return WHITESPACE.sub(" ", PLACEHOLDER.sub(value, self.template)).strip()
+
+
+def compile_label_template(app_model) -> LabelTemplate | None:
+    template = app_model.meta.get("construct_label_template")
+    if not template or app_model.meta.get("abstract"):
+        return None
+    relation_fields = {
+        field_name: field["relation_type"]
+        for field_name, field in app_model.fields.items()
+        if field["type"] == "relation" and not field.get("inline_relation")
+    }
+    return LabelTemplate(
+        template,
+        {
+            field_name: relation_fields[field_name]
+            for field_name, *path in (
+                placeholder.split(".") for placeholder in PLACEHOLDER.findall(template)
+            )
+            if path and field_name in relation_fields
+        },
+    )
+
+
+LABEL_TEMPLATES: dict[str, LabelTemplate] = {
+    model_name: label_template
+    for model_name, app_model in PROS_MODELS.items()
+    if (label_template := compile_label_template(app_model))
+}
+
+# (real type, relation type) of each relation from an entity to one its label embeds
+LABEL_DEPENDENCIES: list[list[str]] = [
+    [model_name, rel_type]
+    for model_name, label_template in LABEL_TEMPLATES.items()
+    for rel_type in sorted(set(label_template.relation_types.values()))
+]
+LABEL_RELATION_TYPES = sorted({rel_type for _, rel_type in LABEL_DEPENDENCIES})
+
+
+def refresh_template_labels(uids: set[str]) -> dict[str, str]:
+    """Recompute and store the labels of those of the given entities that have a
+    label template, in the current transaction; returns the labels that changed"""
+    if not uids or not LABEL_TEMPLATES:
+        return {}
+    results, meta = db.cypher_query(
+        TEMPLATE_NODES_QUERY,
+        {
+            "uids": list(uids),
+            "types": list(LABEL_TEMPLATES),
+            "rel_types": LABEL_RELATION_TYPES,
+        },
+    )
+    changed = {}
+    for uid, real_type, properties, related in results:
+        label = LABEL_TEMPLATES[real_type].render(properties, related)
+        if label != properties.get("label"):
+            changed[uid] = label
+    if changed:
+        db.cypher_query(
+            WRITE_LABELS_QUERY,
+            {"labels": [{"uid": uid, "label": label} for uid, label in changed.items()]},
+        )
+    return changed
+
+
+def get_dependent_uids(uids: set[str]) -> set[str]:
+    """uids of the entities whose template labels embed the labels of these"""
+    if not uids or not LABEL_DEPENDENCIES:
+        return set()
+    results, meta = db.cypher_query(
+        DEPENDENT_NODES_QUERY, {"uids": list(uids), "dependencies": LABEL_DEPENDENCIES}
+    )
+    return {row[0] for row in results}
+
+
+class LabelPropagator:
+    """Recomputes the template labels that depend on changed entities, in batches"""
+
+    def __init__(
+        self,
+        batch_size: int = LABEL_PROPAGATION_BATCH_SIZE,
+        max_depth: int = LABEL_PROPAGATION_DEPTH_MAX,
+    ):
+        self.batch_size = batch_size
+        self.max_depth = max_depth
+
+    def propagate(self, uids: set[str]):
+        """Recompute the labels depending on these entities, and on the entities
+        whose labels change in turn"""
+        for depth in range(self.max_depth):
+            dependents = sorted(get_dependent_uids(uids))
+            uids = set()
+            for i in range(0, len(dependents), self.batch_size):
+                uids |= self.refresh_batch(set(dependents[i : i + self.batch_size]))
+            if not uids:
+                return
+
+    @db.write_transaction
+    def refresh_batch(self, uids: set[str]) -> set[str]:
+        if changed := set(refresh_template_labels(uids)):
+            # Imported here, as the viewsets use this module
+            from pros_core.viewsets import get_affected_uids, record_entity_changes
+
+            # Recorded in the change log, through which the list projections, label
+            # index and snapshots of the web processes catch up
+            record_entity_changes(
+                {uid: change_log.TOUCH for uid in changed}, get_affected_uids(changed)
+            )
+        return changed
+
+
+LABEL_PROPAGATOR = LabelPropagator()
+
+
+@outbox_handler(PROPAGATE_TEMPLATE_LABELS)
+def propagate_template_labels(payloads: list[dict]):
+    LABEL_PROPAGATOR.propagate({uid for payload in payloads for uid in payload["uids"]})
@@ -1,3 +1,1361 @@
-from django.test import TestCase
+import base64
+import datetime
+import gzip
+import json
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+from neomodel import StringProperty, StructuredRel
+from neomodel.exceptions import AttemptedCardinalityViolation, DoesNotExist
+
+from pros_core import change_log
+from pros_core.batched_writes import (
+    CURRENT_INLINE_NODES_QUERY,
+    build_relation_writes,
+    diff_relations,
+    new_changes,
+    plan_inline_node_changes,
+)
+from pros_core.bulk_upsert import CREATED, ERROR, BulkUpsert
+from pros_core.conditional import build_etag, conditional_headers, is_not_modified
+from pros_core.indexes import build_list_order_indexes
+from pros_core.item_cache import ItemCache, get_item_dependencies
+from pros_core.item_retrieval import (
+    DEFAULT_RELATED_FIELDS,
+    FACET_QUERIES,
+    MAIN_QUERY,
+    build_facet_queries,
+    build_related_node_view,
+    get_items,
+    get_related_keys,
+    projected,
+    rel_types_pattern,
+)
+from pros_core.label_index import TrigramLabelIndex
+from pros_core.list_projection import ListProjection, ListVersion
+from pros_core.merge_clusters import find_components
+from pros_core.models import ProsNode
+from pros_core.outbox import (
+    CLAIM_EVENTS_QUERY,
+    DELETE_EVENTS_QUERY,
+    OUTBOX_MAX_ATTEMPTS,
+    process_events,
+    run_worker,
+)
+from pros_core.queries import LIST_QUERY_PAGE, build_list_match
+from pros_core.schema_validation import compile_validator, with_discriminators
+from pros_core.snapshots import GZIP, IDENTITY, SnapshotStore
+from pros_core.streaming import (
+    JSON_ARRAY,
+    NDJSON,
+    get_stream_format,
+    list_selection_params,
+    stream_json_array,
+    stream_ndjson,
+)
+from pros_core.template_labels import LabelTemplate, compile_label_template
+from pros_core.viewsets import (
+    ProsAbstractViewSet,
+    ResponseValue,
+    decode_list_cursor,
+    encode_list_cursor,
+    get_list_page,
+)
+
+
+class FakeChangeLog:
+    """In-memory stand-in for the change log functions read by the caches"""
+
+    def __init__(self):
+        self.seq = 0
+        self.pruned_seq = 0
+        self.changes = []  # (seq, uid, op, types)
+
+    def record(self, changes: dict[str, str], types: list[str]):
+        self.seq += 1
+        self.changes += [(self.seq, uid, op, types) for uid, op in changes.items()]
+
+    def get_version(self, key):
+        seqs = [
+            seq
+            for seq, uid, op, types in self.changes
+            if key == f"uid:{uid}" or key in {f"type:{t}" for t in types}
+        ]
+        return (max(seqs), None) if seqs else (0, None)
+
+    def get_change_seq(self):
+        return self.seq, self.pruned_seq
+
+    def get_changes_since(self, entity_type, since_seq):
+        return self.seq, {
+            uid: op
+            for seq, uid, op, types in self.changes
+            if seq > since_seq and (entity_type is None or entity_type in types)
+        }
+
+    def patch(self):
+        return mock.patch.multiple(
+            "pros_core.change_log",
+            get_version=self.get_version,
+            get_change_seq=self.get_change_seq,
+            get_changes_since=self.get_changes_since,
+        )
+
+
+class ListProjectionTests(SimpleTestCase):
+    def setUp(self):
+        self.model_class = type("Person", (), {})
+        self.rows = {
+            "b": {"uid": "b", "label": "Bertha"},
+            "a": {"uid": "a", "label": "Albert"},
+        }
+        self.queried = []
+        self.change_log = FakeChangeLog()
+        self.change_log.record({"a": "create", "b": "create"}, ["Person"])
+        patcher = self.change_log.patch()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.projection = ListProjection(
+            self.model_class, self.query_rows, check_interval=0
+        )
+
+    def query_rows(self, model_class, uids=None):
+        self.queried.append(uids)
+        return [
+            dict(row)
+            for uid, row in self.rows.items()
+            if uids is None or uid in uids
+        ]
+
+    def write(self, changes: dict[str, str], rows: dict[str, dict | None]):
+        for uid, row in rows.items():
+            if row is None:
+                self.rows.pop(uid, None)
+            else:
+                self.rows[uid] = row
+        self.change_log.record(changes, ["Person"])
+
+    def test_all_loads_rows_in_label_order(self):
+        rows, list_version = self.projection.all()
+        self.assertEqual([row["uid"] for row in rows], ["a", "b"])
+        self.assertEqual(list_version, ListVersion(1, None, 1))
+
+    def test_unchanged_type_is_not_queried_again(self):
+        self.projection.all()
+        self.change_log.record({"x": "create"}, ["Place"])
+        rows, list_version = self.projection.all()
+        self.assertEqual(self.queried, [None])
+        self.assertEqual(list_version, ListVersion(1, None, 1))
+
+    def test_changes_by_other_processes_are_patched_in(self):
+        self.projection.all()
+        self.write(
+            {"a": "update", "c": "create"},
+            {"a": {"uid": "a", "label": "Zelda"}, "c": {"uid": "c", "label": "Carl"}},
+        )
+        self.write({"b": "delete"}, {"b": None})
+
+        rows, list_version = self.projection.all()
+        self.assertEqual([row["label"] for row in rows], ["Carl", "Zelda"])
+        self.assertEqual(list_version, ListVersion(3, None, 3))
+        self.assertEqual(sorted(self.queried[1]), ["a", "b", "c"])
+
+    def test_page_reflects_the_version_it_was_read_at(self):
+        self.projection.all()
+        self.write({"c": "create"}, {"c": {"uid": "c", "label": "Carl"}})
+
+        rows, has_next, list_version = self.projection.page(("Albert", "a"), 1)
+        self.assertEqual([row["uid"] for row in rows], ["b"])
+        self.assertTrue(has_next)
+        self.assertEqual(list_version.seq, 2)
+
+    def test_pages_cover_every_row_once(self):
+        self.write(
+            {"c": "create", "d": "create", "e": "create"},
+            {
+                "c": {"uid": "c", "label": "Albert"},
+                "d": {"uid": "d"},
+                "e": {"uid": "e", "label": ""},
+            },
+        )
+        uids, after, has_next = [], None, True
+        while has_next:
+            rows, has_next, list_version = self.projection.page(after, 2)
+            uids += [row["uid"] for row in rows]
+            after = (rows[-1].get("label") or "", rows[-1]["uid"])
+        self.assertEqual(uids, ["d", "e", "a", "c", "b"])
+
+    def test_last_page_has_no_next(self):
+        rows, has_next, list_version = self.projection.page(None, 2)
+        self.assertEqual([row["uid"] for row in rows], ["a", "b"])
+        self.assertFalse(has_next)
+        rows, has_next, list_version = self.projection.page(("Bertha", "b"), 2)
+        self.assertEqual((rows, has_next), ([], False))
+
+    def test_reloads_when_the_changes_have_been_pruned(self):
+        self.projection.all()
+        self.write({"c": "create"}, {"c": {"uid": "c", "label": "Carl"}})
+        self.change_log.pruned_seq = 2
+
+        rows, list_version = self.projection.all()
+        self.assertEqual([row["uid"] for row in rows], ["a", "b", "c"])
+        self.assertEqual(self.queried, [None, None])
+
+    def test_version_is_checked_at_most_once_per_interval(self):
+        self.projection.check_interval = 60
+        self.projection.all()
+        self.write({"c": "create"}, {"c": {"uid": "c", "label": "Carl"}})
+
+        with mock.patch.object(
+            change_log, "get_version", side_effect=AssertionError
+        ):
+            rows, list_version = self.projection.all()
+        self.assertEqual([row["uid"] for row in rows], ["a", "b"])
+        self.assertEqual(list_version, ListVersion(1, None, 1))
+
+    def test_expire_checks_the_version_on_the_next_read(self):
+        self.projection.check_interval = 60
+        self.projection.all()
+        self.write({"c": "create"}, {"c": {"uid": "c", "label": "Carl"}})
+
+        self.projection.expire()
+        rows, list_version = self.projection.all()
+        self.assertEqual([row["uid"] for row in rows], ["a", "b", "c"])
+        self.assertEqual(list_version, ListVersion(2, None, 2))
+
+
+class FindComponentsTests(SimpleTestCase):
+    def test_components_of_merge_edges(self):
+        components = find_components(
+            {"a": {"b"}, "b": {"a", "c"}, "c": {"b"}, "d": {"e"}, "f": set()}
+        )
+        self.assertCountEqual(components, [{"a", "b", "c"}, {"d", "e"}, {"f"}])
+
+    def test_nodes_only_given_as_neighbours_are_included(self):
+        self.assertEqual(find_components({"a": {"b"}, "c": {"b"}}), [{"a", "b", "c"}])
+
+    def test_no_edges(self):
+        self.assertEqual(find_components({}), [])
+
+
+class TrigramLabelIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.entities = {
+            "p1": ("Anna Smith", "person", False),
+            "p2": ("Hannah Smithson", "person", False),
+            "p3": ("Smith", "person", True),
+            "o1": ("Smithfield Market", "place", False),
+        }
+        self.change_log = FakeChangeLog()
+        self.change_log.record({uid: "create" for uid in self.entities}, ["ProsNode"])
+        patcher = self.change_log.patch()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.index = TrigramLabelIndex()
+        self.index.query_entities = self.query_entities
+
+    def query_entities(self, uids=None):
+        return [
+            [uid, label, real_type, is_deleted]
+            for uid, (label, real_type, is_deleted) in self.entities.items()
+            if uids is None or uid in uids
+        ]
+
+    def write(self, uid: str, entity: tuple | None):
+        if entity is None:
+            self.entities.pop(uid, None)
+        else:
+            self.entities[uid] = entity
+        self.change_log.record({uid: "update"}, ["ProsNode"])
+
+    def search_uids(self, text, real_types=None, k=20):
+        return [match["uid"] for match in self.index.search(text, real_types, k)]
+
+    def test_ranks_prefix_then_word_prefix_matches(self):
+        self.assertEqual(self.search_uids("smith"), ["p3", "o1", "p1", "p2"])
+
+    def test_short_queries_scan_all_labels(self):
+        self.assertEqual(self.search_uids("an"), ["p1", "p2"])
+
+    def test_filters_by_type_and_limits(self):
+        self.assertEqual(self.search_uids("smith", {"person"}, k=2), ["p3", "p1"])
+        self.assertEqual(self.search_uids("smith", {"event"}), [])
+
+    def test_returns_deleted_flag(self):
+        (match,) = self.index.search("smith", {"person"}, k=1)
+        self.assertEqual(
+            match,
+            {"uid": "p3", "label": "Smith", "real_type": "person", "is_deleted": True},
+        )
+
+    def test_catches_up_with_changes_made_elsewhere(self):
+        self.index.load()
+        self.write("p1", ("Anna Jones", "person", False))
+        self.write("o1", None)
+        self.write("p4", ("Joan Smith", "person", False))
+        self.index.sync()
+        self.assertEqual(self.search_uids("smith"), ["p3", "p4", "p2"])
+        self.assertEqual(self.search_uids("jones"), ["p1"])
+        self.assertEqual(self.index.seq, self.change_log.seq)
+
+    def test_reloads_when_the_changes_have_been_pruned(self):
+        self.index.load()
+        self.write("p1", ("Anna Jones", "person", False))
+        self.change_log.pruned_seq = self.change_log.seq
+        with mock.patch.object(self.index, "refresh") as refresh:
+            self.index.sync()
+        refresh.assert_not_called()
+        self.assertEqual(self.search_uids("jones"), ["p1"])
+
+    def test_searches_do_not_query_once_loaded(self):
+        self.index.load()
+        self.write("p1", ("Anna Jones", "person", False))
+        with mock.patch.object(
+            change_log, "get_change_seq", side_effect=AssertionError
+        ), mock.patch.object(self.index, "query_entities", side_effect=AssertionError):
+            self.assertEqual(self.search_uids("anna"), ["p1", "p2"])
+            self.assertEqual(self.search_uids("jones"), [])
+
+    def test_refreshes_local_writes_without_syncing(self):
+        self.index.load()
+        self.write("p1", ("Anna Jones", "person", False))
+        self.index.refresh({"p1"})
+        self.assertEqual(self.search_uids("jones"), ["p1"])
+        self.assertEqual(self.index.seq, 1)
+
+    def test_compacts_once_half_the_documents_are_dead(self):
+        self.index.load()
+        for i in range(5):
+            self.write("p1", (f"Anna Smith {i}", "person", False))
+            self.index.sync()
+        self.assertLessEqual(self.index.dead_count, len(self.index.doc_ids))
+        self.assertEqual(self.search_uids("anna smith"), ["p1"])
+
+
+class ItemCacheTests(SimpleTestCase):
+    def item(self, uid, *related_uids):
+        return {
+            "uid": uid,
+            "is_about": [{"uid": related_uid} for related_uid in related_uids],
+            "date": {"uid": f"{uid}-date", "date": "1600"},
+        }
+
+    def test_dependencies_are_every_nested_uid(self):
+        self.assertEqual(
+            get_item_dependencies(self.item("a", "b", "c")), {"a", "b", "c", "a-date"}
+        )
+
+    def test_only_returns_items_for_their_version(self):
+        cache = ItemCache(10)
+        cache.put("a", 3, self.item("a"))
+        self.assertEqual(cache.get("a", 3), self.item("a"))
+        self.assertIsNone(cache.get("a", 4))
+
+    def test_invalidated_by_included_entities(self):
+        cache = ItemCache(10)
+        cache.put("a", 1, self.item("a", "b"))
+        cache.put("c", 1, self.item("c"))
+        cache.invalidate({"b"})
+        self.assertIsNone(cache.get("a", 1))
+        self.assertIsNotNone(cache.get("c", 1))
+        self.assertEqual(cache.dependents.keys(), {"c", "c-date"})
+
+    def test_evicts_least_recently_used(self):
+        cache = ItemCache(2)
+        cache.put("a", 1, self.item("a"))
+        cache.put("b", 1, self.item("b"))
+        cache.get("a", 1)
+        cache.put("c", 1, self.item("c"))
+        self.assertIsNone(cache.get("b", 1))
+        self.assertIsNotNone(cache.get("a", 1))
+        self.assertNotIn("b", cache.dependents)
+
+    def test_replacing_an_item_drops_its_old_dependencies(self):
+        cache = ItemCache(10)
+        cache.put("a", 1, self.item("a", "b"))
+        cache.put("a", 2, self.item("a", "c"))
+        cache.invalidate({"b"})
+        self.assertIsNotNone(cache.get("a", 2))
+
+
+class FakeItemDatabase:
+    """Answers the item retrieval queries with fixed rows, recording their params"""
+
+    def __init__(self, rows: dict[str, list]):
+        self.rows = rows
+        self.params = {}
+
+    def cypher_query(self, query, params):
+        self.params[query] = params
+        return self.rows.get(query, []), None
+
+    def patch(self):
+        return mock.patch("pros_core.item_retrieval.db", self)
+
+
+ITEM_ROWS = {
+    MAIN_QUERY: [
+        [{"uid": "a", "real_type": "thing", "label": "A", "inbound_count": 3}, []]
+    ],
+    FACET_QUERIES["outgoing"]: [
+        ["a", "knows", {"certainty": 1}, {"uid": "b", "label": "B", "inbound_count": 1}]
+    ],
+    FACET_QUERIES["incoming"]: [
+        [
+            "a",
+            "is_about",
+            60,
+            [[{}, {"uid": "c", "label": "C", "is_deleted": True, "inbound_count": 2}, "C"]],
+        ],
+        ["a", "mentions", 1, [[{}, {"uid": "e", "label": "E"}, "E"]]],
+    ],
+    FACET_QUERIES["inlines"]: [
+        ["a", "date", {"uid": "d", "real_type": "date", "date": "1600"}, [[None, None]]]
+    ],
+}
+
+
+class ItemRetrievalTests(SimpleTestCase):
+    def test_rel_types_pattern(self):
+        self.assertEqual(rel_types_pattern(None), "")
+        self.assertEqual(rel_types_pattern({"knows", "is_about"}), ":`is_about`|`knows`")
+
+    def test_facets_without_possible_relations_are_not_queried(self):
+        queries = build_facet_queries(
+            incoming={"is_about"}, outgoing=set(), passthrough=set(), inline=set()
+        )
+        self.assertIn("(n)<-[r:`is_about`]-(o)", queries["incoming"])
+        self.assertIsNone(queries["outgoing"])
+        self.assertIsNone(queries["incoming_inline"])
+        self.assertIsNone(queries["inlines"])
+
+    def test_inline_nodes_without_related_types_are_not_expanded(self):
+        query = build_facet_queries(inline={"date"}, inline_related=set())["inlines"]
+        self.assertNotIn("related_rel:", query)
+        self.assertIn("null AS related_node", query)
+
+    def test_assembles_items_from_the_facets(self):
+        with FakeItemDatabase(ITEM_ROWS).patch():
+            items, missing = get_items(["a", "z"], related_fields=None)
+        self.assertEqual(missing, ["z"])
+        self.assertEqual(
+            items["a"],
+            {
+                "uid": "a",
+                "real_type": "thing",
+                "label": "A",
+                "inbound_count": 3,
+                "deleted_and_has_dependent_nodes": False,
+                "date": {"uid": "d", "real_type": "date", "date": "1600", "type": "date"},
+                "knows": [
+                    {
+                        "uid": "b",
+                        "label": "B",
+                        "inbound_count": 1,
+                        "relData": {"certainty": 1},
+                        "rel_type": "knows",
+                        "deleted_and_has_dependent_nodes": False,
+                    }
+                ],
+                "is_about": [
+                    {
+                        "uid": "c",
+                        "label": "C",
+                        "is_deleted": True,
+                        "inbound_count": 2,
+                        "relData": {},
+                        "rel_type": "is_about",
+                        "deleted_and_has_dependent_nodes": True,
+                    }
+                ],
+                "mentions": [
+                    {
+                        "uid": "e",
+                        "label": "E",
+                        "relData": {},
+                        "rel_type": "mentions",
+                        "deleted_and_has_dependent_nodes": False,
+                    }
+                ],
+                "relation_totals": {"is_about": 60, "mentions": 1},
+                "relation_next": {"is_about": encode_list_cursor("C", "c")},
+                "is_merged_item": False,
+            },
+        )
+
+    def test_merged_nodes_have_no_relation_data(self):
+        rows = {
+            **ITEM_ROWS,
+            MAIN_QUERY: [
+                [{"uid": "a", "real_type": "thing"}, [{"uid": "m", "real_type": "thing"}]]
+            ],
+            FACET_QUERIES["outgoing"]: [
+                ["a", "knows", {"certainty": 1}, {"uid": "b"}],
+                ["m", "knows", {"certainty": 2}, {"uid": "b"}],
+            ],
+        }
+        with FakeItemDatabase(rows).patch():
+            items, missing = get_items(["a"])
+        item = items["a"]
+        self.assertTrue(item["is_merged_item"])
+        self.assertEqual(item["knows"][0]["relData"], {"certainty": 1})
+        self.assertNotIn("relData", item["merged_items"][0]["knows"][0])
+
+
+class ItemProjectionTests(SimpleTestCase):
+    def test_related_keys_always_include_the_uid_and_inbound_count(self):
+        self.assertIsNone(get_related_keys(None))
+        self.assertEqual(
+            get_related_keys(["label", "uid"]), ["uid", "label", "inbound_count"]
+        )
+
+    def test_projection_is_skipped_without_related_keys(self):
+        projection = projected("o")
+        self.assertIn("WHEN $related_keys IS NULL THEN properties(o)", projection)
+        self.assertIn("WHERE o[k] IS NOT NULL", projection)
+
+    def test_inbound_count_is_only_returned_if_asked_for(self):
+        node = {"uid": "c", "is_deleted": True, "inbound_count": 2}
+        view = build_related_node_view(node, "is_about", ["uid", "is_deleted"])
+        self.assertEqual(
+            view,
+            {
+                "uid": "c",
+                "is_deleted": True,
+                "rel_type": "is_about",
+                "deleted_and_has_dependent_nodes": True,
+            },
+        )
+        view = build_related_node_view(node, "is_about", ["inbound_count"])
+        self.assertEqual(view["inbound_count"], 2)
+
+    def test_fields_restrict_the_item_and_its_neighbours(self):
+        database = FakeItemDatabase(ITEM_ROWS)
+        with database.patch():
+            items, missing = get_items(["a"], fields=["label", "knows"])
+        self.assertEqual(
+            items["a"],
+            {
+                "uid": "a",
+                "real_type": "thing",
+                "label": "A",
+                "knows": [
+                    {
+                        "uid": "b",
+                        "label": "B",
+                        "relData": {"certainty": 1},
+                        "rel_type": "knows",
+                        "deleted_and_has_dependent_nodes": False,
+                    }
+                ],
+                "is_merged_item": False,
+            },
+        )
+        self.assertEqual(
+            database.params[FACET_QUERIES["outgoing"]]["related_keys"],
+            get_related_keys(DEFAULT_RELATED_FIELDS),
+        )
+
+
+class CertaintyRel(StructuredRel):
+    certainty = StringProperty()
+
+
+class RelationWritesTests(SimpleTestCase):
+    def setUp(self):
+        self.model_class = type("Birth", (), {})
+        app_model = SimpleNamespace(
+            relations={
+                "is_about": SimpleNamespace(
+                    definition={"model": CertaintyRel, "relation_type": "IS_ABOUT"}
+                ),
+                "person_born": SimpleNamespace(
+                    definition={"model": CertaintyRel, "relation_type": "PERSON_BORN"}
+                ),
+            },
+            fields={
+                "is_about": {"cardinality": "ZeroOrMore"},
+                "person_born": {"cardinality": "One"},
+            },
+        )
+        patcher = mock.patch.dict(
+            "pros_core.batched_writes.PROS_MODELS", {"birth": app_model}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_one_write_per_related_node(self):
+        writes = build_relation_writes(
+            self.model_class,
+            "s",
+            {
+                "is_about": [
+                    {"uid": "x"},
+                    {"uid": "y", "relData": {"certainty": "probable"}},
+                    {"uid": "x"},
+                ]
+            },
+        )
+        self.assertEqual(
+            [(w["source"], w["type"], w["target"], w["properties"]) for w in writes],
+            [
+                ("s", "IS_ABOUT", "x", {}),
+                ("s", "IS_ABOUT", "y", {"certainty": "probable"}),
+            ],
+        )
+
+    def test_single_cardinality_rejects_a_second_node(self):
+        with self.assertRaises(AttemptedCardinalityViolation):
+            build_relation_writes(
+                self.model_class, "s", {"person_born": [{"uid": "x"}, {"uid": "y"}]}
+            )
+
+    def test_single_cardinality_allows_the_same_node_twice(self):
+        writes = build_relation_writes(
+            self.model_class, "s", {"person_born": [{"uid": "x"}, {"uid": "x"}]}
+        )
+        self.assertEqual([w["target"] for w in writes], ["x"])
+
+    def test_diff_writes_only_the_difference(self):
+        added, changed, removed = diff_relations(
+            self.model_class,
+            "s",
+            {
+                "is_about": [
+                    {"uid": "x", "relData": {"certainty": "certain"}},
+                    {"uid": "y"},
+                    {"uid": "z"},
+                ]
+            },
+            [
+                (1, "IS_ABOUT", "x", {"certainty": "probable"}),
+                (2, "IS_ABOUT", "y", {}),
+                (3, "IS_ABOUT", "w", {}),
+                (4, "IS_ABOUT", "y", {}),
+            ],
+        )
+        self.assertEqual([w["target"] for w in added], ["z"])
+        self.assertEqual(changed, [{"id": 1, "properties": {"certainty": "certain"}}])
+        self.assertEqual([r["id"] for r in removed], [3, 4])
+
+    def test_diff_of_unchanged_relations_is_empty(self):
+        self.assertEqual(
+            diff_relations(
+                self.model_class,
+                "s",
+                {"is_about": [{"uid": "x"}]},
+                [(1, "IS_ABOUT", "x", {})],
+            ),
+            ([], [], []),
+        )
+
+    def test_diff_checks_cardinality(self):
+        with self.assertRaises(AttemptedCardinalityViolation):
+            diff_relations(
+                self.model_class,
+                "s",
+                {"person_born": [{"uid": "x"}, {"uid": "y"}]},
+                [(1, "PERSON_BORN", "x", {})],
+            )
+
+
+class InlineNodeChangesTests(SimpleTestCase):
+    def setUp(self):
+        self.model_class = type("Birth", (), {})
+        self.date_class = type("Date", (), {})
+        self.place_class = type("Place", (), {})
+        app_model = SimpleNamespace(
+            inline_relations={
+                "date": SimpleNamespace(
+                    definition={"model": CertaintyRel, "relation_type": "DATE"}
+                ),
+                "place": SimpleNamespace(
+                    definition={"model": CertaintyRel, "relation_type": "PLACE"}
+                ),
+            },
+        )
+        self.stored = []
+        for target, kwargs in [
+            ("pros_core.batched_writes.PROS_MODELS", {"new": {"birth": app_model}}),
+            ("pros_core.batched_writes.db", {}),
+            ("pros_core.batched_writes.plan_node_changes", {}),
+            (
+                "pros_core.batched_writes.build_node_writes",
+                {"side_effect": self.build_node_writes},
+            ),
+            ("pros_core.batched_writes.build_relation_writes", {"return_value": []}),
+        ]:
+            patcher = mock.patch(target, **kwargs)
+            setattr(self, target.rsplit(".", 1)[1], patcher.start())
+            self.addCleanup(patcher.stop)
+        self.db.cypher_query.side_effect = lambda query, params: (self.stored, None)
+
+    def build_node_writes(self, nodes):
+        ((node_class, property_data),) = nodes
+        return [{"labels": [node_class.__name__]}], [{"uid": "new", **property_data}]
+
+    def plan(self, inline_nodes, username="editor"):
+        changes = new_changes()
+        plan_inline_node_changes(self.model_class, "b", inline_nodes, username, changes)
+        return changes
+
+    def test_stored_inline_nodes_are_read_in_one_query(self):
+        self.plan({"date": (self.date_class, {}, {}), "place": (self.place_class, {}, {})})
+        self.db.cypher_query.assert_called_once_with(
+            CURRENT_INLINE_NODES_QUERY, {"uid": "b", "types": ["DATE", "PLACE"]}
+        )
+
+    def test_nothing_is_read_without_inline_nodes(self):
+        self.assertEqual(self.plan({}), new_changes())
+        self.db.cypher_query.assert_not_called()
+
+    def test_inline_node_of_the_same_type_is_updated_in_place(self):
+        stored_node = {"uid": "d", "real_type": "date"}
+        stored_relations = [(7, "IS_ABOUT", "x", {})]
+        self.stored = [
+            ["DATE", 1, stored_node, ["Date", "ProsInlineOnlyNode"], stored_relations]
+        ]
+
+        changes = self.plan(
+            {"date": (self.date_class, {"date": "1600"}, {"is_about": []})}
+        )
+        self.plan_node_changes.assert_called_once_with(
+            self.date_class,
+            stored_node,
+            {"date": "1600"},
+            {"is_about": []},
+            stored_relations,
+            changes,
+        )
+        self.assertEqual(changes, new_changes())
+
+    def test_entities_inlined_record_their_modification(self):
+        self.stored = [["PLACE", 1, {"uid": "p", "real_type": "place"}, ["Place"], []]]
+        self.plan(
+            {"place": (self.place_class, {"label": "Paris", "createdBy": "x"}, {})}
+        )
+        property_data = self.plan_node_changes.call_args.args[2]
+        self.assertEqual(property_data["label"], "Paris")
+        self.assertEqual(property_data["modifiedBy"], "editor")
+        self.assertNotIn("createdBy", property_data)
+        self.assertIn("modifiedWhen", property_data)
+
+    def test_inline_node_of_another_type_is_replaced_and_deleted(self):
+        stored_relations = [(7, "IS_ABOUT", "x", {})]
+        stored_node = {"uid": "d", "real_type": "date"}
+        self.stored = [
+            ["DATE", 1, stored_node, ["ProsInlineOnlyNode"], stored_relations]
+        ]
+        changes = self.plan({"date": (self.place_class, {"label": "Paris"}, {})})
+        self.plan_node_changes.assert_not_called()
+        self.assertEqual(changes["created_nodes"], [{"labels": ["Place"]}])
+        self.assertEqual(
+            [(w["source"], w["type"], w["target"]) for w in changes["added_relations"]],
+            [("b", "DATE", "new")],
+        )
+        self.assertEqual([r["id"] for r in changes["removed_relations"]], [1, 7])
+        self.assertEqual(changes["deleted_nodes"], ["d"])
+
+    def test_replaced_entities_are_not_deleted(self):
+        self.stored = [["PLACE", 1, {"uid": "p", "real_type": "place"}, ["Place"], []]]
+        changes = self.plan({"place": (self.date_class, {"date": "1600"}, {})})
+        self.assertEqual([r["id"] for r in changes["removed_relations"]], [1])
+        self.assertEqual(changes["deleted_nodes"], [])
+
+
+class BulkUpsertChunkTests(SimpleTestCase):
+    def setUp(self):
+        self.model_class = type("Person", (), {"__label__": "Person"})
+        self.stored = {"known"}
+        self.failing = set()
+        self.written = []
+        for target, kwargs in [
+            ("pros_core.bulk_upsert.db", {"cypher_query": self.cypher_query}),
+            ("pros_core.bulk_upsert.write_changes", {"side_effect": self.write_changes}),
+            ("pros_core.bulk_upsert.refresh_template_labels", {"return_value": {}}),
+            ("pros_core.bulk_upsert.get_affected_uids", {"side_effect": set}),
+            ("pros_core.bulk_upsert.record_entity_changes", {}),
+        ]:
+            patcher = mock.patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict(
+            "pros_core.bulk_upsert.PROS_MODELS", {"person": SimpleNamespace()}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bulk = BulkUpsert(self.model_class, "editor")
+        self.bulk.plan_row = self.plan_row
+
+    def cypher_query(self, query, params):
+        return [[uid, ["ProsNode"]] for uid in params["uids"] if uid in self.stored], None
+
+    def plan_row(self, row, exists, now, changes):
+        if row["uid"] in self.failing:
+            raise DoesNotExist(f"Could not plan {row['uid']}")
+        changes["created_nodes"].append(row["uid"])
+        return {"line": row["line"], "status": CREATED, "uid": row["uid"]}
+
+    def write_changes(self, created_nodes=(), **changes):
+        self.written += created_nodes
+
+    def row(self, line, uid, *related_uids):
+        return {
+            "line": line,
+            "uid": uid,
+            "property_data": {},
+            "relation_data": {"knows": [{"uid": u} for u in related_uids]},
+            "inline_nodes": {},
+        }
+
+    def statuses(self, results):
+        return {line: result["status"] for line, result in sorted(results.items())}
+
+    def test_rows_may_relate_to_stored_nodes_and_to_each_other(self):
+        results = self.bulk.write_chunk(
+            [self.row(1, "a", "known", "b"), self.row(2, "b", "a"), self.row(3, "c")]
+        )
+        self.assertEqual(self.statuses(results), {1: CREATED, 2: CREATED, 3: CREATED})
+        self.assertCountEqual(self.written, ["a", "b", "c"])
+
+    def test_rows_relating_to_missing_nodes_are_errors(self):
+        results = self.bulk.write_chunk([self.row(1, "a", "nowhere"), self.row(2, "b")])
+        self.assertEqual(self.statuses(results), {1: ERROR, 2: CREATED})
+        self.assertEqual(results[1]["errors"], ["Related nodes not found: nowhere"])
+        self.assertEqual(self.written, ["b"])
+
+    def test_rows_relating_to_rows_that_fail_are_errors_in_turn(self):
+        self.failing = {"c"}
+        results = self.bulk.write_chunk(
+            [
+                self.row(1, "a", "b"),
+                self.row(2, "b", "c"),
+                self.row(3, "c"),
+                self.row(4, "d", "known"),
+            ]
+        )
+        self.assertEqual(
+            self.statuses(results), {1: ERROR, 2: ERROR, 3: ERROR, 4: CREATED}
+        )
+        self.assertEqual(results[2]["errors"], ["Related nodes not written: c"])
+        self.assertEqual(results[1]["errors"], ["Related nodes not written: b"])
+        self.assertEqual(self.written, ["d"])
+
+    def test_duplicate_uids_are_errors(self):
+        results = self.bulk.write_chunk([self.row(1, "a"), self.row(2, "a")])
+        self.assertEqual(self.statuses(results), {1: CREATED, 2: ERROR})
+
+
+def typed_branch(type_name: str, **properties) -> dict:
+    return {
+        "type": "object",
+        "properties": {"type": {"const": type_name}, **properties},
+        "required": list(properties),
+    }
+
+
+class DiscriminatorTests(SimpleTestCase):
+    def setUp(self):
+        self.date_branch = typed_branch("singledate", date={"type": "string"})
+        self.range_branch = typed_branch(
+            "daterange", start={"type": "string"}, end={"type": "string"}
+        )
+        self.schema = {
+            "type": "object",
+            "properties": {
+                "label": {"type": "string"},
+                "date": {"oneOf": [self.date_branch, self.range_branch]},
+            },
+        }
+
+    def test_typed_one_of_becomes_a_discriminator(self):
+        schema = with_discriminators(self.schema)
+        self.assertEqual(
+            schema["properties"]["date"],
+            {
+                "discriminator": {
+                    "propertyName": "type",
+                    "mapping": {
+                        "singledate": self.date_branch,
+                        "daterange": self.range_branch,
+                    },
+                }
+            },
+        )
+        # The schema served to the interface is left as it is
+        self.assertIn("oneOf", self.schema["properties"]["date"])
+
+    def test_one_of_without_distinct_type_consts_is_kept(self):
+        for branches in (
+            [self.date_branch, {"type": "string"}],
+            [self.date_branch, typed_branch("singledate")],
+        ):
+            schema = {"oneOf": branches}
+            self.assertEqual(with_discriminators(schema), schema)
+
+    def test_validates_against_the_selected_branch(self):
+        validator = compile_validator(self.schema)
+        self.assertEqual(
+            list(validator.iter_errors({"date": {"type": "singledate", "date": "1600"}})),
+            [],
+        )
+
+        (error,) = validator.iter_errors({"date": {"type": "daterange", "start": "1600"}})
+        self.assertEqual(error.message, "'end' is a required property")
+
+        (error,) = validator.iter_errors({"date": {"type": "unknown"}})
+        self.assertEqual(list(error.absolute_path), ["date", "type"])
+
+        (error,) = validator.iter_errors({"date": {"date": "1600"}})
+        self.assertEqual(error.message, "'type' is a required property")
+
+
+class LabelTemplateTests(SimpleTestCase):
+    def setUp(self):
+        self.template = LabelTemplate(
+            "Letter {title} from {sender.label} to {recipient.__all__.label}",
+            {"sender": "SENDER", "recipient": "RECIPIENT"},
+        )
+
+    def test_renders_properties_and_related_labels_in_label_order(self):
+        self.assertEqual(
+            self.template.render(
+                {"title": "of thanks"},
+                [
+                    ["RECIPIENT", "Zoe"],
+                    ["SENDER", "Mary"],
+                    ["RECIPIENT", "Anne"],
+                    ["SENDER", "Jane"],
+                ],
+            ),
+            "Letter of thanks from Jane to Anne, Zoe",
+        )
+
+    def test_skips_empty_labels_and_missing_values(self):
+        self.assertEqual(
+            self.template.render({}, [["SENDER", ""], ["SENDER", None]]),
+            "Letter from to",
+        )
+
+    def test_orders_labels_as_the_interface_does(self):
+        # By UTF-16 code unit: astral characters sort before U+FFxx
+        template = LabelTemplate("{sender.label}", {"sender": "SENDER"})
+        self.assertEqual(
+            template.render({}, [["SENDER", "\uff21"], ["SENDER", "\U0001d400"]]),
+            "\U0001d400",
+        )
+
+    def test_compiles_only_relation_placeholders(self):
+        app_model = SimpleNamespace(
+            meta={"construct_label_template": "{name} born {person_born.label}"},
+            fields={
+                "name": {"type": "property"},
+                "person_born": {"type": "relation", "relation_type": "PERSON_BORN"},
+                "birth_date": {
+                    "type": "relation",
+                    "relation_type": "BIRTH_DATE",
+                    "inline_relation": True,
+                },
+            },
+        )
+        self.assertEqual(
+            compile_label_template(app_model),
+            LabelTemplate(
+                "{name} born {person_born.label}", {"person_born": "PERSON_BORN"}
+            ),
+        )
+
+    def test_abstract_models_have_no_template(self):
+        app_model = SimpleNamespace(
+            meta={"construct_label_template": "{name}", "abstract": True}, fields={}
+        )
+        self.assertIsNone(compile_label_template(app_model))
+
+
+class SnapshotStoreTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.model_class = type("Person", (), {})
+        self.rows = [{"uid": "a", "label": "Albert"}]
+        self.store = SnapshotStore(directory.name, lambda model_class: iter(self.rows))
+        self.store.register([self.model_class])
+        self.version = 3
+        patcher = mock.patch.multiple(
+            "pros_core.change_log",
+            get_version=lambda key: (self.version, None),
+            get_versions=lambda keys: {key: self.version for key in keys},
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_build_writes_every_encoding_under_the_version(self):
+        self.assertEqual(self.store.build(self.model_class), 3)
+        path = self.store.get(self.model_class, 3, IDENTITY)
+        self.assertEqual(json.loads(path.read_bytes()), self.rows)
+        gzip_path = self.store.get(self.model_class, 3, GZIP)
+        self.assertEqual(json.loads(gzip.decompress(gzip_path.read_bytes())), self.rows)
+        self.assertEqual(self.store.current_seq("person"), 3)
+
+    def test_build_removes_older_snapshots(self):
+        self.store.build(self.model_class)
+        self.version = 5
+        self.store.build(self.model_class)
+        self.assertIsNone(self.store.get(self.model_class, 3, IDENTITY))
+        self.assertIsNone(self.store.get(self.model_class, 3, GZIP))
+        self.assertIsNotNone(self.store.get(self.model_class, 5, IDENTITY))
+
+    def test_rebuild_stale_only_rebuilds_changed_types(self):
+        self.assertEqual(self.store.rebuild_stale(), ["person"])
+        self.assertEqual(self.store.rebuild_stale(), [])
+        self.version = 4
+        self.assertEqual(self.store.rebuild_stale(), ["person"])
+
+
+class SnapshotSchedulingTests(SimpleTestCase):
+    def setUp(self):
+        self.store = SnapshotStore("unused", lambda model_class: [], debounce=2, max_delay=5)
+        self.now = 100.0
+        self.timers = []
+        for target, side_effect in [
+            ("pros_core.snapshots.time.monotonic", lambda: self.now),
+            ("pros_core.snapshots.threading.Timer", self.timer),
+        ]:
+            patcher = mock.patch(target, side_effect=side_effect)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def timer(self, delay, function):
+        timer = mock.Mock(delay=delay)
+        self.timers.append(timer)
+        return timer
+
+    def test_writes_reset_the_debounce(self):
+        self.store.schedule_rebuild()
+        self.now += 1
+        self.store.schedule_rebuild()
+        self.assertEqual([timer.delay for timer in self.timers], [2, 2])
+        self.timers[0].cancel.assert_called_once()
+
+    def test_writes_cannot_postpone_a_rebuild_beyond_the_maximum_delay(self):
+        self.store.schedule_rebuild()
+        self.now += 4
+        self.store.schedule_rebuild()
+        self.now += 2
+        self.store.schedule_rebuild()
+        self.assertEqual([timer.delay for timer in self.timers], [2, 1, 0])
+
+    def test_reads_leave_a_pending_rebuild_as_it_is(self):
+        self.store.schedule_rebuild(reset=False)
+        self.now += 1
+        self.store.schedule_rebuild(reset=False)
+        self.assertEqual(len(self.timers), 1)
+        self.timers[0].cancel.assert_not_called()
+
+
+def list_request(query_params: dict | None = None, accept: str = "") -> SimpleNamespace:
+    return SimpleNamespace(query_params=query_params or {}, META={"HTTP_ACCEPT": accept})
+
+
+class StreamingTests(SimpleTestCase):
+    rows = [{"uid": "a", "label": "Ä"}, {"uid": "b", "label": None}, {"uid": "c"}]
+
+    def test_ndjson_is_one_row_per_line_in_chunks(self):
+        chunks = list(stream_ndjson(self.rows, chunk_rows=2))
+        self.assertEqual(len(chunks), 2)
+        lines = b"".join(chunks).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.rows)
+        self.assertIn('"Ä"', lines[0])
+
+    def test_json_array_parses_as_the_rows(self):
+        for chunk_rows in (1, 2, 10):
+            data = b"".join(stream_json_array(self.rows, chunk_rows=chunk_rows))
+            self.assertEqual(json.loads(data), self.rows)
+
+    def test_empty_json_array(self):
+        self.assertEqual(b"".join(stream_json_array([])), b"[]")
+        self.assertEqual(b"".join(stream_ndjson([])), b"")
+
+    def test_stream_format_from_param_or_accept_header(self):
+        self.assertEqual(get_stream_format(list_request({"stream": "json"})), JSON_ARRAY)
+        self.assertEqual(get_stream_format(list_request({"stream": "csv"})), None)
+        self.assertEqual(
+            get_stream_format(list_request(accept="application/x-ndjson")), NDJSON
+        )
+        self.assertEqual(get_stream_format(list_request(accept="application/json")), None)
+
+    def test_list_selection_params(self):
+        self.assertEqual(
+            list_selection_params(
+                list_request({"stream": "ndjson", "limit": "10", "filter": "smith"})
+            ),
+            ["filter", "limit"],
+        )
+        self.assertEqual(list_selection_params(list_request({"stream": "ndjson"})), [])
+
+
+class ListDispatchTests(SimpleTestCase):
+    def setUp(self):
+        for target, value in [
+            ("stream_list", "streamed"),
+            ("do_list", ResponseValue(["listed"])),
+        ]:
+            patcher = mock.patch.object(ProsAbstractViewSet, target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch("pros_core.viewsets.LIST_SNAPSHOTS", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.viewset = ProsAbstractViewSet()
+
+    def test_full_lists_are_streamed(self):
+        self.assertEqual(self.viewset.list(list_request({"stream": "ndjson"})), "streamed")
+        self.assertEqual(
+            self.viewset.list(list_request(accept="application/x-ndjson")), "streamed"
+        )
+
+    def test_selected_lists_are_not_streamed(self):
+        for params in ({"filter": "smith"}, {"since_seq": "4"}, {"after": "x", "limit": "5"}):
+            response = self.viewset.list(list_request(params, accept="application/x-ndjson"))
+            self.assertEqual(response.data, ["listed"])
+
+    def test_streaming_a_selected_list_is_an_error(self):
+        response = self.viewset.list(list_request({"stream": "json", "limit": "5"}))
+        self.assertEqual(response.status_code, 400)
+        ProsAbstractViewSet.stream_list.assert_not_called()
+        ProsAbstractViewSet.do_list.assert_not_called()
+
+
+class ListPageTests(SimpleTestCase):
+    def test_cursor_round_trip(self):
+        for label, uid in [("Anna Smith", "a"), ("Zoë /+=", "b"), ("", "c")]:
+            cursor = encode_list_cursor(label, uid)
+            self.assertNotIn("=", cursor)
+            self.assertEqual(decode_list_cursor(cursor), (label, uid))
+
+    def test_unlabelled_rows_have_an_empty_label_cursor(self):
+        self.assertEqual(decode_list_cursor(encode_list_cursor(None, "a")), ("", "a"))
+
+    def test_invalid_cursors(self):
+        for cursor in [
+            "not base64!",
+            encode_list_cursor("a", "b")[:-3],
+            base64.urlsafe_b64encode(b'["a"]').decode(),
+            base64.urlsafe_b64encode(b'[1, "b"]').decode(),
+        ]:
+            with self.assertRaises(ValueError):
+                decode_list_cursor(cursor)
+
+    def test_page_of_queried_rows(self):
+        model_class = type("Person", (), {"Meta": type("Meta", (), {})})
+        rows = [{"uid": "a", "label": "Albert"}, {"uid": "b"}, {"uid": "c"}]
+        with mock.patch(
+            "pros_core.viewsets.uses_list_projection", return_value=False
+        ), mock.patch(
+            "pros_core.viewsets.read_list_version", return_value=ListVersion(1, None, 1)
+        ), mock.patch(
+            "pros_core.viewsets.query_list_rows", return_value=rows
+        ) as query_list_rows:
+            page, list_version = get_list_page(model_class, ("", "x"), 2)
+        query_list_rows.assert_called_once_with(model_class, after=("", "x"), limit=3)
+        self.assertEqual(page["results"], rows[:2])
+        self.assertEqual(decode_list_cursor(page["next"]), ("", "b"))
+
+    def test_page_query_seeks_the_label_index(self):
+        match = build_list_match(LIST_QUERY_PAGE, "Person")
+        self.assertIn('a.label >= coalesce($after_label, "")', match)
+        self.assertIn("ORDER BY a.label, a.uid", match)
+
+    def test_list_order_indexes(self):
+        models = {
+            "person": SimpleNamespace(model=type("Person", (), {}), meta={}),
+            "date": SimpleNamespace(model=type("Date", (), {}), meta={"inline_only": True}),
+        }
+        with mock.patch("pros_core.indexes.PROS_MODELS", models):
+            self.assertEqual(
+                build_list_order_indexes(),
+                [
+                    "CREATE INDEX person_label_uid IF NOT EXISTS "
+                    "FOR (n:Person) ON (n.label, n.uid)"
+                ],
+            )
+
+
+def conditional_request(**headers) -> SimpleNamespace:
+    return SimpleNamespace(META={f"HTTP_{k.upper()}": v for k, v in headers.items()})
+
+
+class ConditionalTests(SimpleTestCase):
+    etag = build_etag("person", 7)
+    last_modified = datetime.datetime(2024, 1, 2, 3, 4, 5, 600000, datetime.timezone.utc)
+
+    def test_weak_etag_of_its_parts(self):
+        self.assertEqual(self.etag, 'W/"person-7"')
+
+    def test_headers(self):
+        self.assertEqual(
+            conditional_headers(self.etag, self.last_modified),
+            {
+                "ETag": 'W/"person-7"',
+                "Cache-Control": "no-cache",
+                "Last-Modified": "Tue, 02 Jan 2024 03:04:05 GMT",
+            },
+        )
+        self.assertNotIn("Last-Modified", conditional_headers(self.etag, None))
+
+    def test_if_none_match(self):
+        for if_none_match, not_modified in [
+            ('W/"person-7"', True),
+            ('"person-7"', True),
+            ('W/"person-6", W/"person-7"', True),
+            ("*", True),
+            ('W/"person-6"', False),
+        ]:
+            with self.subTest(if_none_match):
+                self.assertEqual(
+                    is_not_modified(
+                        conditional_request(if_none_match=if_none_match), self.etag
+                    ),
+                    not_modified,
+                )
+
+    def test_if_none_match_takes_precedence(self):
+        request = conditional_request(
+            if_none_match='W/"person-6"',
+            if_modified_since="Tue, 02 Jan 2024 03:04:05 GMT",
+        )
+        self.assertFalse(is_not_modified(request, self.etag, self.last_modified))
+
+    def test_if_modified_since(self):
+        for if_modified_since, not_modified in [
+            # Sub-second precision is lost in the header
+            ("Tue, 02 Jan 2024 03:04:05 GMT", True),
+            ("Wed, 03 Jan 2024 00:00:00 GMT", True),
+            ("Tue, 02 Jan 2024 03:04:04 GMT", False),
+            ("not a date", False),
+        ]:
+            with self.subTest(if_modified_since):
+                request = conditional_request(if_modified_since=if_modified_since)
+                self.assertEqual(
+                    is_not_modified(request, self.etag, self.last_modified),
+                    not_modified,
+                )
+
+    def test_no_validators(self):
+        self.assertFalse(is_not_modified(conditional_request(), self.etag, self.last_modified))
+        request = conditional_request(if_modified_since="Wed, 03 Jan 2024 00:00:00 GMT")
+        self.assertFalse(is_not_modified(request, self.etag))
+
+
+class ChangeLogQueryTests(SimpleTestCase):
+    def changes_since(self, results):
+        with mock.patch("pros_core.change_log.db") as db:
+            db.cypher_query.return_value = results, None
+            return change_log.get_changes_since("Person", 3)
+
+    def test_later_changes_supersede_earlier_ones(self):
+        self.assertEqual(
+            self.changes_since(
+                [[7, [["a", "create"], ["b", "update"], ["a", "delete"]]]]
+            ),
+            (7, {"a": "delete", "b": "update"}),
+        )
+
+    def test_no_changes(self):
+        self.assertEqual(self.changes_since([[7, []]]), (7, {}))
+        # As an OPTIONAL MATCH without matches would collect them
+        self.assertEqual(self.changes_since([[7, [[None, None]]]]), (7, {}))
+
+    def test_null_changes_are_not_collected(self):
+        with mock.patch("pros_core.change_log.db") as db:
+            db.cypher_query.return_value = [[0, []]], None
+            change_log.get_changes_since(None, 0)
+        query, params = db.cypher_query.call_args[0]
+        self.assertIn("CASE WHEN c IS NULL THEN null", query)
+        self.assertEqual(params["entity_type"], None)
+
+
+class OutboxTests(SimpleTestCase):
+    def setUp(self):
+        self.handled = {}
+        handlers = {
+            "a": lambda payloads: self.handled.setdefault("a", payloads),
+            "b": lambda payloads: self.handled.setdefault("b", payloads),
+            "failing": mock.Mock(side_effect=RuntimeError),
+        }
+        patcher = mock.patch.dict(
+            "pros_core.outbox.OUTBOX_HANDLERS", handlers, clear=True
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("pros_core.outbox.db")
+        self.db = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def process(self, events):
+        with mock.patch("pros_core.outbox.claim_events", return_value=events):
+            claimed = process_events(10)
+        deleted = [
+            call.args[1]["ids"]
+            for call in self.db.cypher_query.call_args_list
+            if call.args[0] == DELETE_EVENTS_QUERY
+        ]
+        return claimed, deleted
+
+    def test_handles_each_topic_in_one_call(self):
+        claimed, deleted = self.process(
+            [
+                ["1", "a", json.dumps({"uid": "x"}), 1],
+                ["2", "b", json.dumps({"uid": "y"}), 1],
+                ["3", "a", json.dumps({"uid": "z"}), 2],
+            ]
+        )
+        self.assertEqual(claimed, 3)
+        self.assertEqual(self.handled, {"a": [{"uid": "x"}, {"uid": "z"}], "b": [{"uid": "y"}]})
+        (deleted_ids,) = deleted
+        self.assertCountEqual(deleted_ids, ["1", "2", "3"])
+
+    def test_failed_events_are_kept_for_a_retry(self):
+        with self.assertLogs("pros_core.outbox", "ERROR") as logs:
+            claimed, deleted = self.process(
+                [
+                    ["1", "a", json.dumps({}), 1],
+                    ["2", "failing", json.dumps({}), OUTBOX_MAX_ATTEMPTS],
+                    ["3", "unknown", json.dumps({}), 1],
+                ]
+            )
+        self.assertEqual(deleted, [["1"]])
+        self.assertIn(
+            f"attempt {OUTBOX_MAX_ATTEMPTS} of {OUTBOX_MAX_ATTEMPTS}", logs.output[0]
+        )
+
+    def test_nothing_is_deleted_without_handled_events(self):
+        self.assertEqual(self.process([]), (0, []))
+
+    def test_claims_are_leased_and_capped(self):
+        # Claimed events only become available again once their lease expires,
+        # and are no longer claimed after their last attempt
+        self.assertIn("e.available_at <= timestamp()", CLAIM_EVENTS_QUERY)
+        self.assertIn("e.attempts < $max_attempts", CLAIM_EVENTS_QUERY)
+        self.assertIn(
+            "SET e.available_at = timestamp() + $lease, e.attempts = e.attempts + 1",
+            CLAIM_EVENTS_QUERY,
+        )
+
+    def test_worker_runs_until_a_batch_is_not_full(self):
+        with mock.patch(
+            "pros_core.outbox.process_events", side_effect=[10, 10, 3]
+        ) as process:
+            run_worker(batch_size=10, once=True)
+        self.assertEqual(process.call_count, 3)
+
+    def test_nodes_created_by_neomodel_emit_their_events(self):
+        event = {"id": "1", "topic": "a", "payload": "{}"}
+        node = mock.Mock(__properties__={"uid": "x"})
+        node.outbox_events_on_create.return_value = [event]
+        with mock.patch("pros_core.models.emit") as emit:
+            ProsNode.post_create(node)
+        node.outbox_events_on_create.assert_called_once_with({"uid": "x"})
+        emit.assert_called_once_with(event)
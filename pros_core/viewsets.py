@@ -1,24 +1,71 @@
+import base64
+import concurrent.futures
 import datetime
 import itertools
-from typing import Type, Callable
+import json
+import re
+from typing import Type, Callable, Iterator
 
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
 from django.urls import path
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from jsonschema import validate, ValidationError
 
-from neomodel.exceptions import DoesNotExist
+from neomodel.exceptions import AttemptedCardinalityViolation, DoesNotExist
+from neo4j.exceptions import ClientError
 from neomodel import db
 from neomodel.properties import DateTimeProperty, DateProperty
 import neomodel
 from neo4j.time import DateTime as neo4jDateTime
 
 from pros_core.setup_app import PROS_MODELS
+from pros_core.schema_validation import validate_instance
+from pros_core.template_labels import refresh_template_labels
+from pros_core.queries import LIST_QUERY_ALL, LIST_QUERY_PAGE, LIST_QUERY_UIDS
+from pros_core.streaming import (
+    STREAM_CONTENT_TYPES,
+    STREAM_ENCODERS,
+    get_stream_format,
+    list_selection_params,
+)
+from pros_core.snapshots import IDENTITY, SnapshotStore, accepted_encoding
 
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework.request import Request
 from pros_core.models import ProsInlineOnlyNode, ProsNode, DeletedNode
 from pros_core.filters import icontains
+from pros_core.list_projection import (
+    ListProjectionRegistry,
+    ListVersion,
+    read_list_version,
+)
+from pros_core.item_retrieval import (
+    DEFAULT_RELATED_FIELDS,
+    RELATION_ORDERINGS,
+    RELATION_PAGE_SIZE,
+    RELATION_PAGE_SIZE_MAX,
+    get_item,
+    get_items,
+    get_relation_page,
+)
+from pros_core.item_cache import ItemCache
+from pros_core.batched_writes import (
+    create_entity,
+    update_entity,
+)
+from pros_core.merge_clusters import (
+    get_merge_cluster,
+    merge_nodes,
+    refresh_merge_cluster,
+    unmerge_nodes,
+)
+from pros_core.indexes import fulltext_index_name
+from pros_core.label_index import LABEL_INDEX
+from pros_core.signals import entities_changed
+from pros_core import change_log
+from pros_core.conditional import build_etag, conditional_headers, is_not_modified
+from django.dispatch import receiver
 
 from multilookupdict import MultiLookupDict
 
@@ -36,9 +83,10 @@ class ResponseValue:
 
     data: dict
     status: int = 200
+    headers: dict | None = None
 
     def keys(self):
-        return ["data", "status"]
+        return ["data", "status", "headers"]
 
     def __getitem__(self, key):
         return self.__dict__.get(key)
@@ -47,16 +95,100 @@ class ResponseValue:
         yield from (self.data, self.status)
 
 
+# Default and maximum page sizes for keyset-paginated lists
+LIST_PAGE_SIZE = 100
+LIST_PAGE_SIZE_MAX = 1000
+# Default number of ranked results for a text-filtered list
+LIST_FILTER_LIMIT = 50
+# Maximum number of uids retrieved by one batch request
+ITEM_BATCH_SIZE_MAX = 200
+# Number of list types fetched concurrently by the bulk list endpoint
+BULK_LIST_WORKERS = 8
+# Default and maximum number of autocomplete suggestions
+AUTOCOMPLETE_LIMIT = 20
+AUTOCOMPLETE_LIMIT_MAX = 200
+
+
 # Utility functions
 
 
 def delete_all_inline_nodes(instance):
-    q = Pypher()
-    q.MATCH.node("s", uid=instance.uid).rel_out("p").node(
-        "o", labels="ProsInlineOnlyNode"
+    # Nodes related from the inline nodes lose an inbound relation
+    q = """
+    MATCH (s {uid: $uid})-[p]->(o:ProsInlineOnlyNode)
+    OPTIONAL MATCH (o)-[r]->(target)
+    WHERE NOT type(r) IN $excluded_types
+    WITH o, target, count(r) AS removed
+    SET target.inbound_count = coalesce(target.inbound_count, 0) - removed
+    WITH DISTINCT o
+    DETACH DELETE o
+    """
+    results, meta = db.cypher_query(
+        q,
+        {
+            "uid": instance.uid,
+            "excluded_types": list(neomodel.config.INBOUND_COUNT_EXCLUDED_TYPES),
+        },
+    )
+
+
+def get_affected_uids(uids: set[str]) -> set[str]:
+    """Get the uids of the given nodes, plus every node whose list row or item view
+    may change with them: direct neighbours, the other side of any inline-only
+    node, and the nodes merged with any of these (whose item views include them)."""
+    q = """
+    MATCH (a:ProsNode) WHERE a.uid IN $uids
+    CALL {
+        WITH a
+        OPTIONAL MATCH (a)-[]-(b:ProsNode)
+        OPTIONAL MATCH (b:ProsInlineOnlyNode)-[]-(c:ProsNode)
+        RETURN COLLECT(b.uid) + COLLECT(c.uid) AS neighbour_uids,
+            COLLECT(DISTINCT b.merge_cluster) + COLLECT(DISTINCT c.merge_cluster)
+                AS neighbour_clusters
+    }
+    CALL {
+        WITH a, neighbour_clusters
+        UNWIND neighbour_clusters + [a.merge_cluster] AS cluster
+        OPTIONAL MATCH (m:ProsNode {merge_cluster: cluster})
+        RETURN COLLECT(m.uid) AS merged_uids
+    }
+    RETURN neighbour_uids + merged_uids
+    """
+    results, meta = db.cypher_query(q, {"uids": list(uids)})
+    return set(uids) | {uid for row in results for uid in row[0]}
+
+
+def notify_entities_changed(uids: set[str]):
+    """Send `entities_changed` for these uids once the current transaction commits"""
+    uids = frozenset(uids)
+    db.on_commit(lambda: entities_changed.send_robust(sender=ProsNode, uids=uids))
+
+
+def record_entity_changes(
+    changes: dict[str, str],
+    affected_uids: set[str],
+    types: dict[str, list[str]] | None = None,
+):
+    """Record the changes (and a `touch` of the other affected entities) in the
+    change log, and notify listeners once the transaction commits"""
+    change_log.record_changes(
+        {**{uid: change_log.TOUCH for uid in affected_uids}, **changes}, types
+    )
+    notify_entities_changed(affected_uids | set(changes))
+
+
+def get_version_validators(version_key: str) -> tuple[str, datetime.datetime | None]:
+    """ETag and Last-Modified time of the current version of a type or entity"""
+    seq, changed_when = change_log.get_version(version_key)
+    return build_etag(version_key, seq), changed_when
+
+
+def list_version_headers(version_key: str, list_version: ListVersion) -> dict:
+    """Validators of a list body, from the version its rows reflect (which may be
+    older than the current version of the type, but never newer)"""
+    return conditional_headers(
+        build_etag(version_key, list_version.version), list_version.changed_when
     )
-    q.DETACH.DELETE(__.o)
-    results, meta = db.cypher_query(str(q), q.bound_params)
 
 
 def prepare_data_value(properties, k, v):
@@ -96,387 +228,347 @@ def get_property_and_relation_data(data, model_class):
     return property_data, relation_data, inline_relations
 
 
-def add_related_nodes(
-    model_class: Type[ProsNode], instance: ProsNode, relation_data: dict
-):
-    for related_name, related in relation_data.items():
-        related_values = [r for r in related]
-        rel_manager = getattr(instance, related_name)
-        related_model = PROS_MODELS[
-            PROS_MODELS[model_class.__name__.lower()]
-            .fields[related_name]["relation_to"]
-            .lower()
-        ].model
-        for related_value in related_values:
-            rel_manager.connect(
-                related_model.nodes.get(uid=related_value["uid"]),
-                related_value.get("relData") or {},
-            )
+def get_inline_node_data(inline_relation_data: dict) -> dict:
+    """Model class, property data and relation data of the inline node of each
+    inline relation field"""
+    inline_nodes = {}
+    for inline_field_name, inline_field_data in inline_relation_data.items():
+        inline_field_data = dict(inline_field_data)
+        inline_model = PROS_MODELS[inline_field_data.pop("type")].model
+        property_data, relation_data, _ = get_property_and_relation_data(
+            inline_field_data, inline_model
+        )
+        inline_nodes[inline_field_name] = (inline_model, property_data, relation_data)
+    return inline_nodes
 
 
-def add_inline_related_nodes(
-    model_class: Type[ProsNode], instance: ProsNode, data: dict
-):
+def get_non_default_fields(node):
+    node_dict = node.__dict__
+    return {k: v for k, v in node_dict.items() if k not in ["uid", "real_type", "id"]}
 
-    for inline_field_name, inline_field_data in data.items():
-        inline_related_type = inline_field_data.pop("type")
-        inline_class = PROS_MODELS[inline_related_type]
-        related_model = inline_class.model
-        (
-            property_data,
-            relation_data,
-            inline_relation_data,
-        ) = get_property_and_relation_data(inline_field_data, related_model)
 
-        rel_manager = getattr(instance, inline_field_name)
+"""
+TODO: try conditionally adding so we don't end up with empty lists
 
-        new_related_node = related_model(**property_data)
-        new_related_node.save()
-        rel_manager.connect(new_related_node)
-        add_related_nodes(related_model, new_related_node, relation_data)
+WITH n, COLLECT(
+  CASE
+    WHEN ilist.container IS NULL THEN NULL
+    ELSE { container : ilist.container, target : target.id } END
+) AS iset
+"""
 
 
-def get_non_default_fields(node):
-    node_dict = node.__dict__
-    return {k: v for k, v in node_dict.items() if k not in ["uid", "real_type", "id"]}
+def query_list_rows(
+    model_class,
+    after: tuple[str, str] | None = None,
+    limit: int | None = None,
+    uids: list[str] | None = None,
+) -> list[dict]:
+    """Get list of items of a type, grouping together merged entities
+    as different permutations, i.e. main person, with merged entities as separate field.
 
+    If `limit` is given, returns a single page of at most `limit` items ordered by
+    (label, uid), starting after the `after` (label, uid) keyset cursor. Only the nodes
+    on the page go through the merged/inbound subqueries.
 
-def update_related_nodes(
-    model_class: Type[ProsNode], instance: ProsNode, relation_data: dict
-):
-    for related_name, related in relation_data.items():
-        # (related_name)
-        related_values = [r for r in related]
-        rel_manager = getattr(instance, related_name)
-        related_model = PROS_MODELS[
-            PROS_MODELS[model_class.__name__.lower()]
-            .fields[related_name]["relation_to"]
-            .lower()
-        ].model
-
-        # TODO: When changing any kind of links to things, also bump the
-        # modifiedWhen date...
-
-        # TODO: reconsider whether we need an "internal" modifiedWhen
-        # to distinguish it from useful changes made by someone to the model
-        # in question... (may be of use for versioning...?)
-
-        # If it's a cardinality-One relation, can't simply disconnect all
-        # as it's not allowed... instead, get the old node from the rel_manager,
-        # look up the new node by uid, and then reconnect the rel_manager
-        if isinstance(rel_manager, neomodel.cardinality.One):
-            ic(related_name, "is one")
-            old_node = rel_manager.get()
-            new_node = related_model.nodes.get(uid=related_values[0]["uid"])
-            rel_manager.reconnect(old_node, new_node)
-
-        # If it's a OneOrMore cardinality relation, also cannot disconnect
-        # everything; here we need to find out whether a relation already exists,
-        # in which case, use rel_manager.replace (otherwise it creates new)
-        # or create new connection if so. Then, clean up all the no-longer
-        # desired connections.
-        elif isinstance(rel_manager, neomodel.cardinality.OneOrMore):
-            ic(related_name, "is oneonemore")
-            for related_value in related_values:
-                ic(">>", related_value)
-                if already_connected_node := rel_manager.get_or_none(
-                    uid=related_value["uid"]
-                ):
-                    ic("already exists")
-                    ic(related_value.get("relData"))
-                    rel_manager.replace(
-                        already_connected_node,
-                        related_value.get("relData") or {"something": "arse"},
-                    )
-                    # ic(rel_manager.relationship(already_connected_node))
+    If `uids` is given, returns only the rows for those uids (used to patch list projections).
 
-                else:
-                    rel_manager.connect(
-                        related_model.nodes.get(uid=related_value["uid"]),
-                        related_value.get("relData") or {},
-                    )
+    The queries are compiled for each model at startup (see pros_core.queries).
+    """
+    list_queries = PROS_MODELS[model_class.__name__.lower()].list_queries
+    if uids is not None:
+        q = list_queries[LIST_QUERY_UIDS]
+    elif limit is not None:
+        q = list_queries[LIST_QUERY_PAGE]
+    else:
+        q = list_queries[LIST_QUERY_ALL]
 
-            updated_uids = {rv["uid"] for rv in related_values}
+    after_label, after_uid = after or (None, None)
+    results, meta = db.cypher_query(
+        q,
+        {
+            "after_label": after_label,
+            "after_uid": after_uid,
+            "limit": limit,
+            "uids": uids,
+        },
+    )
 
-            for node in rel_manager.all():
+    return list(itertools.chain.from_iterable(results))
 
-                if node.uid not in updated_uids:
 
-                    rel_manager.disconnect(node)
-        # TODO: this might not be as quick as comparing lists
-        # of relations and making fewer changes... (unlikely list will
-        # change dramatically...)
-        else:
-            # Remove all relations
-            rel_manager.disconnect_all()
-
-            # And recreate them again so that the data is updated
-            for related_value in related_values:
-                rel_manager.connect(
-                    related_model.nodes.get(uid=related_value["uid"]),
-                    related_value.get("relData") or {},
-                )
+LIST_PROJECTIONS = ListProjectionRegistry(
+    query_list_rows, getattr(settings, "PROS_LIST_VERSION_CHECK_INTERVAL", 1.0)
+)
 
 
-def update_inline_related_nodes(instance, data, username=None):
-    for inline_related_name, inline_field_data in data.items():
+@receiver(entities_changed)
+def expire_list_projections(sender, uids, **kwargs):
+    LIST_PROJECTIONS.expire()
 
-        rel_manager = getattr(instance, inline_related_name)
-        related_model = PROS_MODELS[inline_field_data["type"]].model
 
-        new_type = inline_field_data.pop("type")
+def uses_list_projection(model_class) -> bool:
+    return (
+        PROS_MODELS[model_class.__name__.lower()].meta.get("use_list_projection", True)
+        is not False
+    )
 
-        (
-            property_data,
-            relation_data,
-            inline_relation_data,
-        ) = get_property_and_relation_data(inline_field_data, related_model)
-        try:
 
-            # Get old node
-            old_related_node: ProsNode = rel_manager.all()[0]
+def get_list(model_class) -> tuple[Iterator[dict], ListVersion]:
+    """Get full list of items of a type (unpaginated compatibility mode), and the
+    version of the list it reflects"""
+    if uses_list_projection(model_class):
+        rows, list_version = LIST_PROJECTIONS.get(model_class).all()
+    else:
+        list_version = read_list_version(model_class.__name__)
+        rows = query_list_rows(model_class)
+    if build_label := getattr(model_class.Meta, "build_label", None):
+        return map(build_label, rows), list_version
+    else:
+        return iter(rows), list_version
 
-            # Check whether it's inline-only
-            old_field_inline_only = isinstance(old_related_node, ProsInlineOnlyNode)
 
-            # If it's not inline-only, we should update the modified info
-            if not old_field_inline_only:
-                property_data.pop("createdWhen")
-                property_data.pop("createdBy")
-                property_data = {
-                    **property_data,
-                    "modifiedBy": username,
-                    "modifiedWhen": datetime.datetime.now(datetime.timezone.utc),
-                }
+def stream_list_rows(model_class):
+    """Full list of items of a type as a generator, pulling rows from the database
+    in batches as it is consumed"""
+    rows = (
+        row
+        for row, in db.stream_query(
+            PROS_MODELS[model_class.__name__.lower()].list_queries[LIST_QUERY_ALL]
+        )
+    )
+    if build_label := getattr(model_class.Meta, "build_label", None):
+        return map(build_label, rows)
+    return rows
+
+
+# Precompressed full-list snapshots, if a directory is configured for them. Built
+# from the database rather than the list projection, so that their rows are read
+# after (and so are at least as new as) the version they are written under
+if snapshot_dir := getattr(settings, "PROS_SNAPSHOT_DIR", None):
+    LIST_SNAPSHOTS = SnapshotStore(snapshot_dir, stream_list_rows)
+    LIST_SNAPSHOTS.register(
+        model.model
+        for model in PROS_MODELS.values()
+        if not model.meta.get("inline_only")
+    )
+else:
+    LIST_SNAPSHOTS = None
 
-            # NEW STRATEGY...
 
-            # if type is the same, don't replace Inline Node, just update props and relations
-            if old_related_node.real_type == new_type:
-                for prop_key, prop_value in property_data.items():
-                    setattr(old_related_node, prop_key, prop_value)
-                    update_related_nodes(related_model, old_related_node, relation_data)
-                old_related_node.save()
+@receiver(entities_changed)
+def rebuild_list_snapshots(sender, uids, **kwargs):
+    if LIST_SNAPSHOTS:
+        LIST_SNAPSHOTS.schedule_rebuild()
 
-            else:
-                new_related_node = related_model(**property_data)
-                new_related_node.save()
-                rel_manager.reconnect(old_related_node, new_related_node)
-                add_related_nodes(related_model, new_related_node, relation_data)
-
-                if old_field_inline_only:
-                    old_related_node.delete()
-
-            # create new Inline Node with properties
-
-            # add relations to new Inline Node
-
-            # if the old Inline Node is inline-only
-            # delete
-            # else:
-            # leave it there??
-
-            # If there is already a node related here...
-
-            ## We need to remove the old node, because it could have changed type...
-            '''
-            old_related_node: ProsNode = rel_manager.all()[0]  # Get it...
-            # (there should only be one node to get, due to One cardinality)
-
-            # Create a new node with the data
-            new_related_node = related_model(**property_data)
-            new_related_node.save()
-
-            # Reconnect from the old node to the new node
-            rel_manager.reconnect(old_related_node, new_related_node)
-
-            # CHANGE: No need to delete connections: just delete the node
-            # if it is no longer referenced by anything else
-            """
-            for k, v in relation_data.items():
-                old_node_rel_manager = getattr(old_related_node, k)
-                for i in v:
-                    i_related_model = PROS_MODELS[i["real_type"]].model
-                    i_node = i_related_model.nodes.get(uid=i["uid"])
-                    old_node_rel_manager.disconnect(i_node)
-            """
-
-            # Add the relation to the new node
-            add_related_nodes(related_model, new_related_node, relation_data)
-
-            # If the old node is not related to anything else
-            # delete it
-
-            ic(old_related_node.Meta.__dict__)
-
-            if not getattr(old_related_node.Meta, "inline_only"):
-                ic("deleting old node", old_related_node)
-
-                old_related_node.delete()
-            '''
-        except IndexError:
-            # Otherwise, this node does not exist
-            new_related_node = related_model(**property_data)
-            new_related_node.save()
-            rel_manager.connect(new_related_node)
-            add_related_nodes(related_model, new_related_node, relation_data)
-
-
-def build_select_value_string(select_values, unpack_values):
-    select_value_string = "{"
-    select_value_string += ", ".join(f".{v}" for v in select_values)
-    if unpack_values:
-        select_value_string += ","
-        select_value_string += ", ".join(f"{k}: {k}" for k in unpack_values if k != "_")
-    select_value_string += "}"
-    return select_value_string
-
-
-def build_nested_call(fields, current_node="a", key=None, n=0):
-
-    # ic(select_values_string)
-    res = ""
-    if isinstance(fields, set):
-        return res
-    for k1, v1 in fields.items():
-
-        select_values = {}
-        if not isinstance(v1, set):
-            select_values = v1.get("_")
-        if isinstance(v1, set):
-            select_values = v1
-        if k1 == "_":
-            pass
-        if k1 != "_":
-            res += f"""
-CALL {{
-WITH {current_node}
-OPTIONAL MATCH ({current_node})-[r_{k1}]-(o_{k1})
-WHERE type(r_{k1}) = '{k1.upper()}' OR r_{k1}.reverse_name = '{k1.upper()}'
-"""
 
-            res += build_nested_call(v1, current_node=f"o_{k1}", key=k1, n=n + 1)
-            if not isinstance(v1, set):
-                res += f"RETURN COLLECT(o_{k1}{build_select_value_string(select_values, v1)}) AS {k1} }}"
-            else:
-                res += f"RETURN o_{k1}{build_select_value_string(select_values, {})} AS {k1} }}"
-    return res
+ITEM_CACHE = ItemCache(getattr(settings, "PROS_ITEM_CACHE_SIZE", 1000))
 
 
-"""
-TODO: try conditionally adding so we don't end up with empty lists
+@receiver(entities_changed)
+def invalidate_item_cache(sender, uids, **kwargs):
+    ITEM_CACHE.invalidate(uids)
 
-WITH n, COLLECT(
-  CASE
-    WHEN ilist.container IS NULL THEN NULL
-    ELSE { container : ilist.container, target : target.id } END
-) AS iset
-"""
 
+@receiver(entities_changed)
+def refresh_label_index(sender, uids, **kwargs):
+    LABEL_INDEX.refresh(uids)
 
-def get_list(model_class):
-    """Get list of items of a type, grouping together merged entities
-    as different permutations, i.e. main person, with merged entities as separate field.
 
-    n.b. entity_type should come from the BACKEND, so safe to interpolate it!
-    """
-    entity_type = model_class.__name__
-    unpack_fields = getattr(model_class.Meta, "unpack_fields", None)
-    ic(entity_type)
-    ic(unpack_fields)
-    if unpack_fields:
-        unpack_calls = build_nested_call(unpack_fields)
+def parse_fields_param(value: str | None, default: list[str] | None = None):
+    """Comma-separated field names; `*` for all fields (None)"""
+    if value is None:
+        return default
+    if value.strip() == "*":
+        return None
+    return [f.strip() for f in value.split(",") if f.strip()]
+
+
+def get_items_batch(uids: list[str]) -> dict:
+    """Items of many uids in one go, served from the item cache where current,
+    keyed by uid, with the uids that were not found"""
+    version_keys = {uid: change_log.uid_version_key(uid) for uid in uids}
+    versions = change_log.get_versions(list(version_keys.values()))
+
+    items = {}
+    for uid in uids:
+        if (item := ITEM_CACHE.get(uid, versions[version_keys[uid]])) is not None:
+            items[uid] = item
+
+    fetched, missing = get_items([uid for uid in uids if uid not in items])
+    for uid, item in fetched.items():
+        ITEM_CACHE.put(uid, versions[version_keys[uid]], item)
+    return {"items": {**items, **fetched}, "missing": missing}
+
+
+def stream_bulk_lists(model_classes: list) -> Iterator[dict]:
+    """Full lists of several types, fetched concurrently, as one
+    {"type", "seq", "rows"} item per type in order of completion.
+
+    Each list comes with the change sequence number it reflects, so clients can
+    sync it from there with `since_seq`."""
+    if not model_classes:
+        return
+
+    def fetch(model_class):
+        rows, list_version = get_list(model_class)
+        return list(rows), list_version
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(BULK_LIST_WORKERS, len(model_classes))
+    ) as executor:
+        futures = {
+            executor.submit(fetch, model_class): model_class
+            for model_class in model_classes
+        }
+        for future in concurrent.futures.as_completed(futures):
+            rows, list_version = future.result()
+            yield {
+                "type": futures[future].__name__.lower(),
+                "seq": list_version.seq,
+                "rows": rows,
+            }
+
+
+def encode_list_cursor(label: str | None, uid: str) -> str:
+    return (
+        base64.urlsafe_b64encode(json.dumps([label or "", uid]).encode())
+        .decode()
+        .rstrip("=")
+    )
+
+
+def decode_list_cursor(cursor: str) -> tuple[str, str]:
+    """Decode an opaque `after` cursor into (label, uid); raises ValueError if invalid"""
+    try:
+        label, uid = json.loads(
+            base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        )
+    except Exception as e:
+        raise ValueError(f"Invalid list cursor '{cursor}'") from e
+    if not isinstance(label, str) or not isinstance(uid, str):
+        raise ValueError(f"Invalid list cursor '{cursor}'")
+    return label, uid
+
+
+def get_list_page(
+    model_class, after: tuple[str, str] | None = None, limit: int = LIST_PAGE_SIZE
+) -> tuple[dict, ListVersion]:
+    """Get one keyset-paginated page of items of a type, with the cursor
+    for the next page (or None if this is the last page), and the version of the
+    list it reflects"""
+
+    if uses_list_projection(model_class):
+        rows, has_next, list_version = LIST_PROJECTIONS.get(model_class).page(
+            after, limit
+        )
     else:
-        unpack_calls = ""
+        list_version = read_list_version(model_class.__name__)
+        # Fetch one extra row to find out whether there is a next page
+        rows = query_list_rows(model_class, after=after, limit=limit + 1)
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+
+    next_cursor = None
+    if has_next:
+        next_cursor = encode_list_cursor(rows[-1].get("label"), rows[-1]["uid"])
+
+    if build_label := getattr(model_class.Meta, "build_label", None):
+        rows = [build_label(row) for row in rows]
+
+    return {"results": rows, "next": next_cursor}, list_version
+
+
+LUCENE_SPECIAL_CHARACTERS = re.compile(r'([+\-&|!(){}\[\]^"~*?:\\/])')
+
+
+def build_fulltext_query(text_filter: str) -> str:
+    """Build a Lucene query matching labels containing words starting with
+    each of the words of the filter"""
+    terms = [
+        LUCENE_SPECIAL_CHARACTERS.sub(r"\\\1", term)
+        for term in text_filter.lower().split()
+    ]
+    return " AND ".join(f"{term}*" for term in terms)
+
+
+def get_filter_list(entity_type: str, text_filter: str, limit: int = LIST_FILTER_LIMIT):
+    """Get the best-matching items of a type for a text filter, ranked by full-text score,
+    using the per-model label full-text index (see pros_core.indexes).
+
+    A match on a merged node also returns the other nodes of the type in its merge cluster.
+    """
+    search = build_fulltext_query(text_filter)
+    if not search:
+        return iter([])
 
     q = f"""
-    
-    
-    MATCH (a:{entity_type})
+    CALL db.index.fulltext.queryNodes($index_name, $search, {{limit: $limit}})
+    YIELD node, score
     CALL {{
-        WITH a
-        MATCH path = (a)-[:MERGED*]-(b)
-        CALL {{
-                    WITH b
-                    WITH b
-                    MATCH (b)<-[in_r]-(x)
-                    WHERE NOT in_r:MERGED 
-                    RETURN COUNT(b) > 0  as has_inbound_b
-                }}
-                WITH b, b.is_deleted AND has_inbound_b AS ddn
-        RETURN COLLECT(b{{.label, .uid, .real_type, .is_deleted, deleted_and_has_dependent_nodes:ddn}}) AS cb
+        WITH node
+        OPTIONAL MATCH (m:{entity_type} {{merge_cluster: node.merge_cluster}})
+        RETURN COLLECT(m) + [node] AS matched
     }}
+    UNWIND matched AS a
+    WITH a, max(score) AS score
+    ORDER BY score DESC, a.label
+    LIMIT $limit
     CALL {{
-                WITH a
-                WITH a
-                MATCH (a)<-[in_r]-(x)
-                WHERE NOT in_r:MERGED 
-                RETURN COUNT(a) > 0  as has_inbound_a
+        WITH a
+        MATCH (b:ProsNode {{merge_cluster: a.merge_cluster}})
+        WHERE b <> a
+        WITH b, b.is_deleted AND coalesce(b.inbound_count, 0) > 0 AS ddn
+        RETURN COLLECT(b{{.label, .uid, .real_type, .is_deleted, deleted_and_has_dependent_nodes:ddn}}) AS cb
     }}
-    {unpack_calls}
-
-    WITH DISTINCT(a) AS da, a.is_deleted AND has_inbound_a AS ddn, cb <> [] as is_merged_item,  cb {", "+", ".join(unpack_fields) if unpack_fields else ""}
-  
-
-    RETURN apoc.map.clean(da{{.label, .uid, .real_type, .is_deleted, is_merged_item:is_merged_item, is_merged_item:is_merged_item, merged_items:cb {", "+", ".join(f'''{f}: {f}''' for f in unpack_fields) if unpack_fields else ""}}}, [], [[], {{}}, [{{}}], null]) AS results
-    ORDER BY da.label
-
-
+    WITH a, score, a.is_deleted AND coalesce(a.inbound_count, 0) > 0 AS ddn, cb
+    RETURN a{{.uid, .label, .real_type, .is_deleted, is_merged_item: cb <> [], deleted_and_has_dependent_nodes: ddn, merged_items: cb}} AS results
+    ORDER BY score DESC, a.label
     """
-    results, meta = db.cypher_query(q)
+    try:
+        results, meta = db.cypher_query(
+            q,
+            {
+                "index_name": fulltext_index_name(entity_type),
+                "search": search,
+                "limit": limit,
+            },
+        )
+    except ClientError as e:
+        # Full-text index not (yet) installed: fall back to scanning labels
+        if e.code != "Neo.ClientError.Procedure.ProcedureCallFailed":
+            raise
+        return itertools.islice(get_contains_filter_list(entity_type, text_filter), limit)
 
-    if build_label := getattr(model_class.Meta, "build_label", None):
-        return map(build_label, itertools.chain.from_iterable(results))
-    else:
-        return itertools.chain.from_iterable(results)
+    return itertools.chain.from_iterable(results)
 
 
-def get_filter_list(entity_type: str, text_filter: str):
-    ic(text_filter)
+def get_contains_filter_list(entity_type: str, text_filter: str):
     q = f"""
         CALL {{
         MATCH (a:{entity_type})
         WITH a, toLower(a.label) CONTAINS toLower($text_filter) AS a_matches
         CALL {{
             WITH a, a_matches
-            MATCH path = (a)-[:MERGED*]-(other)
-            WHERE a_matches OR toLower(other.label) CONTAINS toLower($text_filter)
+            MATCH (other:ProsNode {{merge_cluster: a.merge_cluster}})
+            WHERE other <> a AND (a_matches OR toLower(other.label) CONTAINS toLower($text_filter))
             RETURN other as b
         }}
-        MATCH (a)-[:MERGED*]-(b)
         CALL {{
             WITH a
-            MATCH (a)-[:MERGED*]-(b)
-            CALL {{
-                WITH b
-                WITH b
-                MATCH (b)<-[in_r]-(x)
-                WHERE NOT in_r:MERGED 
-                RETURN COUNT(b) > 0  as has_inbound_b
-            }}
-            WITH b, b.is_deleted AND has_inbound_b AS ddn
+            MATCH (b:ProsNode {{merge_cluster: a.merge_cluster}})
+            WHERE b <> a
+            WITH b, b.is_deleted AND coalesce(b.inbound_count, 0) > 0 AS ddn
             RETURN COLLECT(b{{.label, .uid, .real_type, .is_deleted, deleted_and_has_dependent_nodes:ddn}}) as cb
         }}
-        CALL {{
-                WITH a
-                WITH a
-                MATCH (a)<-[in_r]-(x)
-                WHERE NOT in_r:MERGED 
-                RETURN COUNT(a) > 0  as has_inbound_a
-            }}
-        WITH DISTINCT(a) AS da, a.is_deleted AND has_inbound_a AS ddn, cb
+        WITH DISTINCT(a) AS da, a.is_deleted AND coalesce(a.inbound_count, 0) > 0 AS ddn, cb
         RETURN da{{.uid, .label, .real_type, .is_deleted, is_merged_item:true, deleted_and_has_dependent_nodes: ddn, merged_items: cb}} AS results
 
         UNION
 
         MATCH (a:{entity_type})
-        WHERE toLower(a.label) CONTAINS toLower($text_filter) AND NOT (a)-[:MERGED]-()
-        CALL {{
-                MATCH (a)<-[in_r]-(x)
-                WHERE NOT in_r:MERGED 
-                RETURN COUNT(a) > 0  as has_inbound_a
-            }}
-        WITH a as da, a.is_deleted AND has_inbound_a AS ddn
+        WHERE toLower(a.label) CONTAINS toLower($text_filter) AND a.merge_cluster IS NULL
+        WITH a as da, a.is_deleted AND coalesce(a.inbound_count, 0) > 0 AS ddn
         return da{{.uid, .label, .real_type, .is_deleted, is_merged_item:false, deleted_and_has_dependent_nodes:ddn, merged_items:[]}} AS results
         }}
         WITH results
@@ -502,44 +594,25 @@ def get_created_modified_list(entity_type: str, timestamp: datetime.datetime):
             WITH a, a.modifiedWhen > datetime($timestamp) AS a_matches
             CALL {{
                 WITH a, a_matches
-                MATCH path = (a)-[:MERGED*]-(other)
-                WHERE a_matches OR other.modifiedWhen > datetime($timestamp)
+                MATCH (other:ProsNode {{merge_cluster: a.merge_cluster}})
+                WHERE other <> a AND (a_matches OR other.modifiedWhen > datetime($timestamp))
                 RETURN other as b
             }}
-            MATCH (a)-[:MERGED*]-(b)
             CALL {{
                 WITH a
-                MATCH (a)-[:MERGED*]-(b)
-                CALL {{
-                    WITH b
-                    WITH b
-                    MATCH (b)<-[in_r]-(x)
-                    WHERE NOT in_r:MERGED 
-                    RETURN COUNT(b) > 0  as has_inbound_b
-                }}
-                WITH b, b.is_deleted AND has_inbound_b AS ddn
+                MATCH (b:ProsNode {{merge_cluster: a.merge_cluster}})
+                WHERE b <> a
+                WITH b, b.is_deleted AND coalesce(b.inbound_count, 0) > 0 AS ddn
                 RETURN COLLECT(b{{.label, .uid, .real_type, .is_deleted, deleted_and_has_dependent_nodes:ddn}}) as cb
             }}
-            CALL {{
-                    WITH a
-                    WITH a
-                    MATCH (a)<-[in_r]-(x)
-                    WHERE NOT in_r:MERGED 
-                    RETURN COUNT(a) > 0  as has_inbound_a
-                }}
-            WITH DISTINCT(a) AS da, a.is_deleted AND has_inbound_a AS ddn, cb
+            WITH DISTINCT(a) AS da, a.is_deleted AND coalesce(a.inbound_count, 0) > 0 AS ddn, cb
             RETURN da{{.uid, .label, .real_type, .is_deleted, is_merged_item:true, deleted_and_has_dependent_nodes: ddn, merged_items: cb}} AS results
 
             UNION
 
             MATCH (a:{entity_type})
-            WHERE a.modifiedWhen > datetime($timestamp) AND NOT (a)-[:MERGED]-()
-            CALL {{
-                    MATCH (a)<-[in_r]-(x)
-                    WHERE NOT in_r:MERGED 
-                    RETURN COUNT(a) > 0  as has_inbound_a
-                }}
-            WITH a as da, a.is_deleted AND has_inbound_a AS ddn
+            WHERE a.modifiedWhen > datetime($timestamp) AND a.merge_cluster IS NULL
+            WITH a as da, a.is_deleted AND coalesce(a.inbound_count, 0) > 0 AS ddn
             RETURN da{{.uid, .label, .real_type, .is_deleted, is_merged_item:false, deleted_and_has_dependent_nodes:ddn, merged_items:[]}} AS results
         }}
         WITH results
@@ -551,6 +624,23 @@ def get_created_modified_list(entity_type: str, timestamp: datetime.datetime):
     return itertools.chain.from_iterable(results)
 
 
+def get_changes_since(model_class, since_seq: int) -> dict:
+    """List rows of entities of a type changed since the sequence number, the uids
+    of those deleted, and the latest sequence number"""
+    latest_seq, changes = change_log.get_changes_since(model_class.__name__, since_seq)
+    deleted = [uid for uid, op in changes.items() if op == change_log.DELETE]
+    changed = [uid for uid, op in changes.items() if op != change_log.DELETE]
+
+    created_modified = query_list_rows(model_class, uids=changed) if changed else []
+    if build_label := getattr(model_class.Meta, "build_label", None):
+        created_modified = [build_label(row) for row in created_modified]
+    return {
+        "created_modified": created_modified,
+        "deleted": [{"uid": uid} for uid in deleted],
+        "seq": latest_seq,
+    }
+
+
 def get_deleted_items_from_type_and_timestamp(entity_name, timestamp):
     q = """MATCH (n:DeletedNode) 
     WHERE n.deletedWhen > datetime($timestamp) AND $entity_name IN n.type
@@ -562,191 +652,6 @@ def get_deleted_items_from_type_and_timestamp(entity_name, timestamp):
     return itertools.chain.from_iterable(results)
 
 
-def get_item(model_class: str, uid: str):
-    q = """MATCH (main { uid:$uid })
-
-// START OF QUERY ON SINGLE MATCHED NODE
-CALL {
-// Direct incoming
-  WITH main
-  CALL {
-    WITH main
-    OPTIONAL MATCH (main)<-[incoming_relation]-(incoming_node)
-    WHERE incoming_relation.inline is null AND NOT incoming_relation:MERGED
-    CALL {
-      WITH incoming_node
-      MATCH (incoming_node)<-[in_r]-(x)
-      WHERE NOT in_r:MERGED
-      RETURN COUNT(incoming_node) > 0 AS has_inbound_incoming_node
-    }
-    WITH apoc.map.setValues(incoming_node, ["relData", incoming_relation, "rel_type", toLower(incoming_relation.reverse_name), "deleted_and_has_dependent_nodes", has_inbound_incoming_node AND incoming_node.is_deleted]) AS mod_incoming_node
-    RETURN apoc.map.groupByMulti(COLLECT(mod_incoming_node), "rel_type") AS incoming_relations
-  }
-  
-// Outgoing direct
-  CALL {
-    WITH main
-    OPTIONAL MATCH (main)-[outgoing_relation]->(outgoing_node)
-    WHERE outgoing_relation.inline is null AND NOT outgoing_relation:MERGED
-    CALL {
-      WITH outgoing_node
-      MATCH (outgoing_node)<-[in_r]-(x)
-      WHERE NOT in_r:MERGED
-      RETURN COUNT(outgoing_node) > 0 AS has_inbound_outgoing_node
-    }
-    WITH apoc.map.setValues(outgoing_node, ["relData", outgoing_relation, "rel_type", toLower(type(outgoing_relation)), "deleted_and_has_dependent_nodes", has_inbound_outgoing_node AND outgoing_node.is_deleted]) AS mod_outgoing_node
-    RETURN apoc.map.groupByMulti(COLLECT(mod_outgoing_node), "rel_type") AS outgoing_relations
-  }
-  
-// Incoming inline...
-  CALL {
-    WITH main
-    OPTIONAL MATCH (main)<-[incoming_relation]-(incoming_node)<-[passthrough_rel]-(passthrough_node)
-    WHERE main.uid <> passthrough_node.uid AND NOT incoming_relation:MERGED AND passthrough_rel.inline
-    CALL {
-      WITH passthrough_node
-      MATCH (passthrough_node)<-[in_r]-(x)
-      WHERE NOT in_r:MERGED
-      RETURN COUNT(passthrough_node) > 0 AS has_inbound_passthrough_node
-    }
-    WITH incoming_relation, incoming_node, passthrough_rel, apoc.map.setValues(passthrough_node, ["rel_type", toLower(incoming_relation.reverse_name), "deleted_and_has_dependent_nodes", has_inbound_passthrough_node AND passthrough_node.is_deleted]) AS ptn
-    RETURN apoc.map.groupByMulti(COLLECT(ptn), "rel_type") AS incoming_inline
-    
-  }
-// Inlines...
-  CALL {
-    WITH main
-    OPTIONAL MATCH (main)-[inline_relation]->(inline_node)
-    WHERE main.uid <> inline_node.uid AND inline_relation.inline
-    CALL {
-      WITH inline_node
-      OPTIONAL MATCH (inline_node)-[related_rel]->(related_node)
-      WHERE NOT related_rel:MERGED
-      CALL {
-        WITH related_node
-        MATCH (related_node)<-[in_r]-(x)
-        WHERE NOT in_r:MERGED
-        RETURN COUNT(related_node) > 0 AS has_inbound_related_node
-      }
-      WITH apoc.map.setValues(related_node, ["rel_type", toLower(type(related_rel)), "deleted_and_has_dependent_nodes", has_inbound_related_node AND related_node.is_deleted]) AS mod_related_node, related_rel
-      RETURN related_rel, apoc.map.groupByMulti(COLLECT(mod_related_node), "rel_type") AS grouped_mod_related_node // NOW, just need to add in related node to inline_node..., grouping by type!!
-    }
-    
-    WITH apoc.map.setValues(inline_node, ["type", inline_node.real_type]) AS mod_inline_node,
-    inline_relation, inline_node, related_rel, grouped_mod_related_node
-    RETURN apoc.map.mergeList([mod_inline_node, grouped_mod_related_node]) AS inlines, inline_relation, inline_node, related_rel, grouped_mod_related_node
-  }
-  CALL {
-    MATCH (main)<-[in_r]-(x)
-    WHERE NOT in_r:MERGED
-    RETURN COUNT(main) > 0 AS has_inbound_main
-  }
-  WITH apoc.map.setValues(main, [toLower(type(inline_relation)), inlines, "deleted_and_has_dependent_nodes", has_inbound_main AND main.is_deleted]) AS main_node, inlines, outgoing_relations, incoming_inline, incoming_relations
-  RETURN apoc.map.mergeList(COLLECT(apoc.map.mergeList([main_node, outgoing_relations, incoming_relations, incoming_inline]))) AS main_node
-}
-
-CALL {
-  WITH main
-  OPTIONAL MATCH (main)-[:MERGED*]-(mn)
-  
-// START OF LOOKUPS FOR MERGED NODES
-  
-// START OF QUERY ON SINGLE MATCHED NODE
-  CALL {
-// Direct incoming
-    WITH mn
-    CALL {
-      WITH mn
-      OPTIONAL MATCH (mn)<-[incoming_relation]-(incoming_node)
-      WHERE incoming_relation.inline is null AND NOT incoming_relation:MERGED
-      CALL {
-        WITH incoming_node
-        MATCH (incoming_node)<-[in_r]-(x)
-        WHERE NOT in_r:MERGED
-        RETURN COUNT(incoming_node) > 0 AS has_inbound_incoming_node
-      }
-      WITH apoc.map.setValues(incoming_node, ["rel_type", toLower(incoming_relation.reverse_name), "deleted_and_has_dependent_nodes", has_inbound_incoming_node AND incoming_node.is_deleted]) AS mod_incoming_node
-      RETURN apoc.map.groupByMulti(COLLECT(mod_incoming_node), "rel_type") AS incoming_relations
-    }
-    
-// Outgoing direct
-    CALL {
-      WITH mn
-      OPTIONAL MATCH (mn)-[outgoing_relation]->(outgoing_node)
-      WHERE outgoing_relation.inline is null AND NOT outgoing_relation:MERGED
-      CALL {
-        WITH outgoing_node
-        MATCH (outgoing_node)<-[in_r]-(x)
-        WHERE NOT in_r:MERGED
-        RETURN COUNT(outgoing_node) > 0 AS has_inbound_outgoing_node
-      }
-      WITH apoc.map.setValues(outgoing_node, ["rel_type", toLower(type(outgoing_relation)), "deleted_and_has_dependent_nodes", has_inbound_outgoing_node AND outgoing_node.is_deleted]) AS mod_outgoing_node
-      RETURN apoc.map.groupByMulti(COLLECT(mod_outgoing_node), "rel_type") AS outgoing_relations
-    }
-    
-// Incoming inline...
-    CALL {
-      WITH mn
-      OPTIONAL MATCH (mn)<-[incoming_relation]-(incoming_node)<-[passthrough_rel]-(passthrough_node)
-      WHERE mn.uid <> passthrough_node.uid AND NOT incoming_relation:MERGED AND passthrough_rel.inline
-      CALL {
-        WITH passthrough_node
-        MATCH (passthrough_node)<-[in_r]-(x)
-        WHERE NOT in_r:MERGED
-        RETURN COUNT(passthrough_node) > 0 AS has_inbound_passthrough_node
-      }
-      WITH incoming_relation, incoming_node, passthrough_rel, apoc.map.setValues(passthrough_node, ["rel_type", toLower(incoming_relation.reverse_name), "deleted_and_has_dependent_nodes", has_inbound_passthrough_node AND passthrough_node.is_deleted]) AS ptn
-      RETURN apoc.map.groupByMulti(COLLECT(ptn), "rel_type") AS incoming_inline
-      
-    }
-// Inlines...
-    CALL {
-      WITH mn
-      OPTIONAL MATCH (mn)-[inline_relation]->(inline_node)
-      WHERE mn.uid <> inline_node.uid AND inline_relation.inline
-      CALL {
-        WITH inline_node
-        OPTIONAL MATCH (inline_node)-[related_rel]->(related_node)
-        WHERE NOT related_rel:MERGED
-        CALL {
-          WITH related_node
-          MATCH (related_node)<-[in_r]-(x)
-          WHERE NOT in_r:MERGED
-          RETURN COUNT(related_node) > 0 AS has_inbound_related_node
-        }
-        WITH apoc.map.setValues(related_node, ["rel_type", toLower(type(related_rel)), "deleted_and_has_dependent_nodes", has_inbound_related_node AND related_node.is_deleted]) AS mod_related_node, related_rel
-        RETURN related_rel, apoc.map.groupByMulti(COLLECT(mod_related_node{ .uid, .real_type, .label, .is_deleted, .rel_type, .deleted_and_has_dependent_nodes }), "rel_type") AS grouped_mod_related_node // NOW, just need to add in related node to inline_node..., grouping by type!!
-      }
-      
-      WITH apoc.map.setValues(inline_node, ["type", inline_node.real_type]) AS mod_inline_node,
-      inline_relation, inline_node, related_rel, grouped_mod_related_node
-      RETURN apoc.map.mergeList([mod_inline_node, grouped_mod_related_node]) AS inlines, inline_relation, inline_node, related_rel, grouped_mod_related_node
-    }
-    CALL {
-      MATCH (mn)<-[in_r]-(x)
-      WHERE NOT in_r:MERGED
-      RETURN COUNT(mn) > 0 AS has_inbound_main
-    }
-    WITH apoc.map.setValues(mn, [toLower(type(inline_relation)), inlines, "deleted_and_has_dependent_nodes", has_inbound_main AND mn.is_deleted]) AS main_node, inlines, outgoing_relations, incoming_inline, incoming_relations
-    RETURN apoc.map.mergeList(COLLECT(apoc.map.mergeList([main_node, outgoing_relations, incoming_relations, incoming_inline]))) AS merged_main_node
-  }
-  RETURN DISTINCT (merged_main_node) AS merged_nodes
-}
-WITH main_node, merged_nodes.uid is NOT null AS is_merged_item, COLLECT(merged_nodes) AS mnlist
-
-WITH apoc.map.setValues(main_node, ["merged_items", mnlist, "is_merged_item", is_merged_item]) AS result, is_merged_item
-RETURN
-CASE is_merged_item WHEN true THEN result ELSE apoc.map.removeKey(result, "merged_items") END
-"""
-    results, meta = db.cypher_query(q, {"uid": uid})
-    try:
-        return results[0][0]
-    except IndexError:
-        raise model_class.DoesNotExist(
-            f"""<{model_class.__name__} uid={uid}> not found."""
-        )
-
-
 # Viewset methods
 class ProsBlankViewSet(ViewSet):
     pass
@@ -768,8 +673,14 @@ class ProsAbstractViewSet(ProsBlankViewSet):
         # If a text filter is set...
         filter = request.query_params.get("filter")
         if filter:
+            try:
+                limit = int(request.query_params.get("limit") or LIST_FILTER_LIMIT)
+            except ValueError as e:
+                return ResponseValue({"detail": str(e)}, status=400)
             node_data = get_filter_list(
-                self.__model_class__.__name__, text_filter=filter
+                self.__model_class__.__name__,
+                text_filter=filter,
+                limit=max(1, min(limit, LIST_PAGE_SIZE_MAX)),
             )
 
         # No filter assigned
@@ -778,8 +689,28 @@ class ProsAbstractViewSet(ProsBlankViewSet):
             last_refreshed_timestamp_string = request.query_params.get(
                 "lastRefreshedTimestamp"
             )
+            since_seq_string = request.query_params.get("since_seq")
+            # Get update from change sequence number
+            if since_seq_string:
+                try:
+                    since_seq = int(since_seq_string)
+                except ValueError as e:
+                    return ResponseValue({"detail": str(e)}, status=400)
+                latest_seq, pruned_seq = change_log.get_change_seq()
+                if since_seq < pruned_seq:
+                    return ResponseValue(
+                        {
+                            "detail": "Changes since this sequence number are no longer available",
+                            "seq": latest_seq,
+                        },
+                        status=410,
+                    )
+                return ResponseValue(
+                    get_changes_since(self.__model_class__, since_seq)
+                )
+
             # Get update from timestamp
-            if last_refreshed_timestamp_string:
+            elif last_refreshed_timestamp_string:
                 d = datetime.datetime.fromisoformat(
                     last_refreshed_timestamp_string.replace("Z", "")
                 )
@@ -798,37 +729,225 @@ class ProsAbstractViewSet(ProsBlankViewSet):
 
                 return ResponseValue(resp_data)
 
+            # Full and paged lists only change with a new version of the type
+            version_key = change_log.type_version_key(self.__model_class__.__name__)
+            etag, last_modified = get_version_validators(version_key)
+            if is_not_modified(request, etag, last_modified):
+                return ResponseValue(
+                    None, status=304, headers=conditional_headers(etag, last_modified)
+                )
+
+            # Return a single page if a cursor or limit is given
+            if "after" in request.query_params or "limit" in request.query_params:
+                try:
+                    after = request.query_params.get("after")
+                    after = decode_list_cursor(after) if after else None
+                    limit = int(request.query_params.get("limit") or LIST_PAGE_SIZE)
+                except ValueError as e:
+                    return ResponseValue({"detail": str(e)}, status=400)
+                if limit < 1:
+                    return ResponseValue(
+                        {"detail": "limit must be a positive integer"}, status=400
+                    )
+
+                page, list_version = get_list_page(
+                    self.__model_class__,
+                    after=after,
+                    limit=min(limit, LIST_PAGE_SIZE_MAX),
+                )
+                return ResponseValue(
+                    page, headers=list_version_headers(version_key, list_version)
+                )
+
             # Return list
             else:
-
-                node_data = get_list(self.__model_class__)
+                # The sequence number the rows reflect, so that clients syncing from
+                # it cannot miss changes
+                rows, list_version = get_list(self.__model_class__)
+                return ResponseValue(
+                    rows,
+                    headers={
+                        **list_version_headers(version_key, list_version),
+                        "X-Pros-Change-Seq": str(list_version.seq),
+                    },
+                )
         return ResponseValue(node_data)
 
     def list(self, request: Request) -> Response:
+        if stream_format := get_stream_format(request):
+            selection_params = list_selection_params(request)
+            if not selection_params:
+                return self.stream_list(request, stream_format)
+            # Only an explicit request to stream is an error: clients that merely
+            # accept NDJSON get the selected rows as usual
+            if "stream" in request.query_params:
+                return Response(
+                    {
+                        "detail": "Only full lists can be streamed, not with "
+                        + ", ".join(selection_params)
+                    },
+                    status=400,
+                )
+        if LIST_SNAPSHOTS and not request.query_params:
+            if response := self.snapshot_list(request):
+                return response
         return Response(**self.do_list(request))
 
+    def snapshot_list(self, request: Request):
+        """Full list served from its snapshot file, if there is one for the current
+        version of the type. Otherwise returns None, and schedules a rebuild."""
+        version_key = change_log.type_version_key(self.__model_class__.__name__)
+        seq, last_modified = change_log.get_version(version_key)
+        etag = build_etag(version_key, seq)
+        headers = conditional_headers(etag, last_modified)
+        if is_not_modified(request, etag, last_modified):
+            return Response(status=304, headers=headers)
+
+        encoding = accepted_encoding(request)
+        path = LIST_SNAPSHOTS.get(self.__model_class__, seq, encoding)
+        try:
+            f = open(path, "rb") if path else None
+        except FileNotFoundError:
+            # Replaced by a newer snapshot in the meantime
+            f = None
+        if f is None:
+            LIST_SNAPSHOTS.schedule_rebuild(reset=False)
+            return None
+
+        response = FileResponse(f, content_type="application/json")
+        if encoding != IDENTITY:
+            # Also stops GZipMiddleware from compressing the response again
+            response["Content-Encoding"] = encoding
+        response["Vary"] = "Accept-Encoding"
+        # A type's version is a valid sequence number to sync its list from
+        for header, value in {**headers, "X-Pros-Change-Seq": str(seq)}.items():
+            response[header] = value
+        return response
+
+    def stream_list(self, request: Request, stream_format: str):
+        """Full list streamed as NDJSON or as a JSON array, with the same validators
+        and change sequence number as the (unstreamed) full list"""
+        etag, last_modified = get_version_validators(
+            change_log.type_version_key(self.__model_class__.__name__)
+        )
+        headers = conditional_headers(etag, last_modified)
+        if is_not_modified(request, etag, last_modified):
+            return Response(status=304, headers=headers)
+
+        latest_seq, pruned_seq = change_log.get_change_seq()
+        response = StreamingHttpResponse(
+            STREAM_ENCODERS[stream_format](stream_list_rows(self.__model_class__)),
+            content_type=STREAM_CONTENT_TYPES[stream_format],
+        )
+        for header, value in {**headers, "X-Pros-Change-Seq": str(latest_seq)}.items():
+            response[header] = value
+        return response
+
+    def do_autocomplete(self, request: Request) -> ResponseValue:
+        try:
+            k = int(request.query_params.get("k") or AUTOCOMPLETE_LIMIT)
+        except ValueError as e:
+            return ResponseValue({"detail": str(e)}, status=400)
+
+        model_name = self.__model_class__.__name__
+        real_types = {model_name.lower()} | {
+            m.model_name.lower() for m in PROS_MODELS[model_name.lower()].subclasses_as_list
+        }
+        return ResponseValue(
+            LABEL_INDEX.search(
+                request.query_params.get("q", ""),
+                real_types=real_types,
+                k=max(1, min(k, AUTOCOMPLETE_LIMIT_MAX)),
+            )
+        )
+
+    def autocomplete(self, request: Request) -> Response:
+        return Response(**self.do_autocomplete(request))
+
 
 class ProsDefaultViewSet(ProsAbstractViewSet):
     """Default ViewSet for Pros models."""
 
     def do_retrieve(self, request: Request, pk: str | None) -> ResponseValue:
-        try:
-            return ResponseValue(get_item(self.__model_class__, pk))
-        except DoesNotExist as e:
-            return ResponseValue(e.message, 404)
+        version_key = change_log.uid_version_key(pk)
+        version, last_modified = change_log.get_version(version_key)
+        etag = build_etag(version_key, version)
+        headers = conditional_headers(etag, last_modified)
+        if is_not_modified(request, etag, last_modified):
+            return ResponseValue(None, status=304, headers=headers)
+
+        # Sparse fieldsets: `fields` for the item, `related_fields` for its neighbours
+        fields = parse_fields_param(request.query_params.get("fields"))
+        related_fields = parse_fields_param(
+            request.query_params.get("related_fields"), DEFAULT_RELATED_FIELDS
+        )
+        # Only the default projection is cached
+        cacheable = fields is None and related_fields is DEFAULT_RELATED_FIELDS
+
+        if not cacheable or (item := ITEM_CACHE.get(pk, version)) is None:
+            try:
+                item = get_item(
+                    self.__model_class__,
+                    pk,
+                    fields=fields,
+                    related_fields=related_fields,
+                )
+            except DoesNotExist as e:
+                return ResponseValue(e.message, 404)
+            if cacheable:
+                ITEM_CACHE.put(pk, version, item)
+        return ResponseValue(item, headers=headers)
 
     def retrieve(self, request: Request, pk: str | None = None) -> Response:
         return Response(**self.do_retrieve(request, pk))
 
-    @db.write_transaction
-    def do_create(self, request: Request) -> ResponseValue:
+    def do_relations(
+        self, request: Request, pk: str | None, relation: str
+    ) -> ResponseValue:
+        """Page of the incoming relations of one name of an entity, beyond those
+        included in the item"""
+        order = request.query_params.get("order", "label")
+        if order not in RELATION_ORDERINGS:
+            return ResponseValue(
+                {"detail": f"order must be one of: {', '.join(RELATION_ORDERINGS)}"},
+                status=400,
+            )
         try:
-            v = validate(
-                instance=request.data,
-                schema=PROS_MODELS[self.__model_class__.__name__.lower()].json_schema,
+            limit = int(request.query_params.get("limit") or RELATION_PAGE_SIZE)
+            after = request.query_params.get("after")
+            after = decode_list_cursor(after) if after else None
+        except ValueError as e:
+            return ResponseValue({"detail": str(e)}, status=400)
+
+        page = get_relation_page(
+            pk,
+            relation,
+            order=order,
+            after=after,
+            limit=max(1, min(limit, RELATION_PAGE_SIZE_MAX)),
+            related_fields=parse_fields_param(
+                request.query_params.get("related_fields"), DEFAULT_RELATED_FIELDS
+            ),
+        )
+        if page is None:
+            return ResponseValue(
+                f"<{self.__model_class__.__name__} uid={pk}> not found.", 404
             )
-        except ValidationError as e:
-            return ResponseValue(data=e, status=400)
+        if page["next"]:
+            page["next"] = encode_list_cursor(*page["next"])
+        return ResponseValue(page)
+
+    def relations(
+        self, request: Request, pk: str | None = None, relation: str = ""
+    ) -> Response:
+        return Response(**self.do_relations(request, pk, relation))
+
+    @db.write_transaction
+    def do_create(self, request: Request) -> ResponseValue:
+        if error := validate_instance(
+            PROS_MODELS[self.__model_class__.__name__.lower()], request.data
+        ):
+            return ResponseValue(data=error, status=400)
 
         (
             property_data,
@@ -844,28 +963,42 @@ class ProsDefaultViewSet(ProsAbstractViewSet):
             "modifiedWhen": datetime.datetime.now(datetime.timezone.utc),
         }
 
-        instance = self.__model_class__(**property_data)
-        instance.save()
+        properties = create_entity(
+            self.__model_class__,
+            property_data,
+            relation_data,
+            get_inline_node_data(inline_relation_data),
+        )
+        labels = refresh_template_labels({properties["uid"]})
 
-        add_related_nodes(self.__model_class__, instance, relation_data)
-        add_inline_related_nodes(self.__model_class__, instance, inline_relation_data)
+        record_entity_changes(
+            {properties["uid"]: change_log.CREATE},
+            get_affected_uids({properties["uid"]}),
+        )
 
         return ResponseValue(
-            {"uid": instance.uid, "label": instance.label, "saved": True}
+            {
+                "uid": properties["uid"],
+                "label": labels.get(properties["uid"], properties.get("label")),
+                "saved": True,
+            }
         )
 
     def create(self, request: Request) -> Response:
-        return Response(**self.do_create(request))
+        try:
+            return Response(**self.do_create(request))
+        except DoesNotExist as e:
+            # Raised out of the transaction, so that it is rolled back
+            return Response(e.message, status=400)
+        except AttemptedCardinalityViolation as e:
+            return Response(str(e), status=400)
 
     @db.write_transaction
     def do_update(self, request: Request, pk: str | None) -> ResponseValue:
-        try:
-            v = validate(
-                instance=request.data,
-                schema=PROS_MODELS[self.__model_class__.__name__.lower()].json_schema,
-            )
-        except ValidationError as e:
-            return ResponseValue(data=e, status=400)
+        if error := validate_instance(
+            PROS_MODELS[self.__model_class__.__name__.lower()], request.data
+        ):
+            return ResponseValue(data=error, status=400)
 
         (
             property_data,
@@ -879,22 +1012,33 @@ class ProsDefaultViewSet(ProsAbstractViewSet):
             "modifiedBy": request.user.username,
             "modifiedWhen": datetime.datetime.now(datetime.timezone.utc),
         }
-        ic(relation_data)
-        instance: ProsNode = self.__model_class__.nodes.get(uid=pk)
+        # Nodes that are no longer related after the update are affected too
+        affected_uids = get_affected_uids({pk})
 
-        for property_key, property_value in property_data.items():
-            setattr(instance, property_key, property_value)
-        instance.save()
+        update_entity(
+            self.__model_class__,
+            pk,
+            property_data,
+            relation_data,
+            get_inline_node_data(inline_relation_data),
+            request.user.username,
+        )
+        refresh_template_labels({pk})
 
-        update_related_nodes(self.__model_class__, instance, relation_data)
-        update_inline_related_nodes(
-            instance, inline_relation_data, request.user.username
+        record_entity_changes(
+            {pk: change_log.UPDATE}, affected_uids | get_affected_uids({pk})
         )
 
         return ResponseValue({"uid": pk, "saved": True})
 
     def update(self, request, pk=None):
-        return Response(**self.do_update(request, pk))
+        try:
+            return Response(**self.do_update(request, pk))
+        except DoesNotExist as e:
+            # Raised out of the transaction, so that it is rolled back
+            return Response(e.message, status=400)
+        except AttemptedCardinalityViolation as e:
+            return Response(str(e), status=400)
 
     @db.write_transaction
     def do_delete(self, request: Request, pk: str | None) -> ResponseValue:
@@ -904,6 +1048,7 @@ class ProsDefaultViewSet(ProsAbstractViewSet):
                 instance.is_deleted = False
                 instance.modifiedWhen = datetime.datetime.now(datetime.timezone.utc)
                 instance.save()
+                record_entity_changes({pk: change_log.RESTORE}, get_affected_uids({pk}))
 
             return ResponseValue(
                 {
@@ -914,11 +1059,13 @@ class ProsDefaultViewSet(ProsAbstractViewSet):
 
         try:
             instance: ProsNode = self.__model_class__.nodes.get(uid=pk)
-            if instance.has_dependent_relations():
+            # Counted live: a stale counter must not lead to a hard delete
+            if instance.has_dependent_relations(live=True):
 
                 instance.is_deleted = True
                 instance.modifiedWhen = datetime.datetime.now(datetime.timezone.utc)
                 instance.save()
+                record_entity_changes({pk: change_log.UPDATE}, get_affected_uids({pk}))
                 return ResponseValue(
                     {
                         "detail": (
@@ -929,6 +1076,7 @@ class ProsDefaultViewSet(ProsAbstractViewSet):
                     }
                 )
             else:
+                affected_uids = get_affected_uids({pk})
                 delete_all_inline_nodes(instance)
                 d = DeletedNode(
                     uid=instance.uid,
@@ -941,7 +1089,13 @@ class ProsDefaultViewSet(ProsAbstractViewSet):
                     deletedWhen=datetime.datetime.now(datetime.timezone.utc),
                 )
                 d.save()
+                merge_cluster = get_merge_cluster(pk)
                 instance.delete()
+                # Deleting a merged node may split its merge cluster
+                refresh_merge_cluster(merge_cluster)
+                record_entity_changes(
+                    {pk: change_log.DELETE}, affected_uids, types={pk: d.type}
+                )
 
                 return ResponseValue(
                     {
@@ -955,6 +1109,40 @@ class ProsDefaultViewSet(ProsAbstractViewSet):
     def delete(self, request: Request, pk: str | None = None):
         return Response(**self.do_delete(request, pk))
 
+    @db.write_transaction
+    def do_merge(self, request: Request, pk: str | None, other: str) -> ResponseValue:
+        """Mark the entity as the same as another, joining their merge clusters"""
+        if pk == other:
+            return ResponseValue(
+                {"detail": "An entity cannot be merged with itself", "result": "fail"},
+                status=400,
+            )
+        if not self.__model_class__.nodes.get_or_none(uid=pk):
+            return ResponseValue({"detail": "Not found", "result": "fail"}, status=404)
+        if (cluster := merge_nodes(pk, other)) is None:
+            return ResponseValue(
+                {"detail": f"Entity {other} not found", "result": "fail"}, status=404
+            )
+        return ResponseValue({"result": "success", "merge_cluster": cluster})
+
+    def merge(self, request: Request, pk: str | None = None, other: str = ""):
+        return Response(**self.do_merge(request, pk, other))
+
+    @db.write_transaction
+    def do_unmerge(self, request: Request, pk: str | None, other: str) -> ResponseValue:
+        """Remove the merge between the entity and another, splitting their merge
+        cluster if they are no longer connected"""
+        cluster = get_merge_cluster(pk)
+        if cluster is None or cluster != get_merge_cluster(other):
+            return ResponseValue(
+                {"detail": "Entities are not merged", "result": "fail"}, status=404
+            )
+        unmerge_nodes(pk, other)
+        return ResponseValue({"result": "success", "merge_cluster": get_merge_cluster(pk)})
+
+    def unmerge(self, request: Request, pk: str | None = None, other: str = ""):
+        return Response(**self.do_unmerge(request, pk, other))
+
 
 def generic_viewset_factory(
     app_model,
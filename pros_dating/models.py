@@ -51,7 +51,7 @@ class PreciseDate(SingleDate):
 
     date = IncompleteDateProperty()
 
-    def save(self):
+    def pre_save(self):
         self.earliest_possible = parse_date(
             self.date, default=datetime.date(1, 1, 1)
         )  # Set the internal date
@@ -63,14 +63,14 @@ class PreciseDate(SingleDate):
             self.date, default=datetime.date(1, 1, 1)
         )
 
-        super().save()
+        super().pre_save()
 
 
 class ImpreciseDate(SingleDate):
     not_before = IncompleteDateProperty()
     not_after = IncompleteDateProperty()
 
-    def save(self):
+    def pre_save(self):
         self.earliest_possible = parse_date(
             self.not_before, default=datetime.date(1, 1, 1)
         )  # Set the internal date
@@ -84,14 +84,14 @@ class ImpreciseDate(SingleDate):
             self.not_after, default=datetime.date(1, 1, 1)
         )
 
-        super().save()
+        super().pre_save()
 
 
 class PreciseDateRange(DateRange):
     start = IncompleteDateProperty()
     end = IncompleteDateProperty()
 
-    def save(self):
+    def pre_save(self):
         self.earliest_possible = parse_date(
             self.start, default=datetime.date(1, 1, 1)
         )  # Set the internal date
@@ -103,7 +103,7 @@ class PreciseDateRange(DateRange):
             self.end, default=datetime.date(1, 1, 1)
         )
 
-        super().save()
+        super().pre_save()
 
 
 class ImpreciseDateRange(DateRange):
@@ -112,7 +112,7 @@ class ImpreciseDateRange(DateRange):
     end_not_before = IncompleteDateProperty()
     end_not_after = IncompleteDateProperty()
 
-    def save(self):
+    def pre_save(self):
         self.earliest_possible = parse_date(
             self.start_not_before, default=datetime.date(1, 1, 1)
         )  # Set the internal date
@@ -126,4 +126,4 @@ class ImpreciseDateRange(DateRange):
             self.end_not_before, default=datetime.date(1, 1, 1)
         )
 
-        super().save()
+        super().pre_save()
@@ -1,11 +1,30 @@
 from django.conf import settings
-from neomodel import StructuredNode, Relationship
+from neomodel import StructuredNode, Relationship, config, db
 from neomodel.properties import StringProperty, BooleanProperty
-from neomodel.relationship_manager import ZeroOrMore
+from neomodel.relationship_manager import ZeroOrMore, _counts_inbound
 from slugify import slugify
 
+from pros_core.outbox import build_event, outbox_handler
+
 from icecream import ic
 
+CREATE_INTERNAL_URIS = "pros_uris.create_internal"
+
+NODES_WITHOUT_INTERNAL_URI_QUERY = """
+MATCH (n:ProsNode) WHERE n.uid IN $uids
+AND NOT (n)-[:uri]->(:URI {internal: true})
+RETURN n
+"""
+
+WRITE_INTERNAL_URIS_QUERY = f"""
+UNWIND $uris AS row
+MATCH (n:ProsNode {{uid: row.uid}})
+CREATE (n)-[:uri]->(u:URI {{uri: row.uri, internal: true}})
+FOREACH (_ IN CASE WHEN $counts_inbound THEN [1] ELSE [] END |
+    SET u.{config.INBOUND_COUNT_PROPERTY} = 1
+)
+"""
+
 
 def build_uri(instance):
     uri = settings.INTERAL_URI_BASE
@@ -26,19 +45,37 @@ class URI(StructuredNode):
 
 class DefaultUriMixin:
     """Mixin to add default URI construction to a ProsNode class.
-    The mixin should be placed *before* other parent classes."""
+    The mixin should be placed *before* other parent classes.
 
-    uris = Relationship("URI", "uri", cardinality=ZeroOrMore)
+    The internal URI of a new node is created after the request, by the outbox
+    worker (see pros_core.outbox), however the node was created (see
+    ProsNode.post_create)."""
 
-    def save(self, *args, **kwargs):
+    uris = Relationship("URI", "uri", cardinality=ZeroOrMore)
 
-        super().save(*args, **kwargs)
+    @classmethod
+    def outbox_events_on_create(cls, properties):
+        return super().outbox_events_on_create(properties) + [
+            build_event(CREATE_INTERNAL_URIS, {"uid": properties["uid"]})
+        ]
 
-        internal_uri = self.uris.get_or_none(internal=True)
 
-        if not internal_uri:
-            uri_value = build_uri(self)
-            uri = URI(uri=uri_value)
-            uri.save()
-            self.uris.connect(uri)
-            ic(self.uris.get_or_none(internal=True))
+@outbox_handler(CREATE_INTERNAL_URIS)
+@db.write_transaction
+def create_internal_uris(payloads):
+    """Create the internal URIs of the nodes that do not have one yet"""
+    results, meta = db.cypher_query(
+        NODES_WITHOUT_INTERNAL_URI_QUERY,
+        {"uids": list({payload["uid"] for payload in payloads})},
+        resolve_objects=True,
+    )
+    if uris := [
+        {"uid": node.uid, "uri": build_uri(node)} for (node,) in results
+    ]:
+        db.cypher_query(
+            WRITE_INTERNAL_URIS_QUERY,
+            {
+                "uris": uris,
+                "counts_inbound": _counts_inbound(DefaultUriMixin.uris.definition),
+            },
+        )